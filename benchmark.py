@@ -0,0 +1,441 @@
+import argparse
+import json
+import logging
+import os
+import platform
+import re
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+import psutil
+
+from camera_simulator import CameraSimulator
+
+# ------------------- Benchmark Configuration -------------------
+ENCODE_PROFILES = [
+    {'preset': 'ultrafast', 'crf': '23'},
+    {'preset': 'veryfast', 'crf': '23'},
+    {'preset': 'fast', 'crf': '23'},
+    {'preset': 'medium', 'crf': '23'},
+]
+SOURCE_SIZE = '1280x720'
+SOURCE_FPS = 30
+UPLOAD_FILE_COUNT = 20
+UPLOAD_FILE_SIZE = 8 * 1024 * 1024
+RETRIEVAL_OBJECT_COUNT = 2000
+RETRIEVAL_QUERIES = 50
+BENCHMARK_BUCKET = 'benchmark-bucket'
+CAPACITY_MAX_CAMERAS = 16
+CAPACITY_REALTIME_FRACTION = 0.95  # a camera below this share of source fps is falling behind
+STARTUP_RUNS = 5
+STARTUP_BUDGET_SECONDS = 0.5       # median start time allowed for each CLI; restart loops pay it every time
+
+# ------------------- Helpers -------------------
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[rank]
+
+def latency_summary(samples):
+    return {
+        'count': len(samples),
+        'p50_ms': round(percentile(samples, 50) * 1000, 3) if samples else None,
+        'p99_ms': round(percentile(samples, 99) * 1000, 3) if samples else None,
+        'max_ms': round(max(samples) * 1000, 3) if samples else None
+    }
+
+def host_info():
+    return {
+        'platform': platform.platform(),
+        'python': platform.python_version(),
+        'cpu_count': psutil.cpu_count(logical=True),
+        'cpu_physical': psutil.cpu_count(logical=False),
+        'memory_mb': psutil.virtual_memory().total // (1024 * 1024)
+    }
+
+def ffmpeg_available():
+    return shutil.which('ffmpeg') is not None
+
+class ProcessMonitor:
+    """Samples CPU time of a process so CPU% can be reported over a run"""
+    def __init__(self, pid):
+        self.process = psutil.Process(pid)
+        self.last_cpu = 0.0
+        self.start_wall = time.monotonic()
+        self.start_cpu = self._cpu_seconds()
+
+    def _cpu_seconds(self):
+        # Keep the last reading once the process has exited
+        try:
+            times = self.process.cpu_times()
+            self.last_cpu = times.user + times.system
+        except psutil.Error:
+            pass
+        return self.last_cpu
+
+    def cpu_percent(self):
+        """Percent of one core, averaged since the monitor was created"""
+        elapsed = time.monotonic() - self.start_wall
+        if elapsed <= 0:
+            return 0.0
+        return (self._cpu_seconds() - self.start_cpu) / elapsed * 100
+
+# ------------------- Local S3 Stand-in -------------------
+class LocalS3:
+    """A moto S3 server on a free local port"""
+    def __init__(self):
+        from moto.server import ThreadedMotoServer
+        # Keep moto's per-request access log out of the report output
+        logging.getLogger('werkzeug').setLevel(logging.WARNING)
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+            s.bind(('127.0.0.1', 0))
+            self.port = s.getsockname()[1]
+        self.server = ThreadedMotoServer(ip_address='127.0.0.1', port=self.port, verbose=False)
+
+    @property
+    def endpoint_url(self):
+        return f"http://127.0.0.1:{self.port}"
+
+    def start(self):
+        self.server.start()
+        return self
+
+    def stop(self):
+        self.server.stop()
+
+    def backend(self):
+        from storage_backend import S3CompatibleBackend
+        return S3CompatibleBackend(BENCHMARK_BUCKET, self.endpoint_url, access_key='benchmark', secret_key='benchmark')
+
+    def create_bucket(self):
+        self.backend().client.create_bucket(Bucket=BENCHMARK_BUCKET)
+
+    def configure(self, module):
+        module.STORAGE_BACKEND = 's3-compatible'
+        module.S3_ENDPOINT_URL = self.endpoint_url
+
+class LocalStore:
+    """A local-directory object store in a temporary folder, for runs without moto"""
+    def __init__(self):
+        self.path = tempfile.mkdtemp(prefix='object_store_')
+
+    def start(self):
+        return self
+
+    def stop(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def backend(self):
+        from storage_backend import LocalBackend
+        return LocalBackend(os.path.join(self.path, BENCHMARK_BUCKET))
+
+    def create_bucket(self):
+        os.makedirs(os.path.join(self.path, BENCHMARK_BUCKET), exist_ok=True)
+
+    def configure(self, module):
+        module.STORAGE_BACKEND = 'local'
+        module.LOCAL_STORE_PATH = self.path
+
+STORES = {'moto': LocalS3, 'local': LocalStore}
+
+def point_recorder_at(store):
+    """Import index.py with its storage settings aimed at the stand-in"""
+    import index
+    index.AWS_ACCESS_KEY_ID = 'benchmark'
+    index.AWS_SECRET_ACCESS_KEY = 'benchmark'
+    index.AWS_REGION = 'us-east-1'
+    index.S3_BUCKET_NAME = BENCHMARK_BUCKET
+    store.configure(index)
+    return index
+
+# ------------------- Encode Benchmark -------------------
+def run_ffmpeg_measured(command, duration, stop_gracefully):
+    """Run ffmpeg, discard its stdout, and report fps, CPU% and output MB/s"""
+    process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    monitor = ProcessMonitor(process.pid)
+    output_bytes = 0
+    stderr_chunks = []
+
+    def drain_stdout():
+        nonlocal output_bytes
+        while True:
+            chunk = process.stdout.read1(65536)
+            if not chunk:
+                break
+            output_bytes += len(chunk)
+
+    def drain_stderr():
+        for chunk in iter(lambda: process.stderr.read1(4096), b''):
+            stderr_chunks.append(chunk)
+
+    readers = [threading.Thread(target=drain_stdout, daemon=True),
+               threading.Thread(target=drain_stderr, daemon=True)]
+    for reader in readers:
+        reader.start()
+    started = time.monotonic()
+    cpu_samples = []
+    while process.poll() is None and time.monotonic() - started < duration:
+        time.sleep(0.5)
+        cpu_samples.append(monitor.cpu_percent())
+    if process.poll() is None and stop_gracefully:
+        try:
+            process.stdin.write(b'q\n')
+            process.stdin.flush()
+        except OSError:
+            pass
+    try:
+        process.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+    elapsed = time.monotonic() - started
+    for reader in readers:
+        reader.join(timeout=5)
+    stderr = b''.join(stderr_chunks).decode('utf-8', errors='replace')
+    frames = re.findall(r'frame=\s*(\d+)', stderr)
+    frame_count = int(frames[-1]) if frames else 0
+    return {
+        'seconds': round(elapsed, 3),
+        'frames': frame_count,
+        'fps': round(frame_count / elapsed, 2) if elapsed else 0,
+        'cpu_percent': round(cpu_samples[-1], 1) if cpu_samples else None,
+        'cpu_percent_of_host': round(cpu_samples[-1] / psutil.cpu_count(), 1) if cpu_samples else None,
+        'output_mb_per_s': round(output_bytes / elapsed / 1e6, 3) if elapsed else 0,
+        'returncode': process.returncode
+    }
+
+def benchmark_encode(duration):
+    """Time build_ffmpeg_command's encode against a live stand-in camera and at full speed"""
+    if not ffmpeg_available():
+        return {'skipped': 'ffmpeg not found'}
+    import index
+    simulator = CameraSimulator(cameras=1, size=SOURCE_SIZE, fps=SOURCE_FPS).start()
+    results = []
+    try:
+        selected_camera = ((simulator.video_url(1), simulator.audio_url(1)), 0)
+        for profile in ENCODE_PROFILES:
+            live_command, _ = index.build_ffmpeg_command(selected_camera, 'pipe:1', profile)
+            live = run_ffmpeg_measured(live_command, duration, stop_gracefully=True)
+            # Same encode arguments on a lavfi source without -re: how fast can this host go?
+            encode_args = live_command[live_command.index('-c:v'):]
+            capacity_command = [
+                'ffmpeg', '-y', '-loglevel', 'info',
+                '-f', 'lavfi', '-i', f'testsrc=size={SOURCE_SIZE}:rate={SOURCE_FPS}',
+                '-f', 'lavfi', '-i', 'sine=frequency=440:sample_rate=48000',
+                '-t', str(duration)
+            ] + encode_args
+            capacity = run_ffmpeg_measured(capacity_command, duration * 10, stop_gracefully=False)
+            realtime_factor = capacity['fps'] / SOURCE_FPS if capacity['fps'] else 0
+            results.append({
+                'profile': profile,
+                'live_camera': live,
+                'max_speed': capacity,
+                'cameras_per_host_estimate': round(realtime_factor, 2)
+            })
+    finally:
+        simulator.stop()
+    return {'source': {'size': SOURCE_SIZE, 'fps': SOURCE_FPS}, 'profiles': results}
+
+# ------------------- Camera Capacity Benchmark -------------------
+def benchmark_capacity(duration, max_cameras=CAPACITY_MAX_CAMERAS):
+    """Record 1..N simulated cameras at once until any of them falls behind realtime"""
+    if not ffmpeg_available():
+        return {'skipped': 'ffmpeg not found'}
+    import index
+    steps = []
+    supported = 0
+    for camera_count in range(1, max_cameras + 1):
+        simulator = CameraSimulator(cameras=camera_count, size=SOURCE_SIZE, fps=SOURCE_FPS).start()
+        runs = [None] * camera_count
+        try:
+            def record(slot):
+                selected_camera = ((simulator.video_url(slot + 1), simulator.audio_url(slot + 1)), 0)
+                command, _ = index.build_ffmpeg_command(selected_camera, 'pipe:1')
+                runs[slot] = run_ffmpeg_measured(command, duration, stop_gracefully=True)
+            threads = [threading.Thread(target=record, args=(slot,)) for slot in range(camera_count)]
+            host_cpu = psutil.cpu_percent(interval=None)
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            host_cpu = psutil.cpu_percent(interval=None)
+        finally:
+            simulator.stop()
+        # A run with no fps reading never produced frames, so it is not keeping up
+        slowest_fps = min(run['fps'] or 0 for run in runs)
+        keeping_up = slowest_fps >= SOURCE_FPS * CAPACITY_REALTIME_FRACTION
+        steps.append({'cameras': camera_count, 'slowest_fps': slowest_fps,
+                      'host_cpu_percent': host_cpu, 'keeping_up': keeping_up})
+        if not keeping_up:
+            break
+        supported = camera_count
+    return {'source': {'size': SOURCE_SIZE, 'fps': SOURCE_FPS}, 'supported_cameras': supported, 'steps': steps}
+
+# ------------------- Upload Benchmark -------------------
+def benchmark_upload(file_count=UPLOAD_FILE_COUNT, file_size=UPLOAD_FILE_SIZE, store='moto'):
+    """Push synthetic recordings through S3UploadScheduler into a local stand-in store"""
+    local_store = STORES[store]().start()
+    work_dir = tempfile.mkdtemp(prefix='upload_bench_')
+    try:
+        local_store.create_bucket()
+        index = point_recorder_at(local_store)
+        index.KEEP_LOCAL_AFTER_UPLOAD = False
+        scheduler = index.S3UploadScheduler()
+        latencies = []
+        original_upload = scheduler._upload_file
+
+        def timed_upload(*args, **kwargs):
+            started = time.perf_counter()
+            original_upload(*args, **kwargs)
+            latencies.append(time.perf_counter() - started)
+        scheduler._upload_file = timed_upload
+
+        payload = os.urandom(file_size)
+        base_time = datetime(2024, 1, 1, 12, 0, 0)
+        for i in range(file_count):
+            start = base_time + timedelta(minutes=i)
+            file_name = index.generate_filename(start, start + timedelta(seconds=59))
+            with open(os.path.join(work_dir, file_name), 'wb') as f:
+                f.write(payload)
+        scheduler.start_scheduler()
+        started = time.perf_counter()
+        for file_name in sorted(os.listdir(work_dir)):
+            scheduler.queue_upload(os.path.join(work_dir, file_name))
+        scheduler.upload_queue.join()
+        elapsed = time.perf_counter() - started
+        scheduler.stop_scheduler()
+        total_bytes = file_count * file_size
+        return {
+            'files': file_count,
+            'file_size_mb': round(file_size / 1e6, 3),
+            'seconds': round(elapsed, 3),
+            'mb_per_s': round(total_bytes / elapsed / 1e6, 3),
+            'files_per_s': round(file_count / elapsed, 3),
+            'per_file_latency': latency_summary(latencies)
+        }
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+        local_store.stop()
+
+# ------------------- Retrieval Benchmark -------------------
+def make_test_video(path, seconds=20):
+    subprocess.run([
+        'ffmpeg', '-y', '-loglevel', 'error',
+        '-f', 'lavfi', '-i', f'testsrc=size={SOURCE_SIZE}:rate={SOURCE_FPS}',
+        '-f', 'lavfi', '-i', 'sine=frequency=440:sample_rate=48000',
+        '-t', str(seconds), '-c:v', 'libx264', '-preset', 'ultrafast', '-c:a', 'aac', path
+    ], check=True)
+
+def benchmark_retrieval(object_count=RETRIEVAL_OBJECT_COUNT, queries=RETRIEVAL_QUERIES, store='moto'):
+    """Time downloader.list_videos over a populated bucket and crop_video on a real file"""
+    local_store = STORES[store]().start()
+    work_dir = tempfile.mkdtemp(prefix='retrieval_bench_')
+    try:
+        local_store.create_bucket()
+        backend = local_store.backend()
+        import downloader
+        downloader.storage = backend
+        downloader.BUCKET_NAME = BENCHMARK_BUCKET
+        index = point_recorder_at(local_store)
+        base_time = datetime(2024, 1, 1, 0, 0, 0)
+        for i in range(object_count):
+            start = base_time + timedelta(minutes=5 * i)
+            key = index.s3_key_for(index.generate_filename(start, start + timedelta(minutes=5), 'bench-camera'))
+            backend.put(key, b'')
+        span_ms = object_count * 5 * 60 * 1000
+        base_ms = int(base_time.timestamp() * 1000)
+        list_latencies = []
+        for q in range(queries):
+            query_start = base_ms + (span_ms * q) // queries
+            started = time.perf_counter()
+            downloader.list_videos(query_start, query_start + 10 * 60 * 1000)
+            list_latencies.append(time.perf_counter() - started)
+        results = {'objects': object_count, 'list_videos': latency_summary(list_latencies)}
+
+        if ffmpeg_available():
+            source = os.path.join(work_dir, 'source.mp4')
+            make_test_video(source)
+            crop_latencies = []
+            for q in range(min(queries, 20)):
+                started = time.perf_counter()
+                downloader.crop_video(source, os.path.join(work_dir, 'crop.mp4'), q % 10, q % 10 + 5)
+                crop_latencies.append(time.perf_counter() - started)
+            results['crop_video'] = latency_summary(crop_latencies)
+        else:
+            results['crop_video'] = {'skipped': 'ffmpeg not found'}
+        return results
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+        local_store.stop()
+
+# ------------------- Startup Benchmark -------------------
+STARTUP_COMMANDS = {
+    'index_import': [sys.executable, '-c', 'import index'],
+    'index_help': [sys.executable, 'index.py', '--help'],
+    'downloader_help': [sys.executable, 'downloader.py', '--help'],
+}
+
+def benchmark_startup(runs=STARTUP_RUNS, budget=STARTUP_BUDGET_SECONDS):
+    """Time each CLI from process start to exit against the startup budget"""
+    repo_dir = os.path.dirname(os.path.abspath(__file__))
+    results = {'budget_ms': budget * 1000}
+    for name, command in STARTUP_COMMANDS.items():
+        samples = []
+        for _ in range(runs):
+            started = time.perf_counter()
+            subprocess.run(command, cwd=repo_dir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+            samples.append(time.perf_counter() - started)
+        results[name] = dict(latency_summary(samples), within_budget=percentile(samples, 50) <= budget)
+    # Importing the recorder must not load boto3, which is what used to tie startup to the network
+    probe = subprocess.run([sys.executable, '-c', "import sys, index; print('boto3' in sys.modules)"],
+                           cwd=repo_dir, capture_output=True, text=True, check=True)
+    results['index_imports_boto3'] = probe.stdout.strip().endswith('True')
+    return results
+
+# ------------------- Main -------------------
+BENCHMARKS = {
+    'encode': lambda args: benchmark_encode(args.duration),
+    'capacity': lambda args: benchmark_capacity(args.duration),
+    'upload': lambda args: benchmark_upload(store=args.store),
+    'retrieval': lambda args: benchmark_retrieval(store=args.store),
+    'startup': lambda args: benchmark_startup(),
+}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the recording, upload and retrieval hot paths.")
+    parser.add_argument('benchmarks', nargs='*', metavar='BENCHMARK',
+                        help=f"benchmarks to run: {', '.join(BENCHMARKS)} (default: all)")
+    parser.add_argument('--duration', type=float, default=10, help='seconds per encode run (default: %(default)s)')
+    parser.add_argument('--output', help='write the JSON report here instead of stdout')
+    parser.add_argument('--store', choices=sorted(STORES), default='moto',
+                        help='object store the upload and retrieval benchmarks use (default: %(default)s)')
+    args = parser.parse_args(argv)
+    unknown = [name for name in args.benchmarks if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"unknown benchmark(s): {', '.join(unknown)}")
+    selected = args.benchmarks or list(BENCHMARKS)
+    report = {'timestamp': datetime.now().isoformat(), 'host': host_info(), 'results': {}}
+    for name in selected:
+        print(f"Running {name} benchmark...", file=sys.stderr)
+        try:
+            report['results'][name] = BENCHMARKS[name](args)
+        except Exception as e:
+            report['results'][name] = {'error': str(e)}
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+        print(f"Report written to {args.output}", file=sys.stderr)
+    else:
+        print(output)
+
+if __name__ == "__main__":
+    main()
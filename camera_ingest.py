@@ -0,0 +1,458 @@
+import logging
+import queue
+import ssl
+import threading
+import time
+import urllib.request
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, urlunsplit
+
+# ------------------- Ingest Configuration -------------------
+INGEST_HOST = '127.0.0.1'
+INGEST_CONNECT_TIMEOUT = 5           # seconds a new subscriber waits for the camera to answer
+INGEST_READ_TIMEOUT = 10             # seconds without data before the upstream connection is reopened
+INGEST_RECONNECT_MAX_BACKOFF = 30
+INGEST_DIRECT_RETRY_SECONDS = 300    # a camera the relay cannot reach is read directly for this long before trying again
+INGEST_VERIFY_TLS = False            # cameras mostly use self-signed certificates, which ffmpeg does not check either
+INGEST_IDLE_SECONDS = 15             # upstream stays open this long after the last subscriber leaves
+INGEST_SUBSCRIBER_QUEUE = 120        # frames or pages buffered per subscriber before it starts dropping
+INGEST_CHUNK_SIZE = 64 * 1024
+INGEST_BOUNDARY = 'ingestframe'
+CLOCK_WINDOW_SECONDS = 10            # audio clock lag is the minimum seen over each window this long
+ADTS_SAMPLE_RATES = [96000, 88200, 64000, 48000, 44100, 32000, 24000, 22050, 16000, 12000, 11025, 8000, 7350]
+
+logger = logging.getLogger('camera_ingest')
+
+# ------------------- Stream Framing -------------------
+# Each framer reads one self-contained unit from the upstream response, so a
+# subscriber that joins mid-stream always starts on a unit boundary. Units are
+# returned as (data, is_header, seconds of audio in the unit or None).
+class MjpegFramer:
+    """multipart/x-mixed-replace JPEG frames, republished with a fixed boundary"""
+    content_type = f'multipart/x-mixed-replace; boundary={INGEST_BOUNDARY}'
+    resumable = True
+
+    def __init__(self, boundary=None):
+        self.boundary = (boundary or '').strip('"').lstrip('-').encode('latin-1')
+        self.pending_line = None
+
+    def _is_boundary(self, line):
+        return line.startswith(b'--') and line.lstrip(b'-').startswith(self.boundary)
+
+    def _readline(self, stream):
+        line, self.pending_line = self.pending_line, None
+        return line or stream.readline()
+
+    def read_unit(self, stream):
+        line = self._readline(stream)
+        while line and not self._is_boundary(line):
+            line = stream.readline()
+        if not line:
+            return None
+        content_length = None
+        while True:
+            line = stream.readline()
+            if not line:
+                return None
+            if line in (b'\r\n', b'\n'):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            if name.strip().lower() == 'content-length' and value.strip().isdigit():
+                content_length = int(value.strip())
+        if content_length is not None:
+            frame = stream.read(content_length)
+            if len(frame) < content_length:
+                return None
+        else:
+            # No length given: the frame runs until the next boundary line
+            lines = []
+            while True:
+                line = stream.readline()
+                if not line:
+                    return None
+                if self._is_boundary(line):
+                    self.pending_line = line
+                    break
+                lines.append(line)
+            frame = b''.join(lines).rstrip(b'\r\n')
+        part = f"--{INGEST_BOUNDARY}\r\nContent-Type: image/jpeg\r\nContent-Length: {len(frame)}\r\n\r\n"
+        return part.encode() + frame + b"\r\n", False, None
+
+class OggFramer:
+    """Ogg pages; the granule-0 header pages are replayed to late subscribers"""
+    content_type = 'audio/ogg'
+    resumable = False   # a new connection starts a new logical stream with new headers
+
+    def __init__(self):
+        self.sample_rate = None
+        self.granule = 0
+
+    def read_unit(self, stream):
+        header = stream.read(27)
+        if len(header) < 27 or header[:4] != b'OggS':
+            return None
+        table = stream.read(header[26])
+        body_length = sum(table)
+        body = stream.read(body_length)
+        if len(table) < header[26] or len(body) < body_length:
+            return None
+        granule = int.from_bytes(header[6:14], 'little')
+        if granule == 0:
+            if body.startswith(b'OpusHead'):
+                self.sample_rate = 48000   # Opus granules always count 48 kHz samples
+            elif body[1:7] == b'vorbis' and body[0] == 1:
+                self.sample_rate = int.from_bytes(body[12:16], 'little')
+            return header + table + body, True, None
+        duration = None
+        # All ones means no packet ends on this page
+        if self.sample_rate and granule != 0xFFFFFFFFFFFFFFFF and granule > self.granule:
+            duration = (granule - self.granule) / self.sample_rate
+            self.granule = granule
+        return header + table + body, False, duration
+
+class AdtsFramer:
+    """ADTS AAC frames, each carrying its own header"""
+    content_type = 'audio/aac'
+    resumable = True
+
+    def read_unit(self, stream):
+        header = stream.read(7)
+        if len(header) < 7 or header[0] != 0xFF or header[1] & 0xF0 != 0xF0:
+            return None
+        frame_length = ((header[3] & 0x03) << 11) | (header[4] << 3) | (header[5] >> 5)
+        if frame_length < 7:
+            return None
+        body = stream.read(frame_length - 7)
+        if len(body) < frame_length - 7:
+            return None
+        rate_index = (header[2] >> 2) & 0x0F
+        duration = None
+        if rate_index < len(ADTS_SAMPLE_RATES):
+            duration = 1024 * ((header[6] & 0x03) + 1) / ADTS_SAMPLE_RATES[rate_index]
+        return header + body, False, duration
+
+class RawFramer:
+    """Unknown formats are passed through as they arrive"""
+    resumable = False
+
+    def __init__(self, content_type):
+        self.content_type = content_type or 'application/octet-stream'
+
+    def read_unit(self, stream):
+        chunk = stream.read1(INGEST_CHUNK_SIZE)
+        return (chunk, False, None) if chunk else None
+
+def framer_for(response):
+    """Pick a framer from the first bytes of the response, falling back to its Content-Type"""
+    head = response.peek(4)[:4]
+    content_type = response.headers.get_content_type()
+    if head == b'OggS':
+        return OggFramer()
+    if len(head) >= 2 and head[0] == 0xFF and head[1] & 0xF0 == 0xF0:
+        return AdtsFramer()
+    if content_type.startswith('multipart/') or head.startswith(b'--'):
+        return MjpegFramer(response.headers.get_param('boundary'))
+    return RawFramer(response.headers.get('Content-Type'))
+
+def redact(url):
+    parts = urlsplit(url)
+    if parts.username is None:
+        return url
+    return urlunsplit(parts._replace(netloc=parts.hostname + (f':{parts.port}' if parts.port else '')))
+
+def open_upstream(url):
+    """Open url, answering with any user:password in it as HTTP basic or digest auth, as the camera asks"""
+    parts = urlsplit(url)
+    context = None if INGEST_VERIFY_TLS else ssl._create_unverified_context()
+    handlers = [urllib.request.HTTPSHandler(context=context)]
+    if parts.username is not None:
+        url = redact(url)
+        passwords = urllib.request.HTTPPasswordMgrWithPriorAuth()
+        # Basic credentials go with the first request, as cameras that never send a challenge expect
+        passwords.add_password(None, url, parts.username, parts.password or '', is_authenticated=True)
+        handlers += [urllib.request.HTTPBasicAuthHandler(passwords), urllib.request.HTTPDigestAuthHandler(passwords)]
+    return urllib.request.build_opener(*handlers).open(url, timeout=INGEST_READ_TIMEOUT)
+
+# ------------------- Clock Tracking -------------------
+class ClockTracker:
+    """How far a stream's sample clock lags the wall clock it arrives on.
+
+    Audio arrives in bursts, so the lag of any one unit is mostly network and
+    buffering delay. The minimum over each CLOCK_WINDOW_SECONDS window is
+    steady, and how it changes over time is the camera clock's drift, plus
+    any audio the camera dropped.
+    """
+    def __init__(self):
+        self.connection = 0
+        self.reset()
+
+    def reset(self):
+        """Start over; lags from before and after a reset are not comparable"""
+        self.connection += 1
+        self.media_time = 0.0
+        self.window_start = None
+        self.window_min = None
+        self.lag = None
+
+    def add(self, duration, arrival):
+        self.media_time += duration
+        lag = arrival - self.media_time
+        if self.window_start is None or arrival - self.window_start >= CLOCK_WINDOW_SECONDS:
+            if self.window_min is not None:
+                self.lag = self.window_min
+            self.window_start = arrival
+            self.window_min = lag
+        else:
+            self.window_min = min(self.window_min, lag)
+
+# ------------------- Stream Relay -------------------
+class StreamRelay:
+    """One upstream HTTP connection fanned out to any number of local subscribers.
+
+    The connection is opened when the first subscriber arrives, reopened with
+    backoff if it drops, and closed INGEST_IDLE_SECONDS after the last one
+    leaves. Each subscriber has its own bounded queue, so a slow reader
+    loses units rather than holding up the others.
+    """
+    def __init__(self, url):
+        self.url = url
+        self.subscribers = []
+        self.headers = []
+        self.content_type = None
+        self.connected = threading.Event()
+        self.lock = threading.Lock()
+        self.thread = None
+        self.response = None
+        self.stopped = threading.Event()
+        self.idle_since = time.monotonic()
+        self.clock = ClockTracker()
+        self.stats = {'connections': 0, 'units': 0, 'dropped': 0, 'errors': 0}
+
+    def subscribe(self):
+        subscriber = queue.Queue(maxsize=INGEST_SUBSCRIBER_QUEUE)
+        with self.lock:
+            for unit in self.headers:
+                subscriber.put_nowait(unit)
+            self.subscribers.append(subscriber)
+            if self.thread is None and not self.stopped.is_set():
+                self.thread = threading.Thread(target=self._run, daemon=True)
+                self.thread.start()
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            if subscriber in self.subscribers:
+                self.subscribers.remove(subscriber)
+            if not self.subscribers:
+                self.idle_since = time.monotonic()
+
+    def check(self):
+        """True once the upstream connection is open, opening it if needed"""
+        subscriber = self.subscribe()
+        try:
+            return self.connected.wait(INGEST_CONNECT_TIMEOUT)
+        finally:
+            self.unsubscribe(subscriber)
+
+    def stop(self):
+        """Close the upstream connection and end every subscriber's stream for good"""
+        self.stopped.set()
+        with self.lock:
+            response, thread = self.response, self.thread
+        if response is not None:
+            try:
+                response.close()
+            except Exception:
+                pass
+        if thread is not None:
+            thread.join(timeout=INGEST_CONNECT_TIMEOUT)
+        self._end_subscribers()
+
+    def _idle(self):
+        if self.stopped.is_set():
+            return True
+        return not self.subscribers and time.monotonic() - self.idle_since >= INGEST_IDLE_SECONDS
+
+    def clock_lag(self):
+        """(connection, seconds) the stream's own clock lags the wall clock, or None for video"""
+        with self.lock:
+            if self.clock.lag is None:
+                return None
+            return self.clock.connection, self.clock.lag
+
+    def _publish(self, unit, is_header, duration):
+        with self.lock:
+            if is_header:
+                self.headers.append(unit)
+            if duration:
+                self.clock.add(duration, time.monotonic())
+            self.stats['units'] += 1
+            for subscriber in self.subscribers:
+                try:
+                    subscriber.put_nowait(unit)
+                except queue.Full:
+                    self.stats['dropped'] += 1
+
+    def _end_subscribers(self):
+        """Close every current subscriber's stream; they reconnect and get the new headers"""
+        with self.lock:
+            for subscriber in self.subscribers:
+                try:
+                    subscriber.get_nowait()
+                except queue.Empty:
+                    pass
+                subscriber.put_nowait(None)
+            self.subscribers = []
+            self.idle_since = time.monotonic()
+
+    def _run(self):
+        backoff = 1
+        while True:
+            with self.lock:
+                if self._idle():
+                    self.thread = None
+                    return
+            try:
+                response = open_upstream(self.url)
+            except Exception as e:
+                self.stats['errors'] += 1
+                logger.warning(f"Cannot connect to {redact(self.url)}: {e}; retrying in {backoff}s")
+                self.stopped.wait(backoff)
+                backoff = min(backoff * 2, INGEST_RECONNECT_MAX_BACKOFF)
+                continue
+            backoff = 1
+            framer = None
+            with self.lock:
+                self.response = response
+            try:
+                with response:
+                    framer = framer_for(response)
+                    with self.lock:
+                        self.headers = []
+                        self.content_type = framer.content_type
+                        self.stats['connections'] += 1
+                        if not framer.resumable:
+                            self.clock.reset()
+                    self.connected.set()
+                    logger.info(f"Ingest connected to {redact(self.url)} ({framer.content_type})")
+                    while True:
+                        unit = framer.read_unit(response)
+                        if unit is None:
+                            break
+                        self._publish(*unit)
+                        with self.lock:
+                            if self._idle():
+                                break
+            except Exception as e:
+                self.stats['errors'] += 1
+                logger.warning(f"Ingest connection to {redact(self.url)} failed: {e}")
+            self.connected.clear()
+            with self.lock:
+                self.response = None
+                self.headers = []
+            if framer is None or not framer.resumable:
+                self._end_subscribers()
+
+# ------------------- Local Server -------------------
+class IngestHandler(BaseHTTPRequestHandler):
+    """GET /<n>/<name> streams the relayed camera URL registered under that path"""
+    protocol_version = 'HTTP/1.0'
+
+    def do_GET(self):
+        relay = self.server.relays.get(self.path.partition('?')[0])
+        if relay is None:
+            self.send_error(404)
+            return
+        subscriber = relay.subscribe()
+        try:
+            if not relay.connected.wait(INGEST_CONNECT_TIMEOUT):
+                self.send_error(502, 'Camera is not reachable')
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', relay.content_type)
+            self.send_header('Cache-Control', 'no-cache')
+            self.end_headers()
+            while True:
+                try:
+                    unit = subscriber.get(timeout=INGEST_READ_TIMEOUT)
+                except queue.Empty:
+                    break
+                if unit is None:
+                    break
+                self.wfile.write(unit)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            relay.unsubscribe(subscriber)
+
+    def log_message(self, format, *args):
+        pass
+
+class IngestHub:
+    """Shared ingest for every camera URL in this process.
+
+    local_url() maps a camera URL to a loopback URL on one local server.
+    However many readers open that loopback URL, the camera sees a single
+    connection. A camera the relay cannot reach, for example because it
+    wants an authentication scheme urllib does not speak, is handed back as
+    its own URL for INGEST_DIRECT_RETRY_SECONDS so ffmpeg reads it directly.
+    """
+    def __init__(self, host=INGEST_HOST, port=0):
+        self.host = host
+        self.port = port
+        self.server = None
+        self.relays = {}
+        self.paths = {}
+        self.direct_until = {}
+        self.lock = threading.Lock()
+
+    def _start(self):
+        self.server = ThreadingHTTPServer((self.host, self.port), IngestHandler)
+        self.server.daemon_threads = True
+        self.server.relays = self.relays
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        logger.info(f"Camera ingest listening on http://{self.host}:{self.server.server_address[1]}")
+
+    def local_url(self, url):
+        """Loopback URL that relays url; anything but reachable http(s) URLs is returned unchanged"""
+        if not isinstance(url, str) or not url.startswith(('http://', 'https://')):
+            return url
+        with self.lock:
+            if time.monotonic() < self.direct_until.get(url, 0):
+                return url
+            if self.server is None:
+                self._start()
+            path = self.paths.get(url)
+            if path is None:
+                name = urlsplit(url).path.rstrip('/').rsplit('/', 1)[-1] or 'stream'
+                path = f"/{len(self.paths) + 1}/{name}"
+                self.paths[url] = path
+                self.relays[path] = StreamRelay(url)
+            relay = self.relays[path]
+            local = f"http://{self.host}:{self.server.server_address[1]}{path}"
+        if not relay.check():
+            logger.warning(f"Ingest cannot reach {redact(url)}; reading it directly for {INGEST_DIRECT_RETRY_SECONDS}s")
+            with self.lock:
+                self.direct_until[url] = time.monotonic() + INGEST_DIRECT_RETRY_SECONDS
+            return url
+        return local
+
+    def clock_lag(self, url):
+        path = self.paths.get(url)
+        return self.relays[path].clock_lag() if path else None
+
+    def stats(self):
+        return {path: dict(relay.stats, upstream=redact(relay.url), subscribers=len(relay.subscribers))
+                for path, relay in list(self.relays.items())}
+
+    def shutdown(self):
+        with self.lock:
+            relays = list(self.relays.values())
+            self.relays.clear()
+            self.paths.clear()
+            if self.server:
+                self.server.shutdown()
+                self.server.server_close()
+                self.server = None
+        for relay in relays:
+            relay.stop()
@@ -0,0 +1,290 @@
+import argparse
+import json
+import random
+import subprocess
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# ------------------- Simulator Configuration -------------------
+DEFAULT_CAMERAS = 4
+DEFAULT_SIZE = '1280x720'
+DEFAULT_FPS = 30
+DEFAULT_PORT = 8090
+BOUNDARY = 'BoundaryString'
+# Video patterns cycled across cameras so streams are distinguishable
+TEST_PATTERNS = ['testsrc2', 'testsrc', 'smptehdbars', 'rgbtestsrc']
+
+# ------------------- Frame Source -------------------
+class FrameSource:
+    """Produces JPEG frames for one simulated camera.
+
+    A single ffmpeg process generates frames at the camera's fps no matter
+    how many clients are connected, like a real camera's encoder. Clients
+    wait on the condition for the next frame.
+    """
+    def __init__(self, pattern, size, fps, quality=5):
+        self.command = [
+            'ffmpeg', '-loglevel', 'error', '-re',
+            '-f', 'lavfi', '-i', f'{pattern}=size={size}:rate={fps}',
+            '-f', 'mpjpeg', '-q:v', str(quality), 'pipe:1'
+        ]
+        self.frame = None
+        self.sequence = 0
+        self.condition = threading.Condition()
+        self.running = False
+        self.process = None
+        self.thread = None
+
+    def start(self):
+        self.running = True
+        self.process = subprocess.Popen(self.command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        self.thread = threading.Thread(target=self._read_frames, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.process:
+            self.process.kill()
+            self.process.wait()
+        with self.condition:
+            self.condition.notify_all()
+
+    def _read_frames(self):
+        stream = self.process.stdout
+        while self.running:
+            # ffmpeg's mpjpeg muxer: boundary line, headers, blank line, JPEG body
+            content_length = None
+            line = stream.readline()
+            if not line:
+                break
+            if not line.startswith(b'--'):
+                continue
+            while True:
+                line = stream.readline()
+                if not line or line in (b'\r\n', b'\n'):
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                if name.strip().lower() == 'content-length':
+                    content_length = int(value.strip())
+            if content_length is None:
+                continue
+            frame = stream.read(content_length)
+            if len(frame) < content_length:
+                break
+            with self.condition:
+                self.frame = frame
+                self.sequence += 1
+                self.condition.notify_all()
+        self.running = False
+
+    def wait_frame(self, last_sequence, timeout=5):
+        with self.condition:
+            self.condition.wait_for(lambda: self.sequence != last_sequence or not self.running, timeout)
+            return self.sequence, self.frame
+
+# ------------------- Simulated Camera -------------------
+class SimulatedCamera:
+    def __init__(self, number, size, fps, jitter_ms=0, disconnect_every=0, drop_rate=0.0):
+        self.number = number
+        self.size = size
+        self.fps = fps
+        self.jitter_ms = jitter_ms
+        self.disconnect_every = disconnect_every
+        self.drop_rate = drop_rate
+        self.audio_frequency = 220 * number
+        self.source = FrameSource(TEST_PATTERNS[(number - 1) % len(TEST_PATTERNS)], size, fps)
+        self.stats = {'clients': 0, 'connections': 0, 'frames_sent': 0,
+                      'frames_dropped': 0, 'disconnects_injected': 0}
+        self.stats_lock = threading.Lock()
+
+    def count(self, key, amount=1):
+        with self.stats_lock:
+            self.stats[key] += amount
+
+    def connection_lifetime(self):
+        """How long a client may stay connected before a forced disconnect"""
+        if not self.disconnect_every:
+            return None
+        return random.expovariate(1.0 / self.disconnect_every)
+
+    def jitter(self):
+        if self.jitter_ms:
+            time.sleep(random.uniform(0, self.jitter_ms) / 1000)
+
+# ------------------- HTTP Handler -------------------
+class SimulatorHandler(BaseHTTPRequestHandler):
+    """Serves /cam<N>/video (multipart MJPEG), /cam<N>/audio.opus, /cam<N>/audio.aac and /stats"""
+    protocol_version = 'HTTP/1.0'
+
+    def do_GET(self):
+        path = self.path.split('?')[0]
+        if path == '/stats':
+            self._send_stats()
+            return
+        parts = path.strip('/').split('/')
+        camera = None
+        if len(parts) == 2 and parts[0].startswith('cam') and parts[0][3:].isdigit():
+            camera = self.server.cameras.get(int(parts[0][3:]))
+        if camera is None:
+            self.send_error(404)
+            return
+        camera.count('clients')
+        camera.count('connections')
+        try:
+            if parts[1] == 'video':
+                self._serve_video(camera)
+            elif parts[1] in ('audio.opus', 'audio.aac'):
+                self._serve_audio(camera, parts[1].split('.')[1])
+            else:
+                self.send_error(404)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            camera.count('clients', -1)
+
+    def _send_stats(self):
+        body = json.dumps({f"cam{number}": camera.stats for number, camera in self.server.cameras.items()}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _disconnect_due(self, camera, deadline):
+        if deadline is not None and time.monotonic() >= deadline:
+            camera.count('disconnects_injected')
+            return True
+        return False
+
+    def _serve_video(self, camera):
+        self.send_response(200)
+        self.send_header('Content-Type', f'multipart/x-mixed-replace; boundary={BOUNDARY}')
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        lifetime = camera.connection_lifetime()
+        deadline = time.monotonic() + lifetime if lifetime is not None else None
+        sequence = 0
+        while camera.source.running and not self.server.stopping:
+            sequence, frame = camera.source.wait_frame(sequence)
+            if frame is None:
+                continue
+            if self._disconnect_due(camera, deadline):
+                break
+            if camera.drop_rate and random.random() < camera.drop_rate:
+                camera.count('frames_dropped')
+                continue
+            camera.jitter()
+            self.wfile.write(
+                f"--{BOUNDARY}\r\nContent-Type: image/jpeg\r\nContent-Length: {len(frame)}\r\n\r\n".encode()
+                + frame + b"\r\n"
+            )
+            camera.count('frames_sent')
+
+    def _serve_audio(self, camera, codec):
+        if codec == 'opus':
+            codec_args, content_type = ['-c:a', 'libopus', '-b:a', '64k', '-f', 'ogg'], 'audio/ogg'
+        else:
+            codec_args, content_type = ['-c:a', 'aac', '-b:a', '96k', '-f', 'adts'], 'audio/aac'
+        command = [
+            'ffmpeg', '-loglevel', 'error', '-re',
+            '-f', 'lavfi', '-i', f'sine=frequency={camera.audio_frequency}:sample_rate=48000'
+        ] + codec_args + ['pipe:1']
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.end_headers()
+        lifetime = camera.connection_lifetime()
+        deadline = time.monotonic() + lifetime if lifetime is not None else None
+        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        try:
+            while not self.server.stopping:
+                chunk = process.stdout.read1(4096)
+                if not chunk or self._disconnect_due(camera, deadline):
+                    break
+                camera.jitter()
+                self.wfile.write(chunk)
+        finally:
+            process.kill()
+            process.wait()
+
+    def log_message(self, format, *args):
+        pass
+
+# ------------------- Camera Simulator -------------------
+class CameraSimulator:
+    """N synthetic IP cameras behind one local HTTP server"""
+    def __init__(self, cameras=DEFAULT_CAMERAS, size=DEFAULT_SIZE, fps=DEFAULT_FPS, jitter_ms=0,
+                 disconnect_every=0, drop_rate=0.0, host='127.0.0.1', port=0):
+        self.cameras = {number: SimulatedCamera(number, size, fps, jitter_ms, disconnect_every, drop_rate)
+                        for number in range(1, cameras + 1)}
+        self.server = ThreadingHTTPServer((host, port), SimulatorHandler)
+        self.server.daemon_threads = True
+        self.server.cameras = self.cameras
+        self.server.stopping = False
+        self.thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def video_url(self, number):
+        return f"{self.base_url}/cam{number}/video"
+
+    def audio_url(self, number, codec='opus'):
+        return f"{self.base_url}/cam{number}/audio.{codec}"
+
+    def integrated_devices(self):
+        """Entries in the same shape as index.INTEGRATED_DEVICES"""
+        return [{'name': f"Simulated Camera {number}", 'ip': self.video_url(number)}
+                for number in self.cameras]
+
+    def start(self):
+        for camera in self.cameras.values():
+            camera.source.start()
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.stopping = True
+        for camera in self.cameras.values():
+            camera.source.stop()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def stats(self):
+        return {f"cam{number}": dict(camera.stats) for number, camera in self.cameras.items()}
+
+# ------------------- Main -------------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve synthetic MJPEG IP cameras for load testing the recorder.")
+    parser.add_argument('--cameras', type=int, default=DEFAULT_CAMERAS, help='number of cameras (default: %(default)s)')
+    parser.add_argument('--size', default=DEFAULT_SIZE, help='frame size WxH (default: %(default)s)')
+    parser.add_argument('--fps', type=int, default=DEFAULT_FPS, help='frames per second (default: %(default)s)')
+    parser.add_argument('--jitter-ms', type=float, default=0, help='random delay of up to this many ms per frame')
+    parser.add_argument('--disconnect-every', type=float, default=0, metavar='SECONDS',
+                        help='drop each client after a random time with this mean (0 = never)')
+    parser.add_argument('--drop-rate', type=float, default=0.0, help='fraction of frames to skip per client')
+    parser.add_argument('--host', default='127.0.0.1', help='address to listen on (default: %(default)s)')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help='port to listen on (default: %(default)s)')
+    args = parser.parse_args(argv)
+
+    simulator = CameraSimulator(args.cameras, args.size, args.fps, args.jitter_ms,
+                                args.disconnect_every, args.drop_rate, args.host, args.port).start()
+    print(f"Simulating {args.cameras} camera(s) at {args.size} {args.fps}fps on {simulator.base_url}")
+    for number in simulator.cameras:
+        print(f"  cam{number}: {simulator.video_url(number)}  audio: {simulator.audio_url(number)}")
+    print(f"Stats: {simulator.base_url}/stats")
+    print("\nINTEGRATED_DEVICES = " + json.dumps(simulator.integrated_devices(), indent=4))
+    print("\nPress Ctrl+C to stop.")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        print("\nStopping simulator...")
+    finally:
+        simulator.stop()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,302 @@
+import argparse
+import hashlib
+import logging
+import os
+import subprocess
+import tempfile
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+import downloader
+
+# ------------------- Clip Server Configuration -------------------
+CLIP_SERVER_HOST = '127.0.0.1'
+CLIP_SERVER_PORT = 8780
+CLIP_MAX_SECONDS = 3600                          # longest clip a single request may ask for
+CLIP_CHUNK_SIZE = 64 * 1024
+CLIP_CACHE_DIR = os.path.join(tempfile.gettempdir(), 'clip_cache')
+CLIP_CACHE_MAX_BYTES = 2 * 1024 * 1024 * 1024    # 2 GB
+CLIP_CACHE_SETTLE_SECONDS = 600                  # windows newer than this may still gain footage, so are not cached
+PRESIGNED_URL_EXPIRY = 3600
+
+logger = logging.getLogger('clip_server')
+
+# ------------------- Clip Cache -------------------
+class ClipCache:
+    """Finished clips on disk, evicted least recently used first once over max_bytes"""
+    def __init__(self, folder=CLIP_CACHE_DIR, max_bytes=CLIP_CACHE_MAX_BYTES):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        os.makedirs(folder, exist_ok=True)
+
+    def path_for(self, camera, start_ms, end_ms):
+        digest = hashlib.sha1(f"{camera}:{start_ms}:{end_ms}".encode()).hexdigest()
+        return os.path.join(self.folder, f"{digest}.mp4")
+
+    def get(self, camera, start_ms, end_ms):
+        path = self.path_for(camera, start_ms, end_ms)
+        with self.lock:
+            if not os.path.exists(path):
+                return None
+            os.utime(path)
+            return path
+
+    def temp_path(self):
+        handle, path = tempfile.mkstemp(suffix='.part', dir=self.folder)
+        os.close(handle)
+        return path
+
+    def store(self, camera, start_ms, end_ms, temp_path):
+        with self.lock:
+            os.replace(temp_path, self.path_for(camera, start_ms, end_ms))
+            self._evict()
+
+    def _evict(self):
+        entries = []
+        for name in os.listdir(self.folder):
+            if name.endswith('.mp4'):
+                path = os.path.join(self.folder, name)
+                stat = os.stat(path)
+                entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            os.remove(path)
+            total -= size
+
+# ------------------- Clip Pipeline -------------------
+def source_url(segment):
+    """URL ffmpeg reads a segment from; stored objects are read in place, through a presigned URL on S3"""
+    if segment['source'] == 'local':
+        return f"file:{os.path.abspath(segment['path'])}"
+    return downloader.get_storage().url(segment['path'], PRESIGNED_URL_EXPIRY)
+
+def piece_sources(pieces, segments):
+    """(url, inpoint, outpoint) in seconds for each piece of the clip"""
+    sources = []
+    for path, piece_start, piece_end in pieces:
+        segment = segments[path]
+        sources.append((source_url(segment), (piece_start - segment['start_ms']) / 1000,
+                        (piece_end - segment['start_ms']) / 1000))
+    return sources
+
+def concat_list(sources):
+    """ffconcat script that trims each segment to its piece of the clip"""
+    lines = ['ffconcat version 1.0']
+    for url, inpoint, outpoint in sources:
+        url = url.replace("'", "'\\''")
+        lines.append(f"file '{url}'")
+        lines.append(f"inpoint {inpoint:.3f}")
+        lines.append(f"outpoint {outpoint:.3f}")
+    return '\n'.join(lines) + '\n'
+
+def clip_command(input_args=None):
+    """Stream copy of an ffconcat script on stdin, or the given re-encoding inputs, as fragmented MP4"""
+    if input_args is None:
+        input_args = ['-f', 'concat', '-safe', '0',
+                      '-protocol_whitelist', 'file,http,https,tcp,tls,crypto,pipe',
+                      '-i', 'pipe:0', '-c', 'copy']
+    # Fragmented so output starts flowing after the first keyframe
+    return [
+        'ffmpeg', '-loglevel', 'error',
+        *input_args,
+        '-movflags', '+frag_keyframe+empty_moov+default_base_moof',
+        '-f', 'mp4', 'pipe:1'
+    ]
+
+# ------------------- HTTP Handler -------------------
+class ClipHandler(BaseHTTPRequestHandler):
+    """GET /clip?camera=<id>&start_ms=<ms>&end_ms=<ms> streams the clip as chunked video/mp4"""
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path != '/clip':
+            self._send_error(404, 'Not found')
+            return
+        params = parse_qs(url.query)
+        camera = params.get('camera', [None])[0] or None
+        try:
+            start_ms = int(params['start_ms'][0])
+            end_ms = int(params['end_ms'][0])
+        except (KeyError, ValueError):
+            self._send_error(400, 'start_ms and end_ms must be integer timestamps')
+            return
+        if start_ms < 0 or start_ms >= end_ms:
+            self._send_error(400, 'end_ms must be greater than start_ms')
+            return
+        if end_ms - start_ms > CLIP_MAX_SECONDS * 1000:
+            self._send_error(400, f'clips are limited to {CLIP_MAX_SECONDS} seconds')
+            return
+
+        # Clips are cached by camera slug, so 'Cam 1' and 'cam-1' share one; without
+        # a camera, the camera is only known once the footage has been found
+        if camera and self._send_cached(downloader.camera_slug(camera), start_ms, end_ms):
+            return
+        plans, segments = downloader.plan_batch([{'camera': camera, 'start_ms': start_ms, 'end_ms': end_ms}])
+        if len(plans) > 1:
+            cameras = ', '.join(request['camera'] for request, _ in plans)
+            self._send_error(400, f'footage from several cameras; pick one with camera=: {cameras}')
+            return
+        request, pieces = plans[0]
+        if not pieces:
+            self._send_error(404, 'no footage in the requested range')
+            return
+        cache_camera = downloader.camera_slug(request['camera'])
+        if not camera and self._send_cached(cache_camera, start_ms, end_ms):
+            return
+        cacheable = end_ms < (time.time() - CLIP_CACHE_SETTLE_SECONDS) * 1000
+        sources = piece_sources(pieces, segments)
+        if downloader.mixed_tiers(pieces, segments):
+            # Originals and cloud tier copies cannot be stream copied into one clip
+            try:
+                command, script = clip_command(downloader.reencode_args(sources)), ''
+            except Exception as e:
+                logger.error(f"Cannot probe clip sources: {e}")
+                self._send_error(502, 'clip generation failed')
+                return
+        else:
+            command, script = clip_command(), concat_list(sources)
+        self._stream_clip(command, script, (cache_camera, start_ms, end_ms) if cacheable else None)
+
+    def _send_cached(self, camera, start_ms, end_ms):
+        """Send a cached clip; False if there is none, so the caller generates it"""
+        cached = self.server.cache.get(camera, start_ms, end_ms)
+        if cached is None:
+            return False
+        try:
+            # Opened before anything is sent, so a clip evicted since get() is just generated again
+            f = open(cached, 'rb')
+        except FileNotFoundError:
+            return False
+        with f:
+            self._send_file(f)
+        return True
+
+    def _send_error(self, status, message):
+        body = (message + '\n').encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/plain; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_file(self, f):
+        try:
+            self.send_response(200)
+            self.send_header('Content-Type', 'video/mp4')
+            self.send_header('Content-Length', str(os.fstat(f.fileno()).st_size))
+            self.send_header('X-Clip-Cache', 'hit')
+            self.end_headers()
+            while True:
+                chunk = f.read(CLIP_CHUNK_SIZE)
+                if not chunk:
+                    break
+                self.wfile.write(chunk)
+        except (BrokenPipeError, ConnectionResetError):
+            logger.info("Client disconnected during cached clip")
+            self.close_connection = True
+
+    def _write_chunk(self, data):
+        self.wfile.write(f"{len(data):X}\r\n".encode() + data + b"\r\n")
+
+    def _stream_clip(self, command, script, cache_key):
+        process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                   stderr=subprocess.PIPE)
+        cache_file = None
+        try:
+            process.stdin.write(script.encode())
+            process.stdin.close()
+            # Wait for the first bytes before committing to a 200
+            chunk = process.stdout.read1(CLIP_CHUNK_SIZE)
+            if not chunk:
+                process.wait()
+                error = process.stderr.read().decode('utf-8', errors='replace').strip()
+                logger.error(f"Clip generation failed: {error}")
+                self._send_error(502, 'clip generation failed')
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', 'video/mp4')
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.send_header('X-Clip-Cache', 'miss')
+            self.end_headers()
+            if cache_key:
+                temp_path = self.server.cache.temp_path()
+                cache_file = open(temp_path, 'wb')
+            while chunk:
+                self._write_chunk(chunk)
+                if cache_file:
+                    cache_file.write(chunk)
+                chunk = process.stdout.read1(CLIP_CHUNK_SIZE)
+            if process.wait() != 0:
+                # Leave the chunked body unterminated so the client sees a truncated response
+                logger.error(f"Clip generation failed mid-stream: {process.stderr.read().decode('utf-8', errors='replace').strip()}")
+                self.close_connection = True
+                return
+            self.wfile.write(b"0\r\n\r\n")
+            if cache_file:
+                cache_file.close()
+                self.server.cache.store(*cache_key, cache_file.name)
+                cache_file = None
+        except (BrokenPipeError, ConnectionResetError):
+            logger.info("Client disconnected during clip")
+        finally:
+            if process.poll() is None:
+                process.kill()
+                process.wait()
+            if cache_file:
+                cache_file.close()
+                os.remove(cache_file.name)
+
+    def log_message(self, format, *args):
+        logger.info(f"{self.address_string()} {format % args}")
+
+# ------------------- Clip Server -------------------
+class ClipServer:
+    def __init__(self, host=CLIP_SERVER_HOST, port=CLIP_SERVER_PORT, cache=None):
+        self.server = ThreadingHTTPServer((host, port), ClipHandler)
+        self.server.daemon_threads = True
+        self.server.cache = cache or ClipCache()
+        self.thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+# ------------------- Main -------------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve recorded clips over HTTP by camera and time range.")
+    parser.add_argument('--host', default=CLIP_SERVER_HOST, help='address to listen on (default: %(default)s)')
+    parser.add_argument('--port', type=int, default=CLIP_SERVER_PORT, help='port to listen on (default: %(default)s)')
+    parser.add_argument('--cache-dir', default=CLIP_CACHE_DIR, help='folder for cached clips (default: %(default)s)')
+    parser.add_argument('--cache-mb', type=int, default=CLIP_CACHE_MAX_BYTES // (1024 * 1024),
+                        help='cache size limit in MB (default: %(default)s)')
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    server = ClipServer(args.host, args.port, ClipCache(args.cache_dir, args.cache_mb * 1024 * 1024))
+    print(f"Serving clips on {server.base_url}/clip?camera=<id>&start_ms=<ms>&end_ms=<ms>")
+    print("Press Ctrl+C to stop.")
+    try:
+        server.server.serve_forever()
+    except KeyboardInterrupt:
+        print("\nStopping clip server...")
+    finally:
+        server.server.server_close()
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,17 @@
-import boto3
-import ffmpeg
 import os
 import subprocess
 import json
-import psutil
 from datetime import datetime
-import re
+from recording_names import (parse_recording_name, name_prefix_for, window_partitions, camera_slug, LEGACY_CAMERA,
+                             MAX_PARTITIONED_MS, LONG_PARTITION, RESERVED_FOLDERS)
+import shutil
+import argparse
+import csv
+import sys
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from storage_backend import create_backend
+import tracing
+# ffmpeg-python, psutil and boto3 are imported where they are used, so the CLI starts quickly
 
 # ------------------- AWS S3 Setup -------------------
 AWS_ACCESS_KEY_ID = ''
@@ -13,21 +19,34 @@ AWS_SECRET_ACCESS_KEY = ''
 AWS_REGION = 'eu-north-1'
 BUCKET_NAME = 'my-bucket'
 PREFIX = 'recorded-videos/'
+S3_ENDPOINT_URL = None  # set for S3-compatible stores (MinIO, moto server)
+STORAGE_BACKEND = 's3'  # 's3', 's3-compatible' or 'local', as configured in index.py
+LOCAL_STORE_PATH = 'object-store'
+RECORDING_INDEX_FILE = 'recording_index.jsonl'
+BATCH_OUTPUT_DIR = os.path.join("download_video", "batch")
+BATCH_DOWNLOAD_WORKERS = 4   # segments fetched from S3 at once in batch mode
+TIER_METADATA_KEY = 'tier'   # object metadata naming the tier a cloud copy was re-encoded at, as set by index.py
+# Used only to join pieces of a clip that mixes originals with cloud tier copies
+REENCODE_OUTPUT_ARGS = ['-c:v', 'libx264', '-preset', 'veryfast', '-crf', '23', '-pix_fmt', 'yuv420p',
+                        '-c:a', 'aac', '-b:a', '128k']
 
-# Initialize S3 client
-try:
-    s3_client = boto3.client(
-        's3',
-        aws_access_key_id=AWS_ACCESS_KEY_ID,
-        aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
-        region_name=AWS_REGION
-    )
-except Exception as e:
-    print(f"Failed to initialize S3 client: {e}")
-    s3_client = None
+storage = None
+
+def get_storage():
+    """Create the storage backend on first use, so the CLI starts quickly and never connects when it does not need to"""
+    global storage
+    if storage is None:
+        try:
+            storage = create_backend(STORAGE_BACKEND, BUCKET_NAME, region=AWS_REGION,
+                                     access_key=AWS_ACCESS_KEY_ID, secret_key=AWS_SECRET_ACCESS_KEY,
+                                     endpoint_url=S3_ENDPOINT_URL, local_path=LOCAL_STORE_PATH)
+        except Exception as e:
+            print(f"Failed to initialize {STORAGE_BACKEND} storage backend: {e}")
+    return storage
 
 # ------------------- Find Removable Drive -------------------
 def find_removable_drive():
+    import psutil
     partitions = psutil.disk_partitions(all=False)
     for partition in partitions:
         if 'removable' in partition.opts.lower():
@@ -44,32 +63,76 @@ def find_removable_drive():
 
 # ------------------- Parse Filename to Epoch (in seconds) -------------------
 def parse_filename_to_epoch(filename):
-    pattern = r'captured_video_(\d{4}-\d{2}-\d{2}_\d{2}-\d{2}-\d{2}_[AP]M)_to_(\d{2}-\d{2}-\d{2}_[AP]M)\.mp4'
-    match = re.match(pattern, os.path.basename(filename))
-    if match:
-        start_str, end_str = match.groups()
-        try:
-            start_dt = datetime.strptime(start_str, '%Y-%m-%d_%I-%M-%S_%p')
-            end_dt = datetime.strptime(f"{start_str.split('_')[0]}_{end_str}", '%Y-%m-%d_%I-%M-%S_%p')
-            return int(start_dt.timestamp()), int(end_dt.timestamp())
-        except ValueError as e:
-            print(f"Error parsing timestamp in filename {filename}: {e}")
-            return None, None
-    return None, None
+    parsed = parse_recording_name(filename)
+    if parsed is None:
+        return None, None
+    start_ms, end_ms, _ = parsed
+    return start_ms // 1000, end_ms // 1000
+
+# ------------------- List S3 Keys -------------------
+def list_keys(prefix, last_key=None, delimiter=None, cache=None):
+    """Keys under prefix sorting before last_key, and the sub-folders found when delimiter is set.
+
+    Pass a dict as cache to reuse listings across many queries, as batch mode does.
+    """
+    if cache is not None:
+        cache_key = (prefix, last_key, delimiter)
+        if cache_key not in cache:
+            cache[cache_key] = list_keys(prefix, last_key, delimiter)
+        return cache[cache_key]
+    keys, folders = [], []
+    for page_keys, page_folders in get_storage().list_pages(prefix, delimiter):
+        folders.extend(page_folders)
+        for key in page_keys:
+            if last_key and key >= last_key:
+                return keys, folders
+            keys.append(key)
+    return keys, folders
+
+def list_window_keys(base_prefix, start_ms, end_ms, camera=None, cache=None):
+    """Keys under base_prefix that can hold recordings overlapping the window.
+
+    Objects are stored as <camera>/YYYY/MM/DD/HH/<name>, so only the
+    partitions overlapping the window, and MAX_PARTITIONED_MS before it, are
+    listed for each camera, along with its long/ folder of longer recordings.
+    Flat objects directly under base_prefix (not yet migrated) are listed too.
+    With a camera id, only that camera's folder is searched.
+    """
+    keys, folders = list_keys(base_prefix, delimiter='/', cache=cache)
+    keys = list(keys)
+    partitions = window_partitions(start_ms - MAX_PARTITIONED_MS, end_ms)
+    for folder in folders:
+        if folder[len(base_prefix):].rstrip('/') in RESERVED_FOLDERS:
+            continue
+        if camera and folder[len(base_prefix):] != f"{camera_slug(camera)}/":
+            continue
+        for partition in partitions:
+            prefix = f"{folder}{partition}"
+            # Names within an hour partition sort by start time, so stop past the window
+            last_key = f"{prefix}{name_prefix_for(end_ms + 1)}" if partition.count('/') == 4 else None
+            keys.extend(list_keys(prefix, last_key, cache=cache)[0])
+        keys.extend(list_keys(f"{folder}{LONG_PARTITION}", cache=cache)[0])
+    return keys
+
+def matches_camera(name, camera):
+    """True if no camera is asked for, or the recording's name carries that camera id"""
+    if not camera:
+        return True
+    parsed = parse_recording_name(name)
+    return parsed is not None and parsed[2] == camera_slug(camera)
 
 # ------------------- List Videos -------------------
-def list_videos(start_ms, end_ms):
+@tracing.traced(category='search')
+def list_videos(start_ms, end_ms, camera=None, cache=None):
     # Convert milliseconds to seconds for comparison
     start_epoch = start_ms // 1000
     end_epoch = end_ms // 1000
     video_files = []
     # Check S3
-    if s3_client:
+    if get_storage():
         try:
-            response = s3_client.list_objects_v2(Bucket=BUCKET_NAME, Prefix=PREFIX)
-            for item in response.get('Contents', []):
-                key = item['Key']
-                if key.endswith('.mp4'):
+            for key in list_window_keys(PREFIX, start_ms, end_ms, camera, cache):
+                if key.endswith('.mp4') and matches_camera(key, camera):
                     start_time, end_time = parse_filename_to_epoch(key)
                     if start_time and end_time:
                         # Include video if its time range overlaps with the input range
@@ -83,7 +146,7 @@ def list_videos(start_ms, end_ms):
     if local_folder and os.path.exists(local_folder):
         try:
             for file in os.listdir(local_folder):
-                if file.endswith('.mp4'):
+                if file.endswith('.mp4') and matches_camera(file, camera):
                     full_path = os.path.join(local_folder, file)
                     start_time, end_time = parse_filename_to_epoch(full_path)
                     if start_time and end_time:
@@ -93,15 +156,130 @@ def list_videos(start_ms, end_ms):
         except Exception as e:
             print(f"Error accessing local folder {local_folder}: {e}")
 
+    video_files.sort(key=lambda video: video[2])
     return video_files
 
+# ------------------- Recording Gaps -------------------
+def parse_index_lines(lines):
+    entries = []
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            entries.append(json.loads(line))
+        except ValueError:
+            # A line may be cut short if the recorder was writing it
+            continue
+    return entries
+
+@tracing.traced(category='search')
+def load_recording_index():
+    entries = []
+    if get_storage():
+        try:
+            for key in list_keys(f"{PREFIX}index/")[0]:
+                # The SQLite timelines synced alongside are read by timeline.py
+                if not key.endswith('.jsonl'):
+                    continue
+                body = get_storage().get(key)
+                entries.extend(parse_index_lines(body.decode('utf-8').splitlines()))
+        except Exception as e:
+            print(f"Error reading recording index from S3: {e}")
+    if os.path.exists(RECORDING_INDEX_FILE):
+        try:
+            with open(RECORDING_INDEX_FILE) as f:
+                entries.extend(parse_index_lines(f))
+        except OSError as e:
+            print(f"Error reading local recording index: {e}")
+    return entries
+
+def find_gaps(start_ms, end_ms, entries=None):
+    gaps = {}
+    for entry in (load_recording_index() if entries is None else entries):
+        if entry.get('type') != 'gap':
+            continue
+        if entry['start_ms'] <= end_ms and entry['end_ms'] >= start_ms:
+            gaps[(entry.get('camera'), entry['start_ms'], entry['end_ms'])] = entry
+    return sorted(gaps.values(), key=lambda gap: gap['start_ms'])
+
+# ------------------- Previews -------------------
+@tracing.traced(category='search')
+def list_previews(start_ms, end_ms):
+    """Preview sidecars of recordings overlapping the range, as (source, path) tuples"""
+    start_epoch = start_ms // 1000
+    end_epoch = end_ms // 1000
+    def overlaps(info_name):
+        video_name = os.path.basename(info_name)[:-len('_preview.json')] + '.mp4'
+        start_time, end_time = parse_filename_to_epoch(video_name)
+        return start_time and end_time and start_epoch <= end_time and end_epoch >= start_time
+    previews = []
+    if get_storage():
+        try:
+            for key in list_window_keys(f"{PREFIX}previews/", start_ms, end_ms):
+                if key.endswith('_preview.json') and overlaps(key):
+                    previews.append(('s3', key))
+        except Exception as e:
+            print(f"Error listing previews in S3: {e}")
+    local_folder = find_removable_drive()
+    preview_folder = os.path.join(local_folder, 'previews') if local_folder else None
+    if preview_folder and os.path.isdir(preview_folder):
+        for file in os.listdir(preview_folder):
+            if file.endswith('_preview.json') and overlaps(file):
+                previews.append(('local', os.path.join(preview_folder, file)))
+    return sorted(previews, key=lambda preview: os.path.basename(preview[1]))
+
+@tracing.traced(category='download')
+def download_preview(source, info_path):
+    """Fetch a recording's preview sidecar, sprite sheet and preview video; returns the sidecar"""
+    folder = os.path.join("download_video", "previews")
+    os.makedirs(folder, exist_ok=True)
+    def fetch(name):
+        source_path = f"{os.path.dirname(info_path)}/{name}" if source == 's3' else os.path.join(os.path.dirname(info_path), name)
+        local_path = os.path.join(folder, name)
+        if source == 's3':
+            get_storage().download(source_path, local_path)
+        else:
+            shutil.copy(source_path, local_path)
+        return local_path
+    try:
+        with open(fetch(os.path.basename(info_path))) as f:
+            info = json.load(f)
+        info['sprite_path'] = fetch(info['sprite'])
+        info['preview_path'] = fetch(info['preview'])
+        return info
+    except Exception as e:
+        print(f"Error downloading preview {info_path}: {e}")
+        return None
+
+def show_previews(start_ms, end_ms):
+    previews = list_previews(start_ms, end_ms)
+    if not previews:
+        print("No previews found in the specified time range.")
+        return
+    for source, info_path in previews:
+        info = download_preview(source, info_path)
+        if not info:
+            continue
+        print(f"\n{info['video']}")
+        print(f"  Sprite sheet: {info['sprite_path']}")
+        print(f"  Preview video: {info['preview_path']}")
+        # Tiles run left to right, top to bottom, one every `interval` seconds
+        row_seconds = info['interval'] * info['columns']
+        for row in range(info['rows']):
+            row_start = info['start_ms'] / 1000 + row * row_seconds
+            if row_start * 1000 > info['end_ms']:
+                break
+            print(f"  Row {row + 1}: {datetime.fromtimestamp(row_start).strftime('%I:%M:%S %p')}, one tile every {info['interval']}s")
+
 # ------------------- Download Video -------------------
+@tracing.traced(category='download')
 def download_video(source, source_path, local_filename):
     os.makedirs("download_video", exist_ok=True)
     full_path = os.path.join("download_video", local_filename)
     if source == 's3':
         try:
-            s3_client.download_file(BUCKET_NAME, source_path, full_path)
+            get_storage().download(source_path, full_path)
             return full_path
         except Exception as e:
             print(f"Error downloading from S3: {e}")
@@ -116,6 +294,7 @@ def download_video(source, source_path, local_filename):
             return None
 
 # ------------------- Get Video Duration -------------------
+@tracing.traced(category='probe')
 def get_video_duration(filename):
     try:
         result = subprocess.run(
@@ -132,18 +311,284 @@ def get_video_duration(filename):
         return 0
 
 # ------------------- Crop Video -------------------
-def crop_video(input_path, output_path, start_time, end_time):
+@tracing.traced(category='crop')
+def crop_video(input_path, output_path, start_time, end_time, quiet=False):
+    import ffmpeg
     try:
         ffmpeg.input(input_path, ss=start_time, t=end_time - start_time) \
               .output(output_path, c='copy') \
-              .run(overwrite_output=True)
+              .run(overwrite_output=True, quiet=quiet)
         return True
     except Exception as e:
         print(f"Error cropping video: {e}")
         return False
 
+# ------------------- Batch Export -------------------
+def load_batch_requests(path):
+    """Clip requests from a CSV file with a camera,start_ms,end_ms header, or a JSON list of such objects"""
+    with open(path, newline='') as f:
+        rows = json.load(f) if path.lower().endswith('.json') else list(csv.DictReader(f))
+    requests = []
+    for number, row in enumerate(rows, 1):
+        try:
+            start_ms, end_ms = int(row['start_ms']), int(row['end_ms'])
+        except (KeyError, TypeError, ValueError):
+            print(f"Skipping request {number}: start_ms and end_ms must be integer timestamps")
+            continue
+        if start_ms < 0 or start_ms >= end_ms:
+            print(f"Skipping request {number}: end_ms must be greater than start_ms")
+            continue
+        requests.append({'camera': (row.get('camera') or '').strip() or None, 'start_ms': start_ms, 'end_ms': end_ms})
+    return requests
+
+def crop_piece(job):
+    """Process pool worker: cut one piece of a clip out of a local segment.
+
+    Spans recorded in a worker never reach the parent's trace, so the worker
+    returns its own start and end times (perf_counter reads the same
+    system-wide monotonic clock in every process) for the parent to record.
+    """
+    source_path, output_path, start_time, end_time = job
+    started = tracing.clock()
+    ok = crop_video(source_path, output_path, start_time, end_time, quiet=True)
+    return (output_path if ok else None), started, tracing.clock()
+
+def probe_layout(source):
+    """(width, height, has_audio, duration in seconds) of a video file or URL"""
+    result = subprocess.run(
+        ["ffprobe", "-v", "error", "-show_entries", "stream=codec_type,width,height:format=duration",
+         "-of", "json", source],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, check=True
+    )
+    output = json.loads(result.stdout)
+    video = next(stream for stream in output['streams'] if stream['codec_type'] == 'video')
+    has_audio = any(stream['codec_type'] == 'audio' for stream in output['streams'])
+    return int(video['width']), int(video['height']), has_audio, float(output['format'].get('duration') or 0)
+
+def reencode_args(sources):
+    """ffmpeg inputs and filters that decode sources, given as (url, start s or None, end s or None), into one clip.
+
+    The concat demuxer keeps the first file's codec setup, so copies made at
+    different tiers cannot go through it even when re-encoding. Each source
+    is opened as its own input instead, scaled into the first one's frame and
+    joined by the concat filter. A source without audio gets silence.
+    """
+    layouts = [probe_layout(url) for url, _, _ in sources]
+    width, height = layouts[0][:2]
+    args, filters, streams = [], [], ''
+    for number, ((url, start, end), (_, _, has_audio, duration)) in enumerate(zip(sources, layouts)):
+        if start is not None:
+            args += ['-ss', f"{start:.3f}"]
+        if end is not None:
+            args += ['-to', f"{end:.3f}"]
+        args += ['-i', url]
+        filters.append(f"[{number}:v]scale={width}:{height}:force_original_aspect_ratio=decrease,"
+                       f"pad={width}:{height}:(ow-iw)/2:(oh-ih)/2,setsar=1,format=yuv420p[v{number}]")
+        if has_audio:
+            filters.append(f"[{number}:a]aresample=48000,aformat=channel_layouts=stereo[a{number}]")
+        else:
+            length = (end if end is not None else duration) - (start or 0)
+            filters.append(f"anullsrc=r=48000:cl=stereo,atrim=duration={length:.3f}[a{number}]")
+        streams += f"[v{number}][a{number}]"
+    filters.append(f"{streams}concat=n={len(sources)}:v=1:a=1[v][a]")
+    return args + ['-filter_complex', ';'.join(filters), '-map', '[v]', '-map', '[a]'] + REENCODE_OUTPUT_ARGS
+
+def mixed_tiers(pieces, segments):
+    """True if a clip's pieces come from copies encoded differently, so they must be re-encoded to join"""
+    return len({segments[path]['tier'] for path, _, _ in pieces}) > 1
+
+@tracing.traced(category='crop')
+def concat_pieces(piece_paths, output_path, reencode=False):
+    """Join clip pieces from consecutive segments, without re-encoding unless asked to"""
+    import ffmpeg
+    list_path = f"{output_path}.txt"
+    try:
+        if reencode:
+            subprocess.run(['ffmpeg', '-v', 'error', '-y', *reencode_args([(path, None, None) for path in piece_paths]),
+                            output_path], stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, check=True)
+            return True
+        with open(list_path, 'w') as f:
+            for piece_path in piece_paths:
+                f.write(f"file '{os.path.abspath(piece_path)}'\n")
+        ffmpeg.input(list_path, format='concat', safe=0) \
+              .output(output_path, c='copy') \
+              .run(overwrite_output=True, quiet=True)
+        return True
+    except Exception as e:
+        print(f"Error joining clip pieces for {output_path}: {e}")
+        return False
+    finally:
+        if os.path.exists(list_path):
+            os.remove(list_path)
+
+@tracing.traced(category='download')
+def fetch_segment(segment, work_dir):
+    """Local path of a segment, downloading it from S3 once if needed"""
+    if segment['source'] == 'local':
+        return segment['path']
+    local_path = os.path.join(work_dir, os.path.basename(segment['path']))
+    try:
+        get_storage().download(segment['path'], local_path)
+        return local_path
+    except Exception as e:
+        print(f"Error downloading {segment['path']}: {e}")
+        return None
+
+def trim_overlaps(pieces):
+    """Start each piece where the previous one ends; rotated segments overlap by a second or two"""
+    trimmed = []
+    covered_until = None
+    for name, piece_start, piece_end in pieces:
+        if covered_until is not None:
+            piece_start = max(piece_start, covered_until)
+        if piece_end > piece_start:
+            trimmed.append((name, piece_start, piece_end))
+            covered_until = piece_end
+    return trimmed
+
+def object_tier(key, cache=None):
+    """Tier an object in S3 was re-encoded at, or None for an original recording"""
+    if cache is not None:
+        cache_key = ('tier', key)
+        if cache_key not in cache:
+            cache[cache_key] = object_tier(key)
+        return cache[cache_key]
+    head = get_storage().head(key)
+    return head['metadata'].get(TIER_METADATA_KEY) if head else None
+
+def choose_copies(names, copies, cache=None):
+    """(source, path) to read each of a clip's segments from.
+
+    The drive holds originals, while with a cloud tier S3 holds re-encoded
+    copies, and the two only join by re-encoding. A clip is therefore read
+    all from the drive, or all from S3 if its copies there share one tier.
+    Only when neither covers the whole clip are the two mixed.
+    """
+    if all('local' in copies[name] for name in names):
+        return {name: ('local', copies[name]['local']) for name in names}
+    if all('s3' in copies[name] for name in names) and \
+            len({object_tier(copies[name]['s3'], cache) for name in names}) == 1:
+        return {name: ('s3', copies[name]['s3']) for name in names}
+    return {name: ('local', copies[name]['local']) if 'local' in copies[name] else ('s3', copies[name]['s3'])
+            for name in names}
+
+@tracing.traced(category='search')
+def plan_batch(requests):
+    """Split every request into pieces of the segments it overlaps; each segment appears once.
+
+    Pieces and the returned segments are keyed by the path the segment is
+    read from (see choose_copies). A request without a camera becomes one
+    clip per camera that has footage in the window.
+    """
+    cache = {}
+    segments = {}
+    plans = []
+    for request in requests:
+        copies = {}
+        pieces_by_camera = {}
+        for source, path, _ in list_videos(request['start_ms'], request['end_ms'], request['camera'], cache):
+            segment_start, segment_end, camera = parse_recording_name(path)
+            piece_start = max(request['start_ms'], segment_start)
+            piece_end = min(request['end_ms'], segment_end)
+            if piece_end <= piece_start:
+                continue
+            name = os.path.basename(path)
+            copies.setdefault(name, {})[source] = path
+            pieces = pieces_by_camera.setdefault(request['camera'] or camera or LEGACY_CAMERA, [])
+            if all(piece[0] != name for piece in pieces):
+                pieces.append((name, piece_start, piece_end))
+        if not pieces_by_camera:
+            plans.append((request, []))
+        for camera, pieces in sorted(pieces_by_camera.items()):
+            pieces.sort(key=lambda piece: piece[1])
+            chosen = choose_copies([name for name, _, _ in pieces], copies, cache)
+            for source, path in chosen.values():
+                if path not in segments:
+                    segments[path] = {'source': source, 'path': path, 'start_ms': parse_recording_name(path)[0],
+                                      'tier': object_tier(path, cache) if source == 's3' else None}
+            pieces = [(chosen[name][1], piece_start, piece_end) for name, piece_start, piece_end in pieces]
+            plans.append((dict(request, camera=camera), trim_overlaps(pieces)))
+    return plans, segments
+
+@tracing.traced(category='batch')
+def export_batch(requests, output_dir, workers=None):
+    """Cut every requested clip, fetching each source segment once; returns the manifest entries"""
+    os.makedirs(output_dir, exist_ok=True)
+    work_dir = os.path.join(output_dir, 'segments')
+    os.makedirs(work_dir, exist_ok=True)
+    get_storage()
+    plans, segments = plan_batch(requests)
+    index_entries = load_recording_index()
+    print(f"{len(requests)} clip(s) need {len(segments)} source segment(s)")
+
+    jobs = {}
+    for request_number, (request, pieces) in enumerate(plans):
+        for piece_number, (path, piece_start, piece_end) in enumerate(pieces):
+            jobs.setdefault(path, []).append((request_number, piece_number, piece_start, piece_end))
+    piece_paths = {}
+    try:
+        # Crops for a segment start as soon as it has been fetched
+        with ThreadPoolExecutor(max_workers=BATCH_DOWNLOAD_WORKERS) as downloads, \
+                ProcessPoolExecutor(max_workers=workers) as crops:
+            fetches = {downloads.submit(fetch_segment, segments[path], work_dir): path for path in jobs}
+            crop_futures = {}
+            for fetch in as_completed(fetches):
+                path = fetches[fetch]
+                local_path = fetch.result()
+                for request_number, piece_number, piece_start, piece_end in jobs[path]:
+                    if local_path is None:
+                        continue
+                    offset = segments[path]['start_ms']
+                    piece_path = os.path.join(work_dir, f"piece_{request_number}_{piece_number}.mp4")
+                    crop_futures[(request_number, piece_number)] = crops.submit(
+                        crop_piece, (local_path, piece_path, (piece_start - offset) / 1000, (piece_end - offset) / 1000))
+            for (request_number, piece_number), future in crop_futures.items():
+                piece_path, started, finished = future.result()
+                piece_paths[(request_number, piece_number)] = piece_path
+                tracing.interval('crop_piece', started, finished, 'crop',
+                                 request=request_number, piece=piece_number)
+
+        manifest = []
+        for request_number, (request, pieces) in enumerate(plans):
+            entry = dict(request)
+            entry['segments'] = [os.path.basename(path) for path, _, _ in pieces]
+            entry['gaps'] = [{'start_ms': gap['start_ms'], 'end_ms': gap['end_ms'], 'reason': gap.get('reason')}
+                             for gap in find_gaps(request['start_ms'], request['end_ms'], index_entries)
+                             if not request['camera'] or camera_slug(gap.get('camera')) == camera_slug(request['camera'])]
+            paths = [piece_paths.get((request_number, piece_number)) for piece_number in range(len(pieces))]
+            camera = camera_slug(request['camera']) if request['camera'] else 'none'
+            output_path = os.path.join(output_dir, f"clip_{request_number + 1:04d}_{camera}_{request['start_ms']}_{request['end_ms']}.mp4")
+            if not pieces:
+                entry['status'] = 'not_found'
+            elif None in paths:
+                entry['status'] = 'failed'
+            elif len(paths) == 1:
+                os.replace(paths[0], output_path)
+                entry['status'], entry['output'] = 'ok', output_path
+            elif concat_pieces(paths, output_path, reencode=mixed_tiers(pieces, segments)):
+                entry['status'], entry['output'] = 'ok', output_path
+            else:
+                entry['status'] = 'failed'
+            manifest.append(entry)
+        return manifest
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+def run_batch(batch_path, output_dir, manifest_path=None, workers=None):
+    requests = load_batch_requests(batch_path)
+    if not requests:
+        print("No valid clip requests found.")
+        return 1
+    manifest = export_batch(requests, output_dir, workers)
+    manifest_path = manifest_path or os.path.join(output_dir, 'manifest.json')
+    with open(manifest_path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    exported = sum(1 for entry in manifest if entry['status'] == 'ok')
+    print(f"Exported {exported} of {len(manifest)} clip(s). Manifest: {manifest_path}")
+    return 0 if exported == len(manifest) else 1
+
 # ------------------- Main -------------------
-def main():
+def main(previews=False):
     try:
         # Get millisecond timestamp input
         while True:
@@ -169,6 +614,16 @@ def main():
         end_dt = datetime.fromtimestamp(end_epoch)
         print(f"Searching for videos between {start_dt.strftime('%Y-%m-%d %I:%M:%S %p')} and {end_dt.strftime('%Y-%m-%d %I:%M:%S %p')}")
 
+        # Warn about known recording gaps so missing footage is not mistaken for a search failure
+        for gap in find_gaps(start_ms, end_ms):
+            gap_start = datetime.fromtimestamp(gap['start_ms'] / 1000).strftime('%Y-%m-%d %I:%M:%S %p')
+            gap_end = datetime.fromtimestamp(gap['end_ms'] / 1000).strftime('%Y-%m-%d %I:%M:%S %p')
+            print(f"Warning: no footage from {gap_start} to {gap_end} on {gap.get('camera')} ({gap.get('reason')})")
+
+        if previews:
+            show_previews(start_ms, end_ms)
+            return
+
         # List videos within the time range
         videos = list_videos(start_ms, end_ms)
         if not videos:
@@ -220,4 +675,20 @@ def main():
         print(f"Unexpected error: {e}")
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Download and crop recorded videos by time range.")
+    parser.add_argument('--previews', action='store_true',
+                        help='download sprite sheets and preview videos instead of the recordings')
+    parser.add_argument('--batch', metavar='FILE',
+                        help='export every clip listed in a CSV or JSON file of camera,start_ms,end_ms')
+    parser.add_argument('--output-dir', default=BATCH_OUTPUT_DIR, help='batch clip folder (default: %(default)s)')
+    parser.add_argument('--manifest', help='batch manifest path (default: <output-dir>/manifest.json)')
+    parser.add_argument('--workers', type=int, default=None, help='parallel crop processes (default: CPU count)')
+    parser.add_argument('--trace', metavar='FILE', nargs='?', const='',
+                        help='write a Chrome trace of where time went (default file: downloader_trace_<time>.json)')
+    parser.add_argument('--profile', action='store_true', help='also sample Python stacks into the trace')
+    args = parser.parse_args()
+    if args.trace is not None or args.profile:
+        tracing.start(args.trace or tracing.default_path('downloader'), profile=args.profile)
+    if args.batch:
+        sys.exit(run_batch(args.batch, args.output_dir, args.manifest, args.workers))
+    main(previews=args.previews)
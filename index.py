@@ -7,23 +7,60 @@ import time
 from datetime import datetime
 import re
 import logging
-import boto3
-from botocore.exceptions import ClientError, NoCredentialsError
+import logging.handlers
+import atexit
+import gzip
+import hashlib
+import base64
 import queue
 from pathlib import Path
 import webbrowser
 import socket
-from http.server import HTTPServer, BaseHTTPRequestHandler
+from http.server import HTTPServer, ThreadingHTTPServer, BaseHTTPRequestHandler
+import socketserver
+from urllib.parse import parse_qs
+import argparse
+import signal
 import select
+import json
+import shutil
+import math
+import platform
+from concurrent.futures import ThreadPoolExecutor
+from recording_names import recording_name, is_recording_name, partition_path
+from camera_ingest import IngestHub
+from storage_backend import create_backend
+from timeline import Timeline
+import tracing
 
 active_live_servers = []
 
+# ------------------- Shared Ingest -------------------
+ingest_hub = IngestHub()
+
+def shared_url(url):
+    """Loopback URL relaying url through the shared ingest, or url itself when sharing is off"""
+    if SHARED_INGEST:
+        return ingest_hub.local_url(url)
+    return url
+
+def ingest_camera(selected_camera):
+    """selected_camera with an IP camera's URLs pointed at the shared ingest"""
+    camera_info, method = selected_camera
+    if SHARED_INGEST and isinstance(camera_info, tuple) and camera_info[0].startswith('http'):
+        return tuple(shared_url(url) for url in camera_info), method
+    return selected_camera
+
 # ------------------- S3 Configuration -------------------
 AWS_ACCESS_KEY_ID = ''
 AWS_SECRET_ACCESS_KEY = ''
 AWS_REGION = 'eu-north-1'
 S3_BUCKET_NAME = 'my-bucket-save'
 S3_FOLDER_PREFIX = 'recorded-videos/'
+S3_ENDPOINT_URL = None  # set for S3-compatible stores (MinIO, moto server)
+STORAGE_BACKEND = 's3'  # 's3', 's3-compatible' (MinIO or another S3 API at S3_ENDPOINT_URL) or 'local'
+LOCAL_STORE_PATH = 'object-store'  # folder (or NAS mount) the 'local' backend keeps S3_BUCKET_NAME in
+S3_KEY_LAYOUT = 'partitioned'  # 'partitioned' (<camera>/YYYY/MM/DD/HH/<name>) or 'flat'
 
 # ------------------- Integrated Devices -------------------
 INTEGRATED_DEVICES = [
@@ -32,16 +69,221 @@ INTEGRATED_DEVICES = [
     {"name": "Fayis Phone", "ip": "http://192.168.1.103:8080/video"}
 ]
 
+# ------------------- Storage Retention Configuration -------------------
+# Disk usage thresholds (percent of the recording drive)
+RETENTION_HIGH_WATERMARK = 85.0      # start evicting uploaded recordings
+RETENTION_LOW_WATERMARK = 75.0       # evict until usage drops below this
+RETENTION_CRITICAL_WATERMARK = 95.0  # stop recording before the drive is full
+RETENTION_CHECK_INTERVAL = 30        # seconds between disk usage checks
+KEEP_LOCAL_AFTER_UPLOAD = False      # keep uploaded files until retention evicts them
+
+# ------------------- Streaming Upload Configuration -------------------
+STREAMING_UPLOAD = False                  # tee ffmpeg's output into an S3 multipart upload while recording
+STREAMING_PART_SIZE = 8 * 1024 * 1024     # bytes per multipart part (S3 minimum is 5 MiB)
+MIN_MULTIPART_PART_SIZE = 5 * 1024 * 1024 # S3 rejects smaller parts, other than the last
+STREAMING_MAX_PENDING_PARTS = 4           # parts buffered in memory before falling back to a normal upload
+
+# ------------------- Upload Verification Configuration -------------------
+UPLOAD_PART_SIZE = 8 * 1024 * 1024        # bytes per part of queued uploads; smaller files go up in one request
+CHECKSUM_METADATA_KEY = 'sha256'          # object metadata holding the SHA-256 of the whole file
+STORAGE_RECHECK_INTERVAL = 60             # seconds between retries while the storage backend is unreachable
+
+# ------------------- Preview Configuration -------------------
+PREVIEWS_ENABLED = True
+PREVIEW_INTERVAL = 10          # seconds of footage per preview frame
+PREVIEW_SPRITE_COLUMNS = 10    # tiles per sprite sheet row
+PREVIEW_TILE_WIDTH = 160       # sprite tile width in pixels
+PREVIEW_VIDEO_WIDTH = 320      # width of the low-res preview video
+PREVIEW_VIDEO_FPS = 2          # preview frames shown per second of preview playback
+PREVIEW_WORKERS = 1
+
+# ------------------- Cloud Tier Configuration -------------------
+CLOUD_TIER = None   # TRANSCODE_TIERS entry uploaded in place of the original; None uploads originals
+TRANSCODE_TIERS = {
+    'compact': {'codec': 'libx264', 'preset': 'veryfast', 'crf': '30', 'max_height': 480, 'fps': 15, 'audio_bitrate': '64k'},
+    'hevc': {'codec': 'libx265', 'preset': 'fast', 'crf': '28', 'audio_bitrate': '96k'},
+    'hevc-720p': {'codec': 'libx265', 'preset': 'fast', 'crf': '28', 'max_height': 720, 'max_bitrate': '1500k', 'audio_bitrate': '64k'},
+}
+TRANSCODE_WORKERS = 1
+TIER_METADATA_KEY = 'tier'                      # object metadata naming the tier an upload was encoded at
+SOURCE_CHECKSUM_METADATA_KEY = 'source-sha256'  # object metadata holding the SHA-256 of the local original
+
+# ------------------- Storage Pool Configuration -------------------
+EXTRA_STORAGE_PATHS = []          # local volumes used alongside removable drives
+STORAGE_PLACEMENT = 'free_space'  # 'free_space' or 'round_robin'
+FRAGMENT_SECONDS = 2              # keyframe interval; bounds the footage lost on failover
+
+# ------------------- Watchdog Configuration -------------------
+WATCHDOG_INITIAL_BACKOFF = 1     # seconds before the first restart
+WATCHDOG_MAX_BACKOFF = 60        # cap for the exponential backoff
+WATCHDOG_STABLE_SECONDS = 60     # a segment running this long resets the backoff
+RECORDING_INDEX_FILE = 'recording_index.jsonl'
+RECORDING_INDEX_SYNC_INTERVAL = 30   # seconds between recording index uploads to S3
+
+# ------------------- Timeline Configuration -------------------
+TIMELINE_FILE = 'timeline.sqlite'
+TIMELINE_SYNC_INTERVAL = 300     # seconds between timeline uploads to S3
+BITRATE_WINDOW_SECONDS = 10      # bitrate is measured over windows this long, several fragments each
+BITRATE_SPIKE_FACTOR = 2.0       # recorded bitrate this many times the running average is a spike
+BITRATE_BASELINE_SECONDS = 300   # time constant of the running average; longer spikes become the new normal
+
+# ------------------- Encode Settings -------------------
+DEFAULT_ENCODE_SETTINGS = {'preset': 'fast', 'crf': '23'}
+# Applied on top of the current settings while the recording drive is above the high watermark
+LOW_SPACE_ENCODE_SETTINGS = {'crf': '30'}
+
+# ------------------- A/V Sync Configuration -------------------
+AUDIO_LATENCY_SECONDS = 0.0     # delay applied to audio, for cameras that send audio ahead of video
+AUDIO_RESAMPLE_ASYNC = 1000     # samples per second aresample may stretch audio to follow its timestamps
+AUDIO_MAX_GAP_SECONDS = 0.1     # audio timestamp gaps longer than this are filled with silence at once
+AV_RESYNC_DRIFT_MS = 200        # start a new segment once audio has drifted this far from video
+AV_RESYNC_MIN_SECONDS = 60      # shortest segment that may be cut short to resync
+MAX_SEGMENT_SECONDS = 3600      # start a new segment at least this often (0: never); also bounds file length
+
+# ------------------- Encoder Auto-Tuning -------------------
+AUTOTUNE_ENABLED = True
+AUTOTUNE_PROFILE_FILE = 'encoder_profile.json'
+AUTOTUNE_CPU_BUDGET = 0.75          # share of all cores that recording may use
+AUTOTUNE_SAMPLE_SECONDS = 3         # length of each synthetic encode
+AUTOTUNE_SAMPLE_RESOLUTION = '1280x720'
+AUTOTUNE_FPS = 30
+AUTOTUNE_PRESETS = ['medium', 'fast', 'faster', 'veryfast', 'superfast', 'ultrafast']  # best quality first
+AUTOTUNE_RESOLUTIONS = ['1920x1080', '1280x720', '960x540', '640x360']                  # largest first
+AUTOTUNE_FASTEST_PREFERRED = 'veryfast'  # drop resolution before going faster than this preset
+
+# ------------------- Adaptive Quality Configuration -------------------
+ADAPTIVE_QUALITY_ENABLED = True
+ADAPTIVE_CHECK_INTERVAL = 5         # seconds between load checks
+ADAPTIVE_SPEED_LOW = 0.95           # ffmpeg speed below this means the encode is falling behind realtime
+ADAPTIVE_CPU_HIGH = 90.0            # host CPU percent that counts as pressure
+ADAPTIVE_CPU_LOW = 60.0             # host CPU percent that leaves room to step back up
+ADAPTIVE_UPLOAD_BACKLOG = 10        # queued uploads that count as bandwidth pressure
+ADAPTIVE_PRESSURE_SECONDS = 20      # sustained pressure before stepping down a tier
+ADAPTIVE_HEADROOM_SECONDS = 300     # sustained headroom before stepping back up
+# Tier 0 is the session's own settings; each later tier only ever lowers quality further
+QUALITY_TIERS = [
+    {},
+    {'crf': '28', 'fps': 20},
+    {'crf': '30', 'fps': 15, 'resolution': '960x540'},
+    {'crf': '32', 'fps': 10, 'resolution': '640x360', 'preset': 'ultrafast'},
+]
+
+# ------------------- Frame Pipeline Configuration -------------------
+FRAME_CONSUMERS = []       # registered frame consumers run on every recording, e.g. ['motion']
+FRAME_SIZE = '320x180'     # frames handed to consumers are scaled to this size
+FRAME_FPS = 5
+FRAME_PIX_FMT = 'gray'     # 'gray' or 'rgb24'
+FRAME_BUFFERS = 3          # preallocated frame buffers per camera
+MOTION_THRESHOLD = 8.0     # mean absolute pixel change between frames that counts as motion
+MOTION_HOLD_SECONDS = 5    # quiet time before a motion event is closed
+
+# ------------------- Shared Ingest Configuration -------------------
+SHARED_INGEST = True       # one connection per IP camera, shared by recording, live view and stream checks
+
+# ------------------- Daemon Control API -------------------
+CONTROL_API_HOST = '127.0.0.1'
+CONTROL_API_PORT = 8765
+
 # ------------------- Logging Configuration -------------------
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('video_recorder.log')
-        # Removed StreamHandler to prevent terminal output
-    ]
-)
+LOG_FILE = 'video_recorder.log'
+LOG_MAX_BYTES = 10 * 1024 * 1024    # rotate the log at this size
+LOG_BACKUP_COUNT = 10               # gzipped rotations to keep
+LOG_JSON = True                     # one JSON object per line; False for plain text
+FFMPEG_LOG_REPEAT_WINDOW = 60       # seconds to fold identical FFmpeg lines together
+FFMPEG_LOG_MAX_PER_SECOND = 20      # FFmpeg lines per second before the rest are dropped
+
+class JsonLogFormatter(logging.Formatter):
+    """Formats records as single-line JSON objects"""
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'thread': record.threadName,
+            'message': record.getMessage()
+        }
+        for key in ('camera', 'repeated', 'dropped'):
+            if hasattr(record, key):
+                entry[key] = getattr(record, key)
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry)
+
+class CompressingRotatingFileHandler(logging.handlers.RotatingFileHandler):
+    """Size-based rotation that gzips each rotated file"""
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.namer = lambda name: name + '.gz'
+        self.rotator = self._compress
+
+    def _compress(self, source, dest):
+        with open(source, 'rb') as f_in, gzip.open(dest, 'wb') as f_out:
+            shutil.copyfileobj(f_in, f_out)
+        os.remove(source)
+
+class FFmpegLogRateLimiter(logging.Filter):
+    """Folds repeated FFmpeg lines together and caps FFmpeg lines per second.
+
+    A line seen again within FFMPEG_LOG_REPEAT_WINDOW is dropped and counted;
+    the count is attached to the next time that line is let through.
+    """
+    def __init__(self, repeat_window=FFMPEG_LOG_REPEAT_WINDOW, max_per_second=FFMPEG_LOG_MAX_PER_SECOND):
+        super().__init__()
+        self.repeat_window = repeat_window
+        self.max_per_second = max_per_second
+        self.recent = {}
+        self.tokens = max_per_second
+        self.last_refill = time.monotonic()
+        self.dropped = 0
+        self.lock = threading.Lock()
+
+    def filter(self, record):
+        now = time.monotonic()
+        key = (getattr(record, 'camera', None), record.getMessage())
+        with self.lock:
+            last_seen, repeated = self.recent.get(key, (None, 0))
+            if last_seen is not None and now - last_seen < self.repeat_window:
+                self.recent[key] = (last_seen, repeated + 1)
+                return False
+            self.tokens = min(self.max_per_second, self.tokens + (now - self.last_refill) * self.max_per_second)
+            self.last_refill = now
+            if self.tokens < 1:
+                self.dropped += 1
+                return False
+            self.tokens -= 1
+            if len(self.recent) > 1000:
+                self.recent = {k: v for k, v in self.recent.items() if now - v[0] < self.repeat_window}
+            self.recent[key] = (now, 0)
+            if repeated:
+                record.repeated = repeated
+                record.msg = f"{record.msg} (repeated {repeated} more times)"
+            if self.dropped:
+                record.dropped = self.dropped
+                self.dropped = 0
+        return True
+
+def setup_logging():
+    """Send all logging through a queue so file I/O happens on a listener thread"""
+    file_handler = CompressingRotatingFileHandler(LOG_FILE, maxBytes=LOG_MAX_BYTES,
+                                                  backupCount=LOG_BACKUP_COUNT)
+    if LOG_JSON:
+        file_handler.setFormatter(JsonLogFormatter())
+    else:
+        file_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+    log_queue = queue.Queue(-1)
+    root = logging.getLogger()
+    root.setLevel(logging.INFO)
+    # No StreamHandler to prevent terminal output
+    root.handlers = [logging.handlers.QueueHandler(log_queue)]
+    listener = logging.handlers.QueueListener(log_queue, file_handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    logging.getLogger('ffmpeg').addFilter(FFmpegLogRateLimiter())
+    return listener
+
+log_listener = setup_logging()
 logger = logging.getLogger(__name__)
+ffmpeg_logger = logging.getLogger('ffmpeg')
 
 # ------------------- Live Stream Server -------------------
 class LiveStreamHandler(BaseHTTPRequestHandler):
@@ -129,7 +371,7 @@ class LiveStreamHandler(BaseHTTPRequestHandler):
                     <div class="status">● Live Stream Active (Video Only)</div>
                     
                     <div class="video-container">
-                        <img src="{self.server.camera_url}" alt="Live Camera Feed" id="cameraFeed">
+                        <img src="{self.server.stream_url}" alt="Live Camera Feed" id="cameraFeed">
                     </div>
                     
                     <div class="info">
@@ -177,8 +419,9 @@ class LiveStreamHandler(BaseHTTPRequestHandler):
         pass
 
 class LiveStreamServer:
-    def __init__(self, camera_url, port=8000):
+    def __init__(self, camera_url, port=8000, stream_url=None):
         self.camera_url = camera_url
+        self.stream_url = stream_url or camera_url
         self.port = port
         self.server = None
         self.server_thread = None
@@ -205,6 +448,7 @@ class LiveStreamServer:
             self.port = free_port
             self.server = HTTPServer(('localhost', self.port), LiveStreamHandler)
             self.server.camera_url = self.camera_url
+            self.server.stream_url = self.stream_url
             self.server.start_time = self.start_time
             self.server.is_active = True
             
@@ -227,82 +471,206 @@ class LiveStreamServer:
             self.server.server_close()
             print("Live stream server stopped")
 
+# ------------------- S3 Key Layout -------------------
+def s3_key_for(file_name, folder='', recording=None):
+    """S3 key for a recording, or for a file belonging to `recording` (such as a preview) under `folder`"""
+    partition = partition_path(recording or file_name) if S3_KEY_LAYOUT == 'partitioned' else None
+    return f"{S3_FOLDER_PREFIX}{folder}{partition or ''}{os.path.basename(file_name)}"
+
+# ------------------- Upload Checksums -------------------
+def file_sha256(file_path):
+    sha256 = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(UPLOAD_PART_SIZE), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+class UploadChecksum:
+    """SHA-256 of an upload, built part by part from the data as it is sent.
+
+    Keeps the digest of every part too, so the checksum S3 computes for a
+    multipart object (a SHA-256 of the part digests) can be checked as well.
+    """
+    def __init__(self):
+        self.sha256 = hashlib.sha256()
+        self.part_digests = []
+        self.size = 0
+
+    def add_part(self, data):
+        """Hash one part; returns its base64 checksum for the upload request"""
+        self.sha256.update(data)
+        self.size += len(data)
+        digest = hashlib.sha256(data).digest()
+        self.part_digests.append(digest)
+        return base64.b64encode(digest).decode()
+
+    def hexdigest(self):
+        return self.sha256.hexdigest()
+
+    def s3_checksum(self, multipart):
+        """The ChecksumSHA256 S3 reports for the object, without its -<parts> suffix"""
+        if not multipart:
+            return base64.b64encode(self.sha256.digest()).decode()
+        return base64.b64encode(hashlib.sha256(b''.join(self.part_digests)).digest()).decode()
+
 # ------------------- S3 Upload Queue and Scheduler -------------------
 class S3UploadScheduler:
+    """Uploads finished files in the background.
+
+    Creating the scheduler touches neither boto3 nor the network. The
+    storage backend is built on first use and checked from the upload
+    thread, so an offline or slow network never delays startup. Files
+    queued while storage is unreachable wait until a recheck succeeds.
+    """
     def __init__(self):
         self.upload_queue = queue.Queue()
         self.running = True
         self.upload_thread = None
-        self.s3_client = None
-        self.initialize_s3_client()
+        self.storage = None
+        self.storage_lock = threading.Lock()
+        self.storage_available = None   # None until checked
+        self.storage_ready = threading.Event()
+        self.stop_event = threading.Event()
         self.is_active = True
-        
-    def initialize_s3_client(self):
+
+    def backend(self):
+        """The storage backend, created on first use; None if it is misconfigured"""
+        if self.storage is None and self.storage_available is not False:
+            with self.storage_lock:
+                if self.storage is None:
+                    try:
+                        self.storage = create_backend(STORAGE_BACKEND, S3_BUCKET_NAME, region=AWS_REGION,
+                                                      access_key=AWS_ACCESS_KEY_ID, secret_key=AWS_SECRET_ACCESS_KEY,
+                                                      endpoint_url=S3_ENDPOINT_URL, local_path=LOCAL_STORE_PATH)
+                    except Exception as e:
+                        logger.error(f"Failed to initialize {STORAGE_BACKEND} storage backend: {e}")
+                        self.storage_available = False
+        return self.storage
+
+    @tracing.traced(category='storage')
+    def check_storage(self):
+        """Check that the storage backend can be reached (head_bucket on S3); True if it can"""
+        storage = self.backend()
+        if storage is None:
+            return False
         try:
-            self.s3_client = boto3.client(
-                's3',
-                aws_access_key_id=AWS_ACCESS_KEY_ID,
-                aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
-                region_name=AWS_REGION
-            )
-            self.s3_client.head_bucket(Bucket=S3_BUCKET_NAME)
-            logger.info("S3 client initialized successfully")
-        except NoCredentialsError:
-            logger.error("AWS credentials not found. Please configure AWS_ACCESS_KEY_ID and AWS_SECRET_ACCESS_KEY")
-            self.s3_client = None
-        except ClientError as e:
-            logger.error(f"Failed to initialize S3 client: {e}")
-            self.s3_client = None
+            storage.check()
+            if not self.storage_available:
+                logger.info(f"Storage backend initialized successfully: {storage.name}")
+            self.storage_available = True
+            self.storage_ready.set()
         except Exception as e:
-            logger.error(f"Unexpected error initializing S3 client: {e}")
-            self.s3_client = None
+            # Logged once per outage rather than on every recheck
+            if self.storage_available is not False:
+                logger.error(f"{STORAGE_BACKEND} storage backend unavailable, retrying every {STORAGE_RECHECK_INTERVAL}s: {e}")
+            self.storage_available = False
+            self.storage_ready.clear()
+        return self.storage_available
+
+    def usable(self):
+        """False once storage is known to be unreachable; True while it is fine or not yet checked"""
+        return self.storage_available is not False and self.backend() is not None
     
     def start_scheduler(self):
-        if self.s3_client is None:
-            logger.warning("S3 client not initialized. Upload scheduler will not start.")
-            return
+        self.running = True
+        self.stop_event.clear()
         self.upload_thread = threading.Thread(target=self._upload_worker, daemon=True)
         self.upload_thread.start()
         logger.info("S3 upload scheduler started")
     
     def stop_scheduler(self):
         self.running = False
+        self.stop_event.set()
         if self.upload_thread:
             self.upload_thread.join(timeout=5)
         logger.info("S3 upload scheduler stopped")
     
-    def queue_upload(self, file_path):
-        if self.s3_client is None:
-            logger.warning(f"S3 client not available. Skipping upload for {file_path}")
-            return
+    def queue_upload(self, file_path, s3_key=None, delete_after=True, sha256=None, metadata=None):
+        """Queue file_path for upload; sha256 is its hash if already known, checked against what is read.
+
+        metadata is stored on the object alongside the SHA-256.
+        """
         if os.path.exists(file_path):
-            self.upload_queue.put(file_path)
+            self.upload_queue.put((file_path, s3_key, delete_after, sha256, metadata, tracing.clock()))
             logger.info(f"Queued for upload: {file_path}")
         else:
             logger.error(f"File not found for upload: {file_path}")
     
-    def check_file_exists_in_s3(self, file_name):
-        """Check if a file exists in the S3 bucket"""
-        if self.s3_client is None:
+    @tracing.traced(category='storage')
+    def is_uploaded(self, file_path):
+        """Check that S3 holds this exact file, or a cloud tier copy made from it.
+
+        A direct upload must have the same size and, where recorded, the same
+        SHA-256. A tier copy is smaller, so it must name this file's SHA-256
+        as its source instead.
+        """
+        if not self.usable():
             return False
-        try:
-            s3_key = f"{S3_FOLDER_PREFIX}{file_name}"
-            self.s3_client.head_object(Bucket=S3_BUCKET_NAME, Key=s3_key)
-            return True
-        except ClientError as e:
-            if e.response['Error']['Code'] == '404':
+        file_name = os.path.basename(file_path)
+        # Objects uploaded before the partitioned layout stay flat until migrated
+        for s3_key in dict.fromkeys([s3_key_for(file_name), f"{S3_FOLDER_PREFIX}{file_name}"]):
+            try:
+                head = self.storage.head(s3_key)
+            except Exception as e:
+                logger.error(f"Error checking file existence in S3 for {file_name}: {e}")
+                return False
+            if head is None:
+                continue
+            source = head['metadata'].get(SOURCE_CHECKSUM_METADATA_KEY)
+            if source:
+                if file_sha256(file_path) != source:
+                    logger.warning(f"S3 {head['metadata'].get(TIER_METADATA_KEY)} tier of {file_name} was not made from the local file")
+                    return False
+                return True
+            if head['size'] != os.path.getsize(file_path):
+                logger.warning(f"S3 copy of {file_name} is {head['size']} bytes, local file is {os.path.getsize(file_path)}")
                 return False
-            logger.error(f"Error checking file existence in S3 for {file_name}: {e}")
+            expected = head['metadata'].get(CHECKSUM_METADATA_KEY)
+            # Uploads from before checksums were recorded can only be checked by size
+            if expected and file_sha256(file_path) != expected:
+                logger.warning(f"S3 copy of {file_name} does not match the local file's SHA-256")
+                return False
+            return True
+        return False
+
+    @tracing.traced(category='upload')
+    def verify_object(self, s3_key, size, sha256, s3_checksum=None):
+        """Read back an uploaded object's size, SHA-256 metadata and S3 checksum; True if all match"""
+        try:
+            head = self.storage.head(s3_key)
+        except Exception as e:
+            logger.error(f"Cannot verify upload of {s3_key}: {e}")
+            return False
+        if head is None:
+            logger.error(f"Upload verification failed for {s3_key}: object not found")
             return False
+        problems = []
+        if head['size'] != size:
+            problems.append(f"{head['size']} bytes instead of {size}")
+        if sha256 and head['metadata'].get(CHECKSUM_METADATA_KEY) != sha256:
+            problems.append("SHA-256 metadata does not match")
+        stored = head['checksum']
+        # S3-compatible stores may not keep checksums; the metadata check still applies
+        if s3_checksum and stored and stored.split('-')[0] != s3_checksum:
+            problems.append("S3 checksum does not match")
+        if problems:
+            logger.error(f"Upload verification failed for {s3_key}: {', '.join(problems)}")
+            return False
+        return True
     
     def _upload_worker(self):
         """Worker thread that processes the upload queue"""
         while self.running:
+            if not self.storage_available and not self.check_storage():
+                self.stop_event.wait(STORAGE_RECHECK_INTERVAL)
+                continue
             try:
                 # Wait for a file to upload with timeout
-                file_path = self.upload_queue.get(timeout=1)
+                file_path, s3_key, delete_after, sha256, metadata, queued_at = self.upload_queue.get(timeout=1)
                 if file_path:
-                    self._upload_file(file_path)
+                    tracing.interval('queue wait', queued_at, category='upload', file=os.path.basename(file_path))
+                    with tracing.span('upload', 'upload', file=os.path.basename(file_path)):
+                        self._upload_file(file_path, s3_key, delete_after, sha256, metadata)
                     self.upload_queue.task_done()
             except queue.Empty:
                 # Timeout occurred, continue checking if we should stop
@@ -311,43 +679,364 @@ class S3UploadScheduler:
                 logger.error(f"Error in upload worker: {e}")
                 continue
     
-    def _upload_file(self, file_path):
+    @tracing.traced('put', category='upload')
+    def _put_file(self, file_path, s3_key, sha256, metadata=None):
+        """Upload a file, hashing it as it is read; returns its UploadChecksum, or None if it changed on disk"""
+        checksum = UploadChecksum()
+        metadata = metadata or {}
+        file_size = os.path.getsize(file_path)
+        with open(file_path, 'rb') as f:
+            if file_size <= UPLOAD_PART_SIZE:
+                data = f.read()
+                part_checksum = checksum.add_part(data)
+                if sha256 is not None and checksum.hexdigest() != sha256:
+                    logger.warning(f"{os.path.basename(file_path)} changed after it was hashed; uploading it again")
+                    return None
+                self.storage.put(s3_key, data, metadata={**metadata, CHECKSUM_METADATA_KEY: checksum.hexdigest()},
+                                 checksum=part_checksum)
+                return checksum
+            # The hash goes into the object's metadata, which a multipart upload needs up front
+            if sha256 is None:
+                sha256 = file_sha256(file_path)
+            upload_id = self.storage.create_multipart(s3_key, metadata={**metadata, CHECKSUM_METADATA_KEY: sha256})
+            try:
+                parts = []
+                for data in iter(lambda: f.read(UPLOAD_PART_SIZE), b''):
+                    part_number = len(parts) + 1
+                    part_checksum = checksum.add_part(data)
+                    parts.append(self.storage.upload_part(s3_key, upload_id, part_number, data, part_checksum))
+                    progress = (checksum.size / file_size) * 100
+                    if progress % 10 < 1:
+                        logger.info(f"Upload progress for {os.path.basename(file_path)}: {progress:.1f}%")
+            except Exception:
+                self.storage.abort_multipart(s3_key, upload_id)
+                raise
+        if checksum.hexdigest() != sha256:
+            logger.warning(f"{os.path.basename(file_path)} changed after it was hashed; uploading it again")
+            self.storage.abort_multipart(s3_key, upload_id)
+            return None
+        self.storage.complete_multipart(s3_key, upload_id, parts)
+        return checksum
+
+    def _upload_file(self, file_path, s3_key=None, delete_after=True, sha256=None, metadata=None):
         try:
             file_name = os.path.basename(file_path)
-            s3_key = f"{S3_FOLDER_PREFIX}{file_name}"
+            s3_key = s3_key or s3_key_for(file_name)
             logger.info(f"Starting upload: {file_name}")
-            file_size = os.path.getsize(file_path)
-            uploaded_bytes = 0
-            
-            def upload_callback(bytes_transferred):
-                nonlocal uploaded_bytes
-                uploaded_bytes += bytes_transferred
-                progress = (uploaded_bytes / file_size) * 100
-                if progress % 10 < 1:
-                    logger.info(f"Upload progress for {file_name}: {progress:.1f}%")
-            
-            self.s3_client.upload_file(
-                file_path,
-                S3_BUCKET_NAME,
-                s3_key,
-                Callback=upload_callback
-            )
-            logger.info(f"Upload success: {file_name} - {datetime.now().strftime('%Y-%m-%d %I:%M:%S %p')}")
+            checksum = self._put_file(file_path, s3_key, sha256, metadata)
+            if checksum is None:
+                self.queue_upload(file_path, s3_key, delete_after, metadata=metadata)
+                return
+            multipart = len(checksum.part_digests) > 1
+            # Nothing is deleted until the object in S3 is known to match what was read
+            if not self.verify_object(s3_key, checksum.size, checksum.hexdigest(), checksum.s3_checksum(multipart)):
+                logger.error(f"Upload failed: {file_name} - verification failed, local file kept")
+                return
+            logger.info(f"Upload success: {file_name} (sha256 {checksum.hexdigest()}) - {datetime.now().strftime('%Y-%m-%d %I:%M:%S %p')}")
+            if not delete_after:
+                return
+            # A tier copy is scratch; the original it was made from is what stays local
+            if KEEP_LOCAL_AFTER_UPLOAD and not (metadata and SOURCE_CHECKSUM_METADATA_KEY in metadata):
+                logger.info(f"Local file kept until retention evicts it: {file_name}")
+                return
             try:
                 os.remove(file_path)
                 logger.info(f"Local file deleted: {file_name}")
             except Exception as e:
                 logger.error(f"Failed to delete local file {file_name}: {e}")
-        except ClientError as e:
-            logger.error(f"Upload failed: {file_name} - {e} - {datetime.now().strftime('%Y-%m-%d %I:%M:%S %p')}")
         except Exception as e:
             logger.error(f"Upload failed: {file_name} - {e} - {datetime.now().strftime('%Y-%m-%d %I:%M:%S %p')}")
 
+    def open_stream(self, file_name):
+        """Start a multipart upload fed while the file is still being recorded"""
+        # Until storage has been checked, recordings go through the queue instead
+        if not self.storage_available:
+            return None
+        try:
+            return S3StreamingUpload(self.storage, f"{S3_FOLDER_PREFIX}streaming/{file_name}")
+        except Exception as e:
+            logger.error(f"Cannot start streaming upload for {file_name}: {e}")
+            return None
+
+    @tracing.traced(category='upload')
+    def finish_stream(self, stream, final_file_name, sha256=None):
+        """Move a completed streaming upload to its final key; False means it must be uploaded again.
+
+        sha256 is the hash of the local file, which the streamed object must match.
+        """
+        if not stream.wait():
+            return False
+        checksum = stream.checksum
+        if sha256 and checksum.hexdigest() != sha256:
+            logger.error(f"Streamed upload of {final_file_name} does not match the local file")
+            stream.discard()
+            return False
+        if not self.verify_object(stream.s3_key, checksum.size, None, checksum.s3_checksum(multipart=True)):
+            stream.discard()
+            return False
+        s3_key = s3_key_for(final_file_name)
+        try:
+            self.storage.copy(stream.s3_key, s3_key, metadata={CHECKSUM_METADATA_KEY: checksum.hexdigest()})
+            if not self.verify_object(s3_key, checksum.size, checksum.hexdigest()):
+                return False
+            self.storage.delete(stream.s3_key)
+            logger.info(f"Streaming upload success: {final_file_name} - {datetime.now().strftime('%Y-%m-%d %I:%M:%S %p')}")
+            return True
+        except Exception as e:
+            logger.error(f"Failed to move streamed upload to {s3_key}: {e}")
+            return False
+
+# ------------------- Streaming Upload -------------------
+class S3StreamingUpload:
+    """Multipart upload fed with data as ffmpeg produces it.
+
+    Writes are buffered into parts of STREAMING_PART_SIZE and handed to a
+    worker thread, so a slow network never stalls the copy from ffmpeg's pipe.
+    If more than STREAMING_MAX_PENDING_PARTS are waiting, the upload is
+    abandoned and the finished local file goes through the normal queue instead.
+    """
+    def __init__(self, storage, s3_key):
+        self.storage = storage
+        self.s3_key = s3_key
+        self.upload_id = storage.create_multipart(s3_key)
+        self.buffer = bytearray()
+        self.parts = []
+        self.checksum = UploadChecksum()
+        self.part_queue = queue.Queue(maxsize=STREAMING_MAX_PENDING_PARTS)
+        self.failed = False
+        self.closed = False
+        self.completed = threading.Event()
+        self.succeeded = False
+        self.worker = threading.Thread(target=self._part_worker, daemon=True)
+        self.worker.start()
+
+    def write(self, data):
+        if self.failed or self.closed:
+            return
+        self.buffer += data
+        if len(self.buffer) >= STREAMING_PART_SIZE:
+            self._submit(bytes(self.buffer))
+            self.buffer.clear()
+
+    def _submit(self, data):
+        try:
+            self.part_queue.put_nowait(data)
+        except queue.Full:
+            logger.warning(f"Streaming upload of {self.s3_key} fell behind; falling back to a normal upload")
+            self.failed = True
+            self.buffer.clear()
+
+    def close(self):
+        """Flush the last part; completion happens on the worker thread"""
+        if self.closed:
+            return
+        self.closed = True
+        if not self.failed and self.buffer:
+            self._submit(bytes(self.buffer))
+        self.buffer = bytearray()
+        # The end marker must get through even when the queue is full
+        self.part_queue.put(None)
+
+    def wait(self, timeout=None):
+        """Block until the upload completed or was aborted; True if the object is in S3"""
+        self.completed.wait(timeout)
+        return self.succeeded
+
+    def discard(self):
+        """Remove the object of an upload whose recording turned out unusable"""
+        self.close()
+        if self.wait():
+            try:
+                self.storage.delete(self.s3_key)
+            except Exception as e:
+                logger.error(f"Failed to delete streamed object {self.s3_key}: {e}")
+
+    def _part_worker(self):
+        try:
+            while True:
+                data = self.part_queue.get()
+                if data is None:
+                    break
+                if self.failed:
+                    continue
+                part_number = len(self.parts) + 1
+                part_checksum = self.checksum.add_part(data)
+                self.parts.append(self.storage.upload_part(self.s3_key, self.upload_id, part_number, data, part_checksum))
+            if self.failed or not self.parts:
+                raise RuntimeError("nothing to complete")
+            self.storage.complete_multipart(self.s3_key, self.upload_id, self.parts)
+            self.succeeded = True
+        except Exception as e:
+            if not self.failed:
+                logger.error(f"Streaming upload of {self.s3_key} failed: {e}")
+            self.failed = True
+            try:
+                self.storage.abort_multipart(self.s3_key, self.upload_id)
+            except Exception:
+                pass
+            # Drain so close() never blocks on a dead worker
+            while data is not None:
+                data = self.part_queue.get()
+        finally:
+            self.completed.set()
+
 # ------------------- Global Upload Scheduler -------------------
 upload_scheduler = S3UploadScheduler()
 
+# ------------------- Storage Retention Manager -------------------
+class RetentionManager:
+    """Keeps the recording drive below its watermarks.
+
+    Evicts the oldest recordings that are already in S3 once usage crosses
+    RETENTION_HIGH_WATERMARK, and reports disk pressure so recording can drop
+    to a lower quality or pause before the drive is actually full.
+    """
+    def __init__(self, uploader):
+        self.uploader = uploader
+        self.video_folders = []
+        self.pressure = 'ok'
+        self.folder_pressure = {}
+        self.listeners = []
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.check_thread = None
+
+    def add_folder(self, folder):
+        with self.lock:
+            if folder not in self.video_folders:
+                self.video_folders.append(folder)
+
+    def add_listener(self, callback):
+        """Call callback(pressure) whenever the storage pressure changes"""
+        with self.lock:
+            self.listeners.append(callback)
+
+    def remove_listener(self, callback):
+        with self.lock:
+            if callback in self.listeners:
+                self.listeners.remove(callback)
+
+    def start(self):
+        if self.check_thread and self.check_thread.is_alive():
+            return
+        self.stop_event.clear()
+        self.enforce()
+        self.check_thread = threading.Thread(target=self._check_worker, daemon=True)
+        self.check_thread.start()
+        logger.info("Retention manager started")
+
+    def stop(self):
+        self.stop_event.set()
+        if self.check_thread:
+            self.check_thread.join(timeout=5)
+        logger.info("Retention manager stopped")
+
+    def _check_worker(self):
+        while not self.stop_event.wait(RETENTION_CHECK_INTERVAL):
+            try:
+                self.enforce()
+            except Exception as e:
+                logger.error(f"Error in retention manager: {e}")
+
+    def disk_usage_percent(self, folder):
+        return psutil.disk_usage(folder).percent
+
+    def _eviction_candidates(self, folder):
+        """Finished recordings in the folder, oldest first"""
+        candidates = []
+        for file_name in os.listdir(folder):
+            if is_recording_name(file_name):
+                file_path = os.path.join(folder, file_name)
+                if os.path.isfile(file_path):
+                    candidates.append((os.path.getmtime(file_path), file_path))
+        candidates.sort()
+        return [file_path for _, file_path in candidates]
+
+    def _evict_uploaded(self, folder):
+        for file_path in self._eviction_candidates(folder):
+            if self.disk_usage_percent(folder) < RETENTION_LOW_WATERMARK:
+                break
+            file_name = os.path.basename(file_path)
+            # Only files verified in S3 may go; everything else waits for upload
+            if not self.uploader.is_uploaded(file_path):
+                continue
+            try:
+                os.remove(file_path)
+                logger.info(f"Retention evicted uploaded file: {file_name}")
+            except OSError as e:
+                logger.error(f"Retention failed to evict {file_name}: {e}")
+                continue
+            self._evict_previews(folder, file_name)
+
+    def _evict_previews(self, folder, file_name):
+        preview_folder = os.path.join(folder, 'previews')
+        stem = os.path.splitext(file_name)[0]
+        if not os.path.isdir(preview_folder):
+            return
+        for preview_name in os.listdir(preview_folder):
+            if preview_name.startswith(f"{stem}_preview") or preview_name == f"{stem}_sprite.jpg":
+                try:
+                    os.remove(os.path.join(preview_folder, preview_name))
+                except OSError as e:
+                    logger.error(f"Retention failed to evict {preview_name}: {e}")
+
+    def enforce(self):
+        with self.lock:
+            folders = list(self.video_folders)
+        folder_pressure = {}
+        for folder in folders:
+            try:
+                if self.disk_usage_percent(folder) >= RETENTION_HIGH_WATERMARK:
+                    self._evict_uploaded(folder)
+                usage = self.disk_usage_percent(folder)
+            except OSError as e:
+                # Missing volumes are the storage pool's concern, not retention's
+                logger.error(f"Cannot check disk usage for {folder}: {e}")
+                continue
+            if usage >= RETENTION_CRITICAL_WATERMARK:
+                folder_pressure[folder] = 'critical'
+            elif usage >= RETENTION_HIGH_WATERMARK:
+                folder_pressure[folder] = 'degraded'
+            else:
+                folder_pressure[folder] = 'ok'
+        self.folder_pressure = folder_pressure
+        # Recording can go to whichever volume has the most room, so the
+        # overall pressure is that of the least loaded volume
+        pressure = 'critical'
+        for level in ('degraded', 'ok'):
+            if level in folder_pressure.values():
+                pressure = level
+        if not folder_pressure:
+            pressure = 'ok'
+        if pressure != self.pressure:
+            logger.warning(f"Storage pressure changed: {self.pressure} -> {pressure}")
+            self.pressure = pressure
+            with self.lock:
+                listeners = list(self.listeners)
+            for callback in listeners:
+                try:
+                    callback(pressure)
+                except Exception as e:
+                    logger.error(f"Error in storage pressure listener: {e}")
+        return pressure
+
+    def encode_settings(self, base=None):
+        base = base or DEFAULT_ENCODE_SETTINGS
+        if self.pressure == 'ok':
+            return base
+        return dict(base, **LOW_SPACE_ENCODE_SETTINGS)
+
+    def should_pause(self):
+        return self.pressure == 'critical'
+
+    def critical_folders(self):
+        return [folder for folder, level in self.folder_pressure.items() if level == 'critical']
+
+retention_manager = RetentionManager(upload_scheduler)
+
 # ------------------- Detect Removable Drives -------------------
-def find_removable_drive():
+def find_removable_drives():
+    drives = []
     partitions = psutil.disk_partitions(all=False)
     for partition in partitions:
         if 'removable' in partition.opts.lower():
@@ -357,32 +1046,284 @@ def find_removable_drive():
                 with open(test_file, 'w') as f:
                     f.write('test')
                 os.remove(test_file)
-                return partition.mountpoint
+                drives.append(partition.mountpoint)
             except (OSError, PermissionError) as e:
                 logger.error(f"Cannot write to drive {partition.mountpoint}: {e}")
                 continue
-    return None
+    return drives
+
+def find_removable_drive():
+    drives = find_removable_drives()
+    return drives[0] if drives else None
+
+# ------------------- Storage Pool -------------------
+class StoragePool:
+    """The set of volumes recordings can be written to.
+
+    Volumes are the writable removable drives plus EXTRA_STORAGE_PATHS. New
+    segments are placed by free space or round robin, and a volume that fails
+    a write is skipped until it shows up again on refresh().
+    """
+    def __init__(self, placement=STORAGE_PLACEMENT):
+        self.placement = placement
+        self.video_folders = []
+        self.failed_folders = set()
+        self.next_index = 0
+        self.lock = threading.Lock()
+
+    def refresh(self):
+        """Rescan volumes, picking up inserted drives and re-admitting recovered ones"""
+        mountpoints = find_removable_drives() + list(EXTRA_STORAGE_PATHS)
+        with self.lock:
+            for mountpoint in mountpoints:
+                folder = os.path.join(mountpoint, 'captured_videos')
+                try:
+                    os.makedirs(folder, exist_ok=True)
+                except OSError as e:
+                    logger.error(f"Cannot use storage volume {mountpoint}: {e}")
+                    continue
+                if folder not in self.video_folders:
+                    self.video_folders.append(folder)
+                    logger.info(f"Storage volume added: {folder}")
+                elif folder in self.failed_folders:
+                    self.failed_folders.discard(folder)
+                    logger.info(f"Storage volume available again: {folder}")
+        return list(self.video_folders)
+
+    def is_available(self, folder):
+        return folder not in self.failed_folders and os.path.isdir(folder) and os.access(folder, os.W_OK)
+
+    def mark_failed(self, folder):
+        with self.lock:
+            if folder not in self.failed_folders:
+                self.failed_folders.add(folder)
+                logger.error(f"Storage volume failed, removing from rotation: {folder}")
+
+    def _free_bytes(self, folder):
+        try:
+            return psutil.disk_usage(folder).free
+        except OSError:
+            return 0
+
+    def select_folder(self, exclude=()):
+        """Pick the volume for the next segment, or None if none are usable"""
+        with self.lock:
+            candidates = [folder for folder in self.video_folders
+                          if folder not in exclude and self.is_available(folder)]
+            if not candidates:
+                return None
+            if self.placement == 'round_robin':
+                folder = candidates[self.next_index % len(candidates)]
+                self.next_index += 1
+                return folder
+            return max(candidates, key=self._free_bytes)
+
+storage_pool = StoragePool()
+
+# ------------------- Failover Segment Writer -------------------
+class FailoverSegmentWriter:
+    """Copies ffmpeg's fragmented MP4 output from its stdout onto the storage pool.
+
+    The stream is split into top-level MP4 boxes. The init segment (ftyp/moov)
+    is kept in memory, and each fragment (moof+mdat) is written as a unit. If a
+    write fails because the drive was pulled or filled up, the current part is
+    closed, the volume is marked failed, and a new part file starting with the
+    init segment is opened on another volume. ffmpeg keeps running throughout.
+
+    With an uploader, every part is also teed into a streaming S3 upload.
+    """
+    def __init__(self, stream, pool, start_time, exclude=(), uploader=None):
+        self.stream = stream
+        self.pool = pool
+        self.uploader = uploader
+        self.start_time = start_time
+        self.exclude = set(exclude)
+        self.init_segment = b''
+        self.parts = []
+        self.current_file = None
+        self.current_part = None
+        self.bytes_written = 0
+        self.copy_thread = None
+        self.first_fragment = threading.Event()
+        self.opened_at = tracing.clock()
+
+    def start(self):
+        self.copy_thread = threading.Thread(target=self._copy_worker, daemon=True)
+        self.copy_thread.start()
+
+    def join(self, timeout=None):
+        if self.copy_thread:
+            self.copy_thread.join(timeout=timeout)
+
+    def _read_exact(self, size):
+        data = b''
+        while len(data) < size:
+            chunk = self.stream.read(size - len(data))
+            if not chunk:
+                break
+            data += chunk
+        return data
+
+    def _read_box(self):
+        header = self._read_exact(8)
+        if len(header) < 8:
+            return None, header
+        size = int.from_bytes(header[:4], 'big')
+        box_type = header[4:8]
+        if size == 1:
+            extended = self._read_exact(8)
+            header += extended
+            size = int.from_bytes(extended, 'big')
+        if size == 0:
+            # Box runs to the end of the stream
+            return box_type, header + self.stream.read()
+        return box_type, header + self._read_exact(size - len(header))
+
+    def _open_part(self, part_start):
+        while True:
+            folder = self.pool.select_folder(exclude=self.exclude)
+            if folder is None:
+                self.pool.refresh()
+                folder = self.pool.select_folder(exclude=self.exclude)
+                if folder is None:
+                    return False
+            temp_filename = f"temp_recording_{part_start.strftime('%Y%m%d_%H%M%S')}.mp4"
+            path = os.path.join(folder, temp_filename)
+            try:
+                self.current_file = open(path, 'wb')
+                self.current_file.write(self.init_segment)
+            except OSError as e:
+                logger.error(f"Cannot open recording part on {folder}: {e}")
+                self._close_part(part_start)
+                self.pool.mark_failed(folder)
+                continue
+            self.current_part = {'path': path, 'folder': folder, 'start': part_start, 'end': None, 'stream': None,
+                                 'sha256': hashlib.sha256(self.init_segment)}
+            self.parts.append(self.current_part)
+            if self.uploader:
+                self.current_part['stream'] = self.uploader.open_stream(temp_filename)
+                if self.current_part['stream']:
+                    self.current_part['stream'].write(self.init_segment)
+            logger.info(f"Recording part opened: {path}")
+            return True
+
+    def _close_part(self, part_end):
+        if self.current_file:
+            try:
+                self.current_file.close()
+            except OSError:
+                pass
+        if self.current_part:
+            self.current_part['end'] = part_end
+            if self.current_part['stream']:
+                self.current_part['stream'].close()
+        self.current_file = None
+        self.current_part = None
+
+    def _write(self, data):
+        for attempt in range(len(self.pool.video_folders) + 1):
+            if self.current_file is None:
+                part_start = self.start_time if not self.parts else datetime.now()
+                if not self._open_part(part_start):
+                    logger.error("No writable storage volume available. Dropping recorded data.")
+                    return
+            try:
+                self.current_file.write(data)
+                self.current_part['sha256'].update(data)
+                self.bytes_written += len(data)
+                if self.current_part['stream']:
+                    self.current_part['stream'].write(data)
+                return
+            except OSError as e:
+                folder = self.current_part['folder']
+                logger.error(f"Write to {folder} failed, failing over: {e}")
+                self._close_part(datetime.now())
+                self.pool.mark_failed(folder)
+
+    def _copy_worker(self):
+        pending_fragment = b''
+        try:
+            while True:
+                box_type, box = self._read_box()
+                if box_type is None:
+                    break
+                if not self.parts and box_type in (b'ftyp', b'moov'):
+                    self.init_segment += box
+                    if box_type == b'moov':
+                        self._write(b'')
+                elif box_type == b'moof':
+                    pending_fragment = box
+                elif box_type == b'mdat' and pending_fragment:
+                    self._write(pending_fragment + box)
+                    pending_fragment = b''
+                    if not self.first_fragment.is_set():
+                        tracing.complete('first frame', self.opened_at, category='recording')
+                        self.first_fragment.set()
+                else:
+                    self._write(box)
+        except Exception as e:
+            logger.error(f"Error copying ffmpeg output: {e}")
+        finally:
+            self._close_part(datetime.now())
+            self.first_fragment.set()
 
 # ------------------- Input Monitor Thread -------------------
+class StopSignal:
+    """A threading.Event that can also wake a thread blocked in select() on stdin"""
+    def __init__(self):
+        self.event = threading.Event()
+        self.wakeup_read = None
+        self.wakeup_write = None
+        if not sys.platform.startswith('win'):
+            self.wakeup_read, self.wakeup_write = os.pipe()
+
+    def set(self):
+        if self.event.is_set():
+            return
+        self.event.set()
+        if self.wakeup_write is not None:
+            try:
+                os.write(self.wakeup_write, b'x')
+            except OSError:
+                pass
+
+    def is_set(self):
+        return self.event.is_set()
+
+    def wait(self, timeout=None):
+        return self.event.wait(timeout)
+
+    def close(self):
+        for fd in (self.wakeup_read, self.wakeup_write):
+            if fd is not None:
+                try:
+                    os.close(fd)
+                except OSError:
+                    pass
+        self.wakeup_read = self.wakeup_write = None
+
 def monitor_input(stop_event):
     while not stop_event.is_set():
         try:
             if sys.platform.startswith('win'):
                 import msvcrt
+                # The Windows console cannot be waited on with select(), so poll it
                 while not stop_event.is_set():
                     if msvcrt.kbhit():
                         user_input = input().strip().lower()
                         if user_input == 'stop':
                             stop_event.set()
                             break
-                    time.sleep(0.05)
+                    stop_event.wait(0.05)
             else:
-                while not stop_event.is_set():
-                    if select.select([sys.stdin], [], [], 0.05)[0]:
-                        user_input = input().strip().lower()
-                        if user_input == 'stop':
-                            stop_event.set()
-                            break
+                # Block until a line arrives or the stop signal wakes us up
+                readable = select.select([sys.stdin, stop_event.wakeup_read], [], [])[0]
+                if sys.stdin in readable and not stop_event.is_set():
+                    user_input = sys.stdin.readline()
+                    if not user_input:
+                        break
+                    if user_input.strip().lower() == 'stop':
+                        stop_event.set()
         except EOFError:
             break
         except KeyboardInterrupt:
@@ -429,6 +1370,7 @@ def get_camera_list():
         return []
 
 # ------------------- Test Camera Access -------------------
+@tracing.traced(category='probe')
 def test_camera_access(camera_name):
     print(f"Testing camera access: {camera_name}")
     try:
@@ -474,6 +1416,7 @@ def test_camera_access(camera_name):
         return False, 0
 
 # ------------------- Test Audio Stream -------------------
+@tracing.traced(category='probe')
 def test_audio_stream(audio_url):
     print(f"Testing audio stream: {audio_url}")
     test_file = 'test_audio.opus'
@@ -485,7 +1428,7 @@ def test_audio_stream(audio_url):
         '-reconnect', '1',
         '-reconnect_streamed', '1',
         '-reconnect_delay_max', '5',
-        '-i', audio_url,
+        '-i', shared_url(audio_url),
         '-t', '5',
         '-c:a', 'copy',
         test_file
@@ -510,6 +1453,7 @@ def test_audio_stream(audio_url):
         return False
 
 # ------------------- Test Video Stream -------------------
+@tracing.traced(category='probe')
 def test_video_stream(video_url):
     print(f"Testing video stream: {video_url}")
     test_file = 'test_video.mjpeg'
@@ -524,7 +1468,7 @@ def test_video_stream(video_url):
         '-reconnect_delay_max', '5',
         '-timeout', '5000000',
         '-f', 'mpjpeg',
-        '-i', video_url,
+        '-i', shared_url(video_url),
         '-t', '5',
         '-c:v', 'copy',
         test_file
@@ -549,6 +1493,7 @@ def test_video_stream(video_url):
         return False
 
 # ------------------- Validate Output File -------------------
+@tracing.traced(category='finalize')
 def validate_output_file(file_path):
     try:
         result = subprocess.run(
@@ -556,7 +1501,6 @@ def validate_output_file(file_path):
             capture_output=True, text=True
         )
         if result.returncode == 0:
-            import json
             data = json.loads(result.stdout)
             streams = data.get('streams', [])
             video_streams = [s for s in streams if s['codec_type'] == 'video']
@@ -574,6 +1518,20 @@ def validate_output_file(file_path):
         print(f"✗ Error validating output file '{file_path}': {e}")
         return False
 
+# ------------------- Find Audio Stream -------------------
+def find_audio_url(ip_url):
+    audio_url = ip_url.replace('/video', '/audio.opus')
+    if not test_audio_stream(audio_url):
+        print(f"Warning: Audio stream at {audio_url} is not accessible.")
+        audio_url_aac = ip_url.replace('/video', '/audio.aac')
+        print(f"Trying fallback audio stream: {audio_url_aac}")
+        if test_audio_stream(audio_url_aac):
+            print(f"Fallback audio stream {audio_url_aac} is accessible.")
+            audio_url = audio_url_aac
+        else:
+            print("Warning: Fallback audio stream also inaccessible. Recording may not include audio.")
+    return audio_url
+
 # ------------------- Camera Selection -------------------
 def select_camera():
     print("\n=== Camera Selection ===")
@@ -620,16 +1578,7 @@ def select_camera():
             if not test_video_stream(ip_url):
                 print(f"Error: Video stream at {ip_url} is not accessible. Please check the IP Webcam app and network.")
                 continue
-            audio_url = ip_url.replace('/video', '/audio.opus')
-            if not test_audio_stream(audio_url):
-                print(f"Warning: Audio stream at {audio_url} is not accessible.")
-                audio_url_aac = ip_url.replace('/video', '/audio.aac')
-                print(f"Trying fallback audio stream: {audio_url_aac}")
-                if test_audio_stream(audio_url_aac):
-                    print(f"Fallback audio stream {audio_url_aac} is accessible.")
-                    audio_url = audio_url_aac
-                else:
-                    print("Warning: Fallback audio stream also inaccessible. Recording may not include audio.")
+            audio_url = find_audio_url(ip_url)
             print("Options:")
             print("1. Record video")
             print("2. Live stream view")
@@ -662,16 +1611,7 @@ def select_camera():
                         if not test_video_stream(ip_url):
                             print(f"Error: Video stream at {ip_url} is not accessible. Please check the device and network.")
                             continue
-                        audio_url = ip_url.replace('/video', '/audio.opus')
-                        if not test_audio_stream(audio_url):
-                            print(f"Warning: Audio stream at {audio_url} is not accessible.")
-                            audio_url_aac = ip_url.replace('/video', '/audio.aac')
-                            print(f"Trying fallback audio stream: {audio_url_aac}")
-                            if test_audio_stream(audio_url_aac):
-                                print(f"Fallback audio stream {audio_url_aac} is accessible.")
-                                audio_url = audio_url_aac
-                            else:
-                                print("Warning: Fallback audio stream also inaccessible. Recording may not include audio.")
+                        audio_url = find_audio_url(ip_url)
                         print("Options:")
                         print("1. Record video")
                         print("2. Live stream view")
@@ -706,7 +1646,7 @@ def close_browser_tabs(url):
 def start_live_stream(camera_url, audio_url):
     print(f"\n=== Starting Live Stream ===")
     print(f"Camera URL: {camera_url}")
-    live_server = LiveStreamServer(camera_url)
+    live_server = LiveStreamServer(camera_url, stream_url=shared_url(camera_url))
     live_url = live_server.start_server()
     if live_url:
         print(f"Live stream available at: {live_url}")
@@ -725,28 +1665,11 @@ def start_live_stream(camera_url, audio_url):
         print("="*50)
         print('Type "stop" and press Enter to stop the live stream')
         print("="*50)
-        stop_event = threading.Event()
-        def check_input():
-            while not stop_event.is_set():
-                if sys.platform.startswith('win'):
-                    import msvcrt
-                    if msvcrt.kbhit():
-                        user_input = input().strip().lower()
-                        if user_input == 'stop':
-                            stop_event.set()
-                            break
-                    time.sleep(0.05)
-                else:
-                    if select.select([sys.stdin], [], [], 0.05)[0]:
-                        user_input = input().strip().lower()
-                        if user_input == 'stop':
-                            stop_event.set()
-                            break
-        input_thread = threading.Thread(target=check_input, daemon=True)
+        stop_event = StopSignal()
+        input_thread = threading.Thread(target=monitor_input, args=(stop_event,), daemon=True)
         input_thread.start()
         try:
-            while not stop_event.is_set():
-                time.sleep(0.1)
+            stop_event.wait()
             cleanup_thread = threading.Thread(target=live_server.stop_server, daemon=True)
             cleanup_thread.start()
             print("Live stream stopping in background...")
@@ -759,41 +1682,72 @@ def start_live_stream(camera_url, audio_url):
             stop_event.set()
             input_thread.join(timeout=2)
             cleanup_thread.join(timeout=2)
+            stop_event.close()
 
 # ------------------- Build FFmpeg Command -------------------
-def build_ffmpeg_command(camera_info, output_path):
+def mp4_output_args(output_path):
+    if output_path.startswith('pipe:'):
+        # Fragmented MP4 so the stream can be split and written by FailoverSegmentWriter
+        return [
+            '-force_key_frames', f'expr:gte(t,n_forced*{FRAGMENT_SECONDS})',
+            '-movflags', '+frag_keyframe+empty_moov+default_base_moof',
+            '-f', 'mp4',
+            output_path
+        ]
+    return ['-f', 'mp4', output_path]
+
+def video_encode_args(settings, scale=True, filters=()):
+    args = ['-c:v', 'libx264', '-preset', settings['preset'], '-crf', settings['crf']]
+    if settings.get('threads'):
+        args += ['-threads', str(settings['threads'])]
+    filters = list(filters)
+    if scale and settings.get('resolution'):
+        width = settings['resolution'].split('x')[0]
+        # Only ever scale down, keeping the camera's aspect ratio
+        filters.append(f"scale=w='min(iw,{width})':h=-2")
+    if filters:
+        args += ['-vf', ','.join(filters)]
+    if scale and settings.get('fps'):
+        args += ['-r', str(settings['fps'])]
+    return args
+
+WALLCLOCK_VIDEO_FILTERS = ['settb=1/1000', 'setpts=(RTCTIME-RTCSTART)/(TB*1000000)']
+
+def build_ffmpeg_command(camera_info, output_path, encode_settings=None):
     camera_name, method = camera_info
+    settings = encode_settings or DEFAULT_ENCODE_SETTINGS
     if isinstance(camera_name, tuple) and camera_name[0].startswith('http'):
         video_url, audio_url = camera_name
+        # MJPEG carries no timestamps and ffmpeg would otherwise assume 25fps,
+        # so frames are stamped with the wall clock as they are decoded. Audio
+        # keeps its own sample clock from the start of the segment; aresample
+        # fills gaps in it with silence so later audio stays in place.
+        audio_offset = ['-itsoffset', str(AUDIO_LATENCY_SECONDS)] if AUDIO_LATENCY_SECONDS else []
         ffmpeg_command = [
             'ffmpeg',
             '-y',
             '-loglevel', 'info',
-            '-re',
             '-fflags', '+nobuffer',
+            '-thread_queue_size', '512',
             '-reconnect', '1',
             '-reconnect_streamed', '1',
             '-reconnect_on_network_error', '1',
             '-reconnect_delay_max', '5',
             '-timeout', '5000000',
             '-f', 'mpjpeg',
-            '-itsoffset', '5',
             '-i', video_url,
+            '-thread_queue_size', '512',
+        ] + audio_offset + [
             '-i', audio_url,
-            '-c:v', 'libx264',
-            '-preset', 'fast',
-            '-crf', '23',
+        ] + video_encode_args(settings, filters=WALLCLOCK_VIDEO_FILTERS) + [
             '-pix_fmt', 'yuv420p',
+            '-af', f'aresample=async={AUDIO_RESAMPLE_ASYNC}:min_hard_comp={AUDIO_MAX_GAP_SECONDS}',
             '-c:a', 'aac',
             '-b:a', '128k',
             '-strict', '-2',
             '-map', '0:v:0',
             '-map', '1:a:0',
-            '-async', '1',
-            '-shortest',
-            '-f', 'mp4',
-            output_path
-        ]
+        ] + mp4_output_args(output_path)
         return ffmpeg_command, None
     else:
         if method == 1:
@@ -808,46 +1762,1560 @@ def build_ffmpeg_command(camera_info, output_path):
             '-loglevel', 'info',
             '-f', 'dshow',
             '-i', f'{input_param}:audio="Microphone (your-microphone-name)"',
-            '-c:v', 'libx264',
-            '-preset', 'fast',
-            '-crf', '23',
+        ] + video_encode_args(settings, scale=False) + [
             '-pix_fmt', 'yuv420p',
             '-c:a', 'aac',
             '-b:a', '128k',
-            '-r', '30',
-            '-s', '1280x720',
-            '-f', 'mp4',
-            output_path
-        ], None
+            '-r', str(settings.get('fps', 30)),
+            '-s', settings.get('resolution', '1280x720'),
+        ] + mp4_output_args(output_path), None
 
 # ------------------- Generate Filename with Start and End Time -------------------
-def generate_filename(start_time, end_time=None):
-    start_str = start_time.strftime("%Y-%m-%d_%I-%M-%S_%p")
-    if end_time:
-        end_str = end_time.strftime("%I-%M-%S_%p")
-        return f"captured_video_{start_str}_to_{end_str}.mp4"
+def generate_filename(start_time, end_time=None, camera_id=None):
+    # Sortable rec_<start ms>_<duration ms>_<camera>.mp4, see recording_names.py
+    return recording_name(start_time, end_time, camera_id)
+
+# ------------------- Preview Generator -------------------
+def lower_priority(process):
+    """Run a helper ffmpeg process below the priority of the recorders"""
+    try:
+        psutil.Process(process.pid).nice(psutil.BELOW_NORMAL_PRIORITY_CLASS if os.name == 'nt' else 10)
+    except Exception as e:
+        logger.debug(f"Cannot lower priority of process {process.pid}: {e}")
+
+class PreviewGenerator:
+    """Makes a sprite sheet and a low-res preview video for each saved recording.
+
+    Work runs on a small pool of worker threads with low-priority ffmpeg
+    processes. Only keyframes are decoded, so an hour of footage takes
+    seconds. Results are uploaded to S3_FOLDER_PREFIX/previews/ together with
+    a JSON sidecar that maps sprite tiles to times. The recording is passed to
+    `then` once its previews exist, because uploading it may delete it.
+    """
+    def __init__(self, workers=PREVIEW_WORKERS):
+        self.workers = workers
+        self.executor = None
+        self.lock = threading.Lock()
+
+    def submit(self, video_path, start_time, end_time, then):
+        if not PREVIEWS_ENABLED:
+            then(video_path)
+            return
+        with self.lock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='preview')
+            self.executor.submit(self._run, video_path, start_time, end_time, then)
+
+    def shutdown(self):
+        """Wait for queued previews so their recordings are handed on before exit"""
+        with self.lock:
+            executor, self.executor = self.executor, None
+        if executor:
+            executor.shutdown(wait=True)
+
+    def _run(self, video_path, start_time, end_time, then):
+        try:
+            self.generate(video_path, start_time, end_time)
+        except Exception as e:
+            logger.error(f"Preview generation failed for {video_path}: {e}")
+        finally:
+            then(video_path)
+
+    def generate(self, video_path, start_time, end_time):
+        folder = os.path.join(os.path.dirname(video_path), 'previews')
+        os.makedirs(folder, exist_ok=True)
+        video_name = os.path.basename(video_path)
+        stem = os.path.splitext(video_name)[0]
+        duration = max((end_time - start_time).total_seconds(), 1)
+        frames = math.ceil(duration / PREVIEW_INTERVAL) + 1
+        columns = min(PREVIEW_SPRITE_COLUMNS, frames)
+        rows = math.ceil(frames / columns)
+        sprite_path = os.path.join(folder, f"{stem}_sprite.jpg")
+        preview_path = os.path.join(folder, f"{stem}_preview.mp4")
+        info_path = os.path.join(folder, f"{stem}_preview.json")
+        command = [
+            'ffmpeg', '-y', '-loglevel', 'error',
+            '-skip_frame', 'nokey',
+            '-i', video_path,
+            '-an',
+            '-filter_complex',
+            f"[0:v]fps=1/{PREVIEW_INTERVAL},split[s][p];"
+            f"[s]scale={PREVIEW_TILE_WIDTH}:-2,tile={columns}x{rows}[sprite];"
+            f"[p]scale={PREVIEW_VIDEO_WIDTH}:-2,setpts=N/{PREVIEW_VIDEO_FPS}/TB[preview]",
+            '-map', '[sprite]', '-frames:v', '1', '-q:v', '5', sprite_path,
+            '-map', '[preview]', '-c:v', 'libx264', '-preset', 'veryfast', '-crf', '32',
+            '-pix_fmt', 'yuv420p', '-r', str(PREVIEW_VIDEO_FPS), preview_path
+        ]
+        process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        lower_priority(process)
+        _, stderr = process.communicate()
+        if process.returncode != 0:
+            logger.error(f"Preview ffmpeg failed for {video_name}: {stderr.decode('utf-8', errors='replace').strip()}")
+            return False
+        with open(info_path, 'w') as f:
+            json.dump({
+                'video': video_name,
+                'start_ms': int(start_time.timestamp() * 1000),
+                'end_ms': int(end_time.timestamp() * 1000),
+                'interval': PREVIEW_INTERVAL,
+                'columns': columns,
+                'rows': rows,
+                'tile_width': PREVIEW_TILE_WIDTH,
+                'sprite': os.path.basename(sprite_path),
+                'preview': os.path.basename(preview_path)
+            }, f)
+        logger.info(f"Previews created for {video_name}")
+        for path in (sprite_path, preview_path, info_path):
+            upload_scheduler.queue_upload(path, s3_key=s3_key_for(path, 'previews/', recording=video_name))
+        return True
+
+preview_generator = PreviewGenerator()
+
+# ------------------- Cloud Tier Transcoder -------------------
+class TierTranscoder:
+    """Re-encodes saved recordings at CLOUD_TIER so a smaller copy goes to S3.
+
+    The full-quality original stays on the drive until retention evicts it.
+    The tier copy is written to a 'cloud' subfolder and uploaded under the
+    original's key, with the original's SHA-256 in its metadata so that
+    is_uploaded() accepts it for the original. It is deleted once verified.
+    Like previews, work runs on a small pool of low-priority ffmpeg
+    processes. If a transcode fails, the original is uploaded instead.
+    """
+    def __init__(self, workers=TRANSCODE_WORKERS):
+        self.workers = workers
+        self.executor = None
+        self.lock = threading.Lock()
+
+    def submit(self, video_path, sha256=None):
+        """Upload a recording at CLOUD_TIER; sha256 is the original's hash if already known"""
+        if not CLOUD_TIER:
+            upload_scheduler.queue_upload(video_path, sha256=sha256)
+            return
+        with self.lock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='transcode')
+            self.executor.submit(self._run, video_path, sha256)
+
+    def shutdown(self):
+        """Wait for queued transcodes so their uploads are queued before exit"""
+        with self.lock:
+            executor, self.executor = self.executor, None
+        if executor:
+            executor.shutdown(wait=True)
+
+    def _run(self, video_path, sha256):
+        video_name = os.path.basename(video_path)
+        try:
+            tier_path = self.transcode(video_path, CLOUD_TIER)
+            if tier_path:
+                upload_scheduler.queue_upload(tier_path, s3_key=s3_key_for(video_name), metadata={
+                    TIER_METADATA_KEY: CLOUD_TIER,
+                    SOURCE_CHECKSUM_METADATA_KEY: sha256 or file_sha256(video_path)
+                })
+                return
+        except Exception as e:
+            logger.error(f"Transcoding {video_name} to the {CLOUD_TIER} tier failed: {e}")
+        logger.warning(f"Uploading the original of {video_name} instead of the {CLOUD_TIER} tier")
+        upload_scheduler.queue_upload(video_path, sha256=sha256)
+
+    def command(self, video_path, output_path, tier):
+        settings = TRANSCODE_TIERS[tier]
+        filters = []
+        if settings.get('max_height'):
+            filters.append(f"scale=-2:'min({settings['max_height']},ih)',setsar=1")
+        if settings.get('fps'):
+            filters.append(f"fps={settings['fps']}")
+        command = [
+            'ffmpeg', '-y', '-loglevel', 'error',
+            '-i', video_path,
+            '-map', '0:v:0', '-map', '0:a?',
+            '-c:v', settings['codec'], '-preset', settings['preset'], '-crf', str(settings['crf']),
+            '-pix_fmt', 'yuv420p'
+        ]
+        if filters:
+            command += ['-vf', ','.join(filters)]
+        if settings.get('max_bitrate'):
+            command += ['-maxrate', settings['max_bitrate'], '-bufsize', settings['max_bitrate']]
+        if settings['codec'] == 'libx265':
+            # Tagged hvc1 so Safari and QuickTime will play it
+            command += ['-tag:v', 'hvc1']
+        command += ['-c:a', 'aac', '-b:a', settings.get('audio_bitrate', '96k'), '-movflags', '+faststart', output_path]
+        return command
+
+    def transcode(self, video_path, tier):
+        """Write the tier copy of video_path; returns its path, or None on failure"""
+        folder = os.path.join(os.path.dirname(video_path), 'cloud')
+        os.makedirs(folder, exist_ok=True)
+        video_name = os.path.basename(video_path)
+        tier_path = os.path.join(folder, video_name)
+        temp_path = os.path.join(folder, f"{os.path.splitext(video_name)[0]}.tmp.mp4")
+        process = subprocess.Popen(self.command(video_path, temp_path, tier), stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        lower_priority(process)
+        _, stderr = process.communicate()
+        if process.returncode != 0 or not validate_output_file(temp_path):
+            logger.error(f"Transcode ffmpeg failed for {video_name}: {stderr.decode('utf-8', errors='replace').strip()}")
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            return None
+        os.replace(temp_path, tier_path)
+        original_size, tier_size = os.path.getsize(video_path), os.path.getsize(tier_path)
+        logger.info(f"Transcoded {video_name} to the {tier} tier: {tier_size / 1024 / 1024:.1f} MB "
+                    f"({tier_size / max(original_size, 1):.0%} of the original)")
+        return tier_path
+
+tier_transcoder = TierTranscoder()
+
+# ------------------- Finalize Recording Part -------------------
+@tracing.traced('finalize', category='finalize')
+def finalize_recording_part(part, camera_id=None):
+    temp_output_path = part['path']
+    temp_filename = os.path.basename(temp_output_path)
+    if not (os.path.exists(temp_output_path) and os.path.getsize(temp_output_path) > 0):
+        print(f'Recording file not found or empty at {temp_output_path}. Check video_recorder.log for errors.')
+        if part.get('stream'):
+            part['stream'].discard()
+        return None
+    stream = part.get('stream')
+    if not validate_output_file(temp_output_path):
+        print(f'Output file {temp_output_path} is invalid. Check video_recorder.log for errors.')
+        if stream:
+            stream.discard()
+        return None
+    final_filename = generate_filename(part['start'], part['end'], camera_id)
+    final_output_path = os.path.join(os.path.dirname(temp_output_path), final_filename)
+    try:
+        with tracing.span('rename', 'finalize'):
+            os.rename(temp_output_path, final_output_path)
+        print(f'Recording saved as: {final_filename}')
+        print(f"Please check the file at {final_output_path} with VLC or another media player.")
+    except Exception as e:
+        logger.error(f"Error renaming file: {e}")
+        print(f'Recording saved as: {temp_filename}')
+        print(f"Please check the file at {temp_output_path} with VLC or another media player.")
+        final_filename, final_output_path = temp_filename, temp_output_path
+    # Hashed while it was written, so uploads are checked against what ffmpeg produced
+    sha256 = part['sha256'].hexdigest() if part.get('sha256') else None
+    if stream and upload_scheduler.finish_stream(stream, final_filename, sha256):
+        then = remove_streamed_copy
     else:
-        return f"captured_video_{start_str}.mp4"
+        then = lambda path: tier_transcoder.submit(path, sha256)
+    preview_generator.submit(final_output_path, part['start'], part['end'], then)
+    return final_output_path
+
+def remove_streamed_copy(file_path):
+    """Apply the post-upload local file policy to a recording that was streamed to S3"""
+    if KEEP_LOCAL_AFTER_UPLOAD:
+        return
+    try:
+        os.remove(file_path)
+        logger.info(f"Local file deleted: {os.path.basename(file_path)}")
+    except Exception as e:
+        logger.error(f"Failed to delete local file {os.path.basename(file_path)}: {e}")
+
+# ------------------- Encoder Auto-Tuner -------------------
+class EncoderAutoTuner:
+    """Picks libx264 settings per camera from a short synthetic encode on this host.
+
+    Each preset in AUTOTUNE_PRESETS is timed encoding AUTOTUNE_SAMPLE_SECONDS
+    of testsrc2 with ffmpeg -benchmark. That gives the CPU seconds one camera
+    needs per second of video. Other resolutions are scaled by pixel count.
+    Results are cached in AUTOTUNE_PROFILE_FILE per host. plan() then picks the
+    largest resolution and slowest preset whose cost fits each camera's share
+    of AUTOTUNE_CPU_BUDGET.
+    """
+    def __init__(self, profile_path=AUTOTUNE_PROFILE_FILE):
+        self.profile_path = profile_path
+        self.profile = None
+        self.lock = threading.Lock()
+
+    def start(self):
+        """Load the cached profile, or measure this host on a background thread"""
+        if not AUTOTUNE_ENABLED:
+            return
+        with self.lock:
+            self.profile = self.load_profile()
+        if self.profile is None:
+            threading.Thread(target=self._measure_in_background, daemon=True).start()
+
+    def _measure_in_background(self):
+        with tracing.span('encoder benchmark', 'startup'):
+            profile = self.benchmark_host()
+        with self.lock:
+            if self.profile is None:
+                self.profile = profile
+
+    def host_key(self):
+        return f"{socket.gethostname()}:{psutil.cpu_count()}:{platform.processor() or platform.machine()}"
+
+    def load_profile(self):
+        try:
+            with open(self.profile_path) as f:
+                profile = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if profile.get('host') != self.host_key():
+            logger.info("Encoder profile is for a different host; it will be re-measured")
+            return None
+        return profile
+
+    def measure_preset(self, preset):
+        """CPU seconds per second of AUTOTUNE_SAMPLE_RESOLUTION video, or None"""
+        command = [
+            'ffmpeg', '-hide_banner', '-nostats', '-benchmark',
+            '-f', 'lavfi', '-i', f'testsrc2=size={AUTOTUNE_SAMPLE_RESOLUTION}:rate={AUTOTUNE_FPS}',
+            '-t', str(AUTOTUNE_SAMPLE_SECONDS),
+            '-c:v', 'libx264', '-preset', preset, '-crf', DEFAULT_ENCODE_SETTINGS['crf'],
+            '-pix_fmt', 'yuv420p', '-f', 'null', '-'
+        ]
+        try:
+            result = subprocess.run(command, capture_output=True, text=True,
+                                    timeout=AUTOTUNE_SAMPLE_SECONDS * 30)
+        except (OSError, subprocess.TimeoutExpired) as e:
+            logger.error(f"Encoder benchmark for preset {preset} failed: {e}")
+            return None
+        match = re.search(r'bench: utime=([\d.]+)s stime=([\d.]+)s', result.stderr)
+        if result.returncode != 0 or not match:
+            logger.error(f"Encoder benchmark for preset {preset} failed: {result.stderr[-200:]}")
+            return None
+        return (float(match.group(1)) + float(match.group(2))) / AUTOTUNE_SAMPLE_SECONDS
+
+    def benchmark_host(self):
+        logger.info("Benchmarking the encoder on this host")
+        costs = {}
+        for preset in AUTOTUNE_PRESETS:
+            cost = self.measure_preset(preset)
+            if cost is not None:
+                costs[preset] = round(cost, 4)
+                logger.info(f"Encoder cost for {preset} at {AUTOTUNE_SAMPLE_RESOLUTION}: {cost:.3f} cores")
+        profile = {
+            'host': self.host_key(),
+            'measured_at': datetime.now().isoformat(),
+            'cpu_count': psutil.cpu_count(),
+            'sample_resolution': AUTOTUNE_SAMPLE_RESOLUTION,
+            'fps': AUTOTUNE_FPS,
+            'preset_costs': costs
+        }
+        try:
+            with open(self.profile_path, 'w') as f:
+                json.dump(profile, f, indent=2)
+        except OSError as e:
+            logger.error(f"Cannot save encoder profile: {e}")
+        return profile
+
+    def get_profile(self, force=False):
+        with self.lock:
+            if force or self.profile is None:
+                self.profile = (None if force else self.load_profile()) or self.benchmark_host()
+            return self.profile
+
+    def plan(self, camera_count, cpu_budget=AUTOTUNE_CPU_BUDGET):
+        """Encode settings for each of camera_count cameras sharing the CPU budget"""
+        profile = self.profile
+        if profile is None:
+            # Not measured yet; recording starts with the defaults rather than waiting
+            return dict(DEFAULT_ENCODE_SETTINGS)
+        costs = profile.get('preset_costs', {})
+        if not costs:
+            return dict(DEFAULT_ENCODE_SETTINGS)
+        cores = profile['cpu_count'] or 1
+        per_camera = cores * cpu_budget / max(1, camera_count)
+        sample_width, sample_height = map(int, profile['sample_resolution'].split('x'))
+        preferred = AUTOTUNE_PRESETS[:AUTOTUNE_PRESETS.index(AUTOTUNE_FASTEST_PREFERRED) + 1]
+        # The very fastest presets cost a lot of bitrate, so shrink the picture first
+        for presets in (preferred, AUTOTUNE_PRESETS):
+            for resolution in AUTOTUNE_RESOLUTIONS:
+                width, height = map(int, resolution.split('x'))
+                scale = (width * height) / (sample_width * sample_height)
+                for preset in presets:
+                    if preset in costs and costs[preset] * scale <= per_camera:
+                        return self._settings(preset, resolution, AUTOTUNE_FPS, per_camera, cores)
+        # Nothing fits at full frame rate: fastest preset, smallest size, half the frames
+        fastest = [preset for preset in AUTOTUNE_PRESETS if preset in costs][-1]
+        logger.warning(f"No encoder setting fits {camera_count} camera(s) on this host; using the cheapest")
+        return self._settings(fastest, AUTOTUNE_RESOLUTIONS[-1], AUTOTUNE_FPS // 2, per_camera, cores)
+
+    def _settings(self, preset, resolution, fps, per_camera, cores):
+        return {
+            'preset': preset,
+            'crf': DEFAULT_ENCODE_SETTINGS['crf'],
+            'threads': max(1, min(cores, math.ceil(per_camera))),
+            'resolution': resolution,
+            'fps': fps
+        }
+
+    def settings_for(self, camera_count):
+        if not AUTOTUNE_ENABLED:
+            return dict(DEFAULT_ENCODE_SETTINGS)
+        try:
+            settings = self.plan(camera_count)
+        except Exception as e:
+            logger.error(f"Encoder auto-tuning failed, using defaults: {e}")
+            return dict(DEFAULT_ENCODE_SETTINGS)
+        logger.info(f"Auto-tuned encode settings for {camera_count} camera(s): {settings}")
+        return settings
+
+encoder_tuner = EncoderAutoTuner()
+
+# ------------------- Recording Index -------------------
+class RecordingIndex:
+    """Append-only JSON lines log of saved segments, recording gaps and events.
+
+    A snapshot is uploaded to S3 under S3_FOLDER_PREFIX/index/ at most every
+    RECORDING_INDEX_SYNC_INTERVAL so the downloader can tell missing footage
+    from footage that was never recorded. Every entry also goes into the
+    SQLite timeline, which answers time range queries without reading the
+    whole log. It is uploaded next to the log at most every
+    TIMELINE_SYNC_INTERVAL.
+    """
+    def __init__(self, index_path, timeline_path):
+        self.index_path = index_path
+        self.snapshot_path = f"{os.path.splitext(index_path)[0]}_snapshot.jsonl"
+        self.s3_key = f"{S3_FOLDER_PREFIX}index/{socket.gethostname()}.jsonl"
+        self.lock = threading.Lock()
+        self.timeline = Timeline(timeline_path)
+        self.timeline_snapshot_path = f"{os.path.splitext(timeline_path)[0]}_snapshot.sqlite"
+        self.timeline_s3_key = f"{S3_FOLDER_PREFIX}index/{socket.gethostname()}.sqlite"
+        self.timeline_loaded = False
+        self.sync_timers = {}
+        self.synced_at = {}
+
+    def _append(self, entry):
+        with self.lock:
+            try:
+                with open(self.index_path, 'a') as f:
+                    f.write(json.dumps(entry) + '\n')
+            except OSError as e:
+                logger.error(f"Cannot write recording index {self.index_path}: {e}")
+                return
+        self._add_to_timeline(entry)
+        self.sync()
+
+    def _add_to_timeline(self, entry):
+        try:
+            if not self.timeline_loaded:
+                self.timeline_loaded = True
+                if self.timeline.is_empty():
+                    # History from before the timeline existed; already includes this entry
+                    self.timeline.add_entries(self.read_entries())
+                    return
+            self.timeline.add_entries([entry])
+        except Exception as e:
+            logger.error(f"Cannot write timeline {self.timeline.path}: {e}")
+
+    def add_segment(self, camera_id, start_time, end_time, file_name, quality_tier=0, sync=None):
+        self._append({
+            'type': 'segment',
+            'camera': camera_id,
+            'start_ms': int(start_time.timestamp() * 1000),
+            'end_ms': int(end_time.timestamp() * 1000),
+            'file': file_name,
+            'quality_tier': quality_tier,
+            'sync': sync
+        })
+
+    def add_quality_change(self, camera_id, change_time, from_tier, to_tier, reason):
+        self._append({
+            'type': 'quality',
+            'camera': camera_id,
+            'time_ms': int(change_time.timestamp() * 1000),
+            'from_tier': from_tier,
+            'to_tier': to_tier,
+            'reason': reason
+        })
+
+    def add_gap(self, camera_id, start_time, end_time, reason):
+        logger.warning(f"Recording gap on {camera_id}: {start_time} to {end_time} ({reason})")
+        self._append({
+            'type': 'gap',
+            'camera': camera_id,
+            'start_ms': int(start_time.timestamp() * 1000),
+            'end_ms': int(end_time.timestamp() * 1000),
+            'reason': reason
+        })
+
+    def add_bitrate_spike(self, camera_id, start_time, end_time, peak_kbps, baseline_kbps):
+        self._append({
+            'type': 'bitrate',
+            'camera': camera_id,
+            'start_ms': int(start_time.timestamp() * 1000),
+            'end_ms': int(end_time.timestamp() * 1000),
+            'peak_kbps': round(peak_kbps),
+            'baseline_kbps': round(baseline_kbps)
+        })
+
+    def add_health(self, camera_id, change_time, from_state, to_state, reason=None):
+        self._append({
+            'type': 'health',
+            'camera': camera_id,
+            'time_ms': int(change_time.timestamp() * 1000),
+            'from_state': from_state,
+            'to_state': to_state,
+            'reason': reason
+        })
+
+    def add_motion(self, camera_id, start_time, end_time, score):
+        self._append({
+            'type': 'motion',
+            'camera': camera_id,
+            'start_ms': int(start_time.timestamp() * 1000),
+            'end_ms': int(end_time.timestamp() * 1000),
+            'score': round(score, 2)
+        })
+
+    def read_entries(self, entry_type=None, camera_id=None):
+        entries = []
+        with self.lock:
+            if not os.path.exists(self.index_path):
+                return entries
+            with open(self.index_path) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    if entry_type and entry.get('type') != entry_type:
+                        continue
+                    if camera_id and entry.get('camera') != camera_id:
+                        continue
+                    entries.append(entry)
+        return entries
+
+    def sync(self):
+        """Upload snapshots of the index and the timeline, each at most once per its interval"""
+        self._schedule('index', RECORDING_INDEX_SYNC_INTERVAL, self.sync_index)
+        self._schedule('timeline', TIMELINE_SYNC_INTERVAL, self.sync_timeline)
+
+    def _schedule(self, name, interval, action):
+        """Run action once interval has passed since it last ran; changes made meanwhile go with it"""
+        with self.lock:
+            if name in self.sync_timers:
+                return
+            last = self.synced_at.get(name)
+            delay = 0 if last is None else max(last + interval - time.monotonic(), 0)
+            timer = threading.Timer(delay, self._run_sync, args=(name, action))
+            timer.daemon = True
+            self.sync_timers[name] = timer
+            timer.start()
+
+    def _run_sync(self, name, action):
+        with self.lock:
+            del self.sync_timers[name]
+            self.synced_at[name] = time.monotonic()
+        action()
+
+    def sync_index(self):
+        """Upload a snapshot of the recording index"""
+        temp_path = f"{self.snapshot_path}.tmp"
+        with self.lock:
+            try:
+                shutil.copyfile(self.index_path, temp_path)
+                # Replaced, not rewritten, so an upload still reading the old snapshot gets all of it
+                os.replace(temp_path, self.snapshot_path)
+            except OSError as e:
+                logger.error(f"Cannot snapshot recording index: {e}")
+                return
+        upload_scheduler.queue_upload(self.snapshot_path, s3_key=self.s3_key, delete_after=False)
+
+    def sync_timeline(self):
+        """Upload a snapshot of the timeline next to the recording index"""
+        try:
+            self.timeline.snapshot(self.timeline_snapshot_path)
+        except Exception as e:
+            logger.error(f"Cannot snapshot timeline: {e}")
+            return
+        upload_scheduler.queue_upload(self.timeline_snapshot_path, s3_key=self.timeline_s3_key, delete_after=False)
+
+recording_index = RecordingIndex(RECORDING_INDEX_FILE, TIMELINE_FILE)
+
+# ------------------- Frame Pipeline -------------------
+FRAME_CHANNELS = {'gray': 1, 'rgb24': 3}
+frame_consumer_factories = {}
+
+def register_frame_consumer(name, factory):
+    """Make a frame consumer available to FRAME_CONSUMERS.
+
+    factory(camera_id, width, height, pix_fmt) is called once per recording
+    session and returns an object with on_frame(frame, timestamp) and
+    optionally close(). frame is a NumPy view of a reused buffer that is only
+    valid during the call, so copy anything you want to keep.
+    """
+    frame_consumer_factories[name] = factory
+
+def frame_size():
+    width, height = FRAME_SIZE.split('x')
+    return int(width), int(height)
+
+def create_frame_consumers(camera_id):
+    consumers = []
+    width, height = frame_size()
+    for name in FRAME_CONSUMERS:
+        factory = frame_consumer_factories.get(name)
+        if factory is None:
+            logger.warning(f"Unknown frame consumer: {name}")
+            continue
+        try:
+            consumers.append(factory(camera_id, width, height, FRAME_PIX_FMT))
+        except Exception as e:
+            logger.error(f"Cannot create frame consumer {name} for {camera_id}: {e}")
+    return consumers
+
+def frame_output_args(output_url):
+    """Second ffmpeg output carrying scaled raw frames for the frame pipeline"""
+    width, height = frame_size()
+    return [
+        '-map', '0:v:0',
+        '-vf', f'fps={FRAME_FPS},scale={width}:{height}',
+        '-pix_fmt', FRAME_PIX_FMT,
+        '-f', 'rawvideo',
+        output_url
+    ]
+
+class FramePipeline:
+    """Delivers raw frames from a recording's ffmpeg process to frame consumers.
+
+    The recording ffmpeg sends a rawvideo output over a loopback TCP
+    connection, so analytics share the recording's decode. Frames are read
+    with readinto() straight into FRAME_BUFFERS preallocated NumPy arrays,
+    so no bytes object is allocated per frame. Consumers run on their own
+    thread. If they fall behind, frames are dropped instead of blocking ffmpeg.
+    """
+    def __init__(self, consumers, lock=None):
+        import numpy  # optional dependency, only needed when frame consumers are configured
+        width, height = frame_size()
+        channels = FRAME_CHANNELS[FRAME_PIX_FMT]
+        shape = (height, width) if channels == 1 else (height, width, channels)
+        self.consumers = consumers
+        self.consumer_lock = lock or threading.Lock()
+        self.buffers = [numpy.empty(shape, numpy.uint8) for _ in range(max(FRAME_BUFFERS, 3))]
+        self.views = [memoryview(buffer).cast('B') for buffer in self.buffers]
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.bind(('127.0.0.1', 0))
+        self.listener.listen(1)
+        self.output_url = f"tcp://127.0.0.1:{self.listener.getsockname()[1]}"
+        self.condition = threading.Condition()
+        self.latest = None
+        self.latest_time = None
+        self.in_use = None
+        self.running = False
+        self.frames = 0
+        self.dropped = 0
+
+    def start(self):
+        self.running = True
+        threading.Thread(target=self._read_worker, daemon=True).start()
+        threading.Thread(target=self._dispatch_worker, daemon=True).start()
+
+    def close(self):
+        """Stop waiting for ffmpeg to connect; an open stream ends when ffmpeg exits"""
+        try:
+            self.listener.close()
+        except OSError:
+            pass
+
+    def _fill(self, view, stream):
+        offset = 0
+        while offset < len(view):
+            count = stream.readinto(view[offset:])
+            if not count:
+                return False
+            offset += count
+        return True
+
+    def _read_worker(self):
+        try:
+            connection, _ = self.listener.accept()
+        except OSError as e:
+            logger.error(f"Frame pipeline was not connected: {e}")
+            connection = None
+        finally:
+            self.close()
+        try:
+            if connection:
+                with connection, connection.makefile('rb', buffering=0) as stream:
+                    while True:
+                        with self.condition:
+                            index = next(i for i in range(len(self.buffers)) if i not in (self.latest, self.in_use))
+                        if not self._fill(self.views[index], stream):
+                            break
+                        with self.condition:
+                            if self.latest is not None:
+                                self.dropped += 1
+                            self.latest = index
+                            self.latest_time = time.time()
+                            self.frames += 1
+                            self.condition.notify()
+        except OSError as e:
+            logger.error(f"Frame pipeline read failed: {e}")
+        finally:
+            with self.condition:
+                self.running = False
+                self.condition.notify_all()
+            if self.dropped:
+                logger.info(f"Frame pipeline delivered {self.frames - self.dropped} of {self.frames} frames")
+
+    def _dispatch_worker(self):
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.latest is not None or not self.running)
+                if self.latest is None:
+                    break
+                self.in_use, self.latest = self.latest, None
+                timestamp = self.latest_time
+            frame = self.buffers[self.in_use]
+            with self.consumer_lock:
+                for consumer in self.consumers:
+                    try:
+                        consumer.on_frame(frame, timestamp)
+                    except Exception as e:
+                        logger.error(f"Frame consumer {type(consumer).__name__} failed: {e}")
+            with self.condition:
+                self.in_use = None
+
+class MotionDetector:
+    """Frame consumer that logs motion events to the recording index"""
+    def __init__(self, camera_id, width, height, pix_fmt):
+        import numpy
+        self.numpy = numpy
+        self.camera_id = camera_id
+        self.previous = numpy.zeros((height, width), numpy.int16)
+        self.difference = numpy.empty((height, width), numpy.int16)
+        self.primed = False
+        self.motion_start = None
+        self.last_motion = None
+        self.peak_score = 0.0
+
+    def on_frame(self, frame, timestamp):
+        # The green channel is a cheap stand-in for luma on rgb24 frames
+        luma = frame if frame.ndim == 2 else frame[:, :, 1]
+        self.numpy.subtract(luma, self.previous, out=self.difference)
+        self.previous[...] = luma
+        if not self.primed:
+            self.primed = True
+            return
+        self.numpy.abs(self.difference, out=self.difference)
+        score = float(self.difference.mean())
+        if score >= MOTION_THRESHOLD:
+            if self.motion_start is None:
+                self.motion_start = timestamp
+                logger.info(f"Motion started on {self.camera_id} (score {score:.1f})")
+            self.last_motion = timestamp
+            self.peak_score = max(self.peak_score, score)
+        elif self.motion_start is not None and timestamp - self.last_motion >= MOTION_HOLD_SECONDS:
+            self._end_event()
+
+    def _end_event(self):
+        recording_index.add_motion(self.camera_id, datetime.fromtimestamp(self.motion_start),
+                                   datetime.fromtimestamp(self.last_motion), self.peak_score)
+        self.motion_start = None
+        self.peak_score = 0.0
+
+    def close(self):
+        if self.motion_start is not None:
+            self._end_event()
+
+register_frame_consumer('motion', MotionDetector)
+
+# ------------------- Bitrate Monitor -------------------
+class BitrateMonitor:
+    """Finds bursts in a camera's recorded bitrate and logs them to the recording index.
+
+    Fed the segment writer's byte count every SEGMENT_CHECK_INTERVAL and
+    measured over BITRATE_WINDOW_SECONDS from the first fragment on. A
+    window above BITRATE_SPIKE_FACTOR times the running average starts a
+    spike, and the first window back under it ends the spike. Bursts often
+    mean a busy scene, night-time noise or a failing camera. Each segment
+    learns its own average, so quality tier changes do not look like spikes.
+    """
+    def __init__(self, camera_id):
+        self.camera_id = camera_id
+        self.writer = None
+        self.last_bytes = 0
+        self.last_time = None
+        self.baseline = None
+        self.spike_start = None
+        self.peak_kbps = 0.0
+
+    def observe(self, writer, now=None):
+        now = now or time.time()
+        if writer is not self.writer:
+            self.close()
+            self.writer, self.last_time, self.baseline = writer, None, None
+        if self.last_time is None:
+            # ffmpeg's start-up would look like a quiet spell
+            if writer.first_fragment.is_set():
+                self.last_bytes, self.last_time = writer.bytes_written, now
+            return
+        elapsed = now - self.last_time
+        if elapsed < BITRATE_WINDOW_SECONDS:
+            return
+        kbps = (writer.bytes_written - self.last_bytes) * 8 / 1000 / elapsed
+        window_start, self.last_bytes, self.last_time = self.last_time, writer.bytes_written, now
+        if self.baseline is None:
+            self.baseline = kbps
+            return
+        if self.baseline > 0 and kbps >= self.baseline * BITRATE_SPIKE_FACTOR:
+            if self.spike_start is None:
+                self.spike_start = window_start
+            self.peak_kbps = max(self.peak_kbps, kbps)
+            if now - self.spike_start < BITRATE_BASELINE_SECONDS:
+                # Spikes are kept out of the running average
+                return
+            self._end_spike(now)
+            self.baseline = kbps
+            return
+        if self.spike_start is not None:
+            self._end_spike(window_start)
+        self.baseline += min(elapsed / BITRATE_BASELINE_SECONDS, 1) * (kbps - self.baseline)
+
+    def _end_spike(self, end):
+        logger.info(f"Bitrate spike on {self.camera_id}: {self.peak_kbps:.0f} kbps against {self.baseline:.0f} kbps")
+        recording_index.add_bitrate_spike(self.camera_id, datetime.fromtimestamp(self.spike_start),
+                                          datetime.fromtimestamp(end), self.peak_kbps, self.baseline)
+        self.spike_start = None
+        self.peak_kbps = 0.0
+
+    def close(self):
+        if self.spike_start is not None:
+            self._end_spike(self.last_time)
+
+# ------------------- Adaptive Quality Controller -------------------
+FFMPEG_PROGRESS_TIME_PATTERN = re.compile(r'time=\s*(\d+):(\d+):([\d.]+)')
+
+def apply_quality_tier(settings, tier):
+    """Encode settings lowered to a quality tier; a tier never raises quality above the base settings"""
+    merged = dict(settings)
+    for key, value in QUALITY_TIERS[tier].items():
+        current = merged.get(key)
+        if current is None:
+            merged[key] = value
+        elif key == 'crf':
+            merged[key] = str(max(int(current), int(value)))
+        elif key == 'fps':
+            merged[key] = min(int(current), int(value))
+        elif key == 'resolution':
+            merged[key] = min(current, value, key=lambda size: int(size.split('x')[0]) * int(size.split('x')[1]))
+        elif key == 'preset' and current in AUTOTUNE_PRESETS and value in AUTOTUNE_PRESETS:
+            merged[key] = max(current, value, key=AUTOTUNE_PRESETS.index)
+        else:
+            merged[key] = value
+    return merged
+
+class AdaptiveQualityController:
+    """Steps a recording session between QUALITY_TIERS as load changes.
+
+    Pressure is host CPU above ADAPTIVE_CPU_HIGH, an encode running slower
+    than realtime while the CPU is busy, or an upload backlog. Encode speed is
+    measured from ffmpeg's progress time between checks. A slow encode on an
+    idle host means the input is the bottleneck, which a lower tier would not
+    fix. Sustained pressure moves the session one tier down; long sustained
+    headroom moves it one tier back up. ffmpeg cannot change its encode while
+    running, so every change restarts it into a new segment.
+    """
+    def __init__(self, session):
+        self.session = session
+        self.media_time = None
+        self.last_sample = None
+        self.speed = None
+        self.pressure_since = None
+        self.headroom_since = None
+        self.cpu_times = psutil.cpu_times()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def reset(self):
+        """Forget the previous ffmpeg process's progress after a restart"""
+        self.media_time = None
+        self.last_sample = None
+        self.speed = None
+        self.pressure_since = None
+        self.headroom_since = None
+
+    def observe(self, progress_line):
+        match = FFMPEG_PROGRESS_TIME_PATTERN.search(progress_line)
+        if match:
+            hours, minutes, seconds = match.groups()
+            self.media_time = int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+    def _measure_speed(self):
+        """Seconds of media encoded per wall-clock second since the previous check"""
+        now = time.monotonic()
+        if self.media_time is None:
+            return
+        if self.last_sample:
+            sample_time, sample_media = self.last_sample
+            if now > sample_time:
+                self.speed = (self.media_time - sample_media) / (now - sample_time)
+        self.last_sample = (now, self.media_time)
+
+    def _cpu_percent(self):
+        # Computed from our own snapshots so several sessions do not reset each other's psutil.cpu_percent()
+        current = psutil.cpu_times()
+        idle = (current.idle + getattr(current, 'iowait', 0)) - (self.cpu_times.idle + getattr(self.cpu_times, 'iowait', 0))
+        total = sum(current) - sum(self.cpu_times)
+        self.cpu_times = current
+        return 100.0 * (1 - idle / total) if total > 0 else 0.0
+
+    def _pressure(self, cpu):
+        reasons = []
+        if cpu > ADAPTIVE_CPU_HIGH:
+            reasons.append(f"CPU {cpu:.0f}%")
+        if self.speed is not None and self.speed < ADAPTIVE_SPEED_LOW and cpu > ADAPTIVE_CPU_LOW:
+            reasons.append(f"encode speed {self.speed:.2f}x at CPU {cpu:.0f}%")
+        backlog = upload_scheduler.upload_queue.qsize()
+        if backlog > ADAPTIVE_UPLOAD_BACKLOG:
+            reasons.append(f"{backlog} uploads queued")
+        return reasons
+
+    def check(self):
+        now = time.monotonic()
+        cpu = self._cpu_percent()
+        self._measure_speed()
+        reasons = self._pressure(cpu)
+        tier = self.session.quality_tier
+        if reasons:
+            self.headroom_since = None
+            self.pressure_since = self.pressure_since or now
+            if now - self.pressure_since >= ADAPTIVE_PRESSURE_SECONDS and tier < len(QUALITY_TIERS) - 1:
+                self.session.change_quality(tier + 1, ', '.join(reasons))
+        elif cpu < ADAPTIVE_CPU_LOW:
+            self.pressure_since = None
+            self.headroom_since = self.headroom_since or now
+            if now - self.headroom_since >= ADAPTIVE_HEADROOM_SECONDS and tier > 0:
+                self.session.change_quality(tier - 1, f"headroom restored (CPU {cpu:.0f}%)")
+        else:
+            self.pressure_since = None
+            self.headroom_since = None
+
+    def _run(self):
+        while not self.session.stop_event.wait(ADAPTIVE_CHECK_INTERVAL):
+            try:
+                if self.session.state == 'recording':
+                    self.check()
+            except Exception as e:
+                logger.error(f"Adaptive quality check failed for {self.session.camera_id}: {e}")
+
+# ------------------- Recording Session -------------------
+FFMPEG_ERROR_PATTERN = re.compile(r'error|failed|invalid|could not|unable', re.IGNORECASE)
+SEGMENT_CHECK_INTERVAL = 5      # seconds between checks for segment rotation
+ROTATION_START_TIMEOUT = 15     # seconds the next segment has to produce footage before the old one stops
+ROTATION_RETRY_SECONDS = 60
+
+def camera_label(selected_camera):
+    camera_info, method = selected_camera
+    if isinstance(camera_info, tuple):
+        return camera_info[0]
+    return camera_info
+
+class RecordingSession:
+    """One camera's recording, supervised by a watchdog.
+
+    If ffmpeg exits without being asked to, the finished parts are saved in
+    the background, the outage is written to the recording index as a gap,
+    and ffmpeg is restarted into a new segment with exponential backoff.
+    """
+    def __init__(self, selected_camera, camera_id=None, on_finished=None, encode_settings=None):
+        self.selected_camera = selected_camera
+        # ffmpeg reads IP cameras through the shared ingest, resolved again for every process
+        # so a camera the relay could not reach goes back to it; camera_id names the real camera
+        self.ffmpeg_camera = selected_camera
+        self.via_ingest = False
+        self.camera_id = camera_id or camera_label(selected_camera)
+        self.on_finished = on_finished
+        self.encode_settings = encode_settings
+        self.process = None
+        self.segment_writer = None
+        self.segment_start = None
+        self.state = 'idle'
+        self.restarts = 0
+        self.saved_files = []
+        self.stop_event = threading.Event()
+        self.lock = threading.Lock()
+        self.supervisor_thread = None
+        self.finalizer_threads = []
+        self.frame_consumers = create_frame_consumers(self.camera_id)
+        self.frame_pipeline = None
+        self.quality_tier = 0
+        self.planned_restart = None
+        self.rotation_retry_at = 0
+        # Consumers may briefly see two pipelines while a segment rotates
+        self.frame_lock = threading.Lock()
+        self.quality = AdaptiveQualityController(self) if ADAPTIVE_QUALITY_ENABLED else None
+        self.bitrate = BitrateMonitor(self.camera_id)
+
+    def _set_state(self, state, reason=None):
+        """Change state, logging the transition to the recording index as a health event"""
+        previous, self.state = self.state, state
+        if previous != state:
+            recording_index.add_health(self.camera_id, datetime.now(), previous, state, reason)
+
+    def start(self):
+        if not self._spawn():
+            return False
+        self._set_state('recording', 'started')
+        retention_manager.add_listener(self._on_storage_pressure)
+        self.supervisor_thread = threading.Thread(target=self._supervise, daemon=True)
+        self.supervisor_thread.start()
+        if self.quality:
+            self.quality.start()
+        return True
+
+    def is_active(self):
+        return self.supervisor_thread is not None and self.supervisor_thread.is_alive()
+
+    def _spawn(self):
+        with self.lock:
+            if self.stop_event.is_set():
+                return False
+            segment_start = datetime.now()
+            # ffmpeg writes to stdout so a pulled drive can fail over without restarting it
+            settings = apply_quality_tier(retention_manager.encode_settings(self.encode_settings), self.quality_tier)
+            ffmpeg_camera = ingest_camera(self.selected_camera)
+            ffmpeg_command, _ = build_ffmpeg_command(ffmpeg_camera, 'pipe:1', settings)
+            frame_pipeline = self._open_frame_pipeline()
+            if frame_pipeline:
+                ffmpeg_command += frame_output_args(frame_pipeline.output_url)
+            logger.info(f"FFmpeg command: {' '.join(ffmpeg_command)}")
+            try:
+                with tracing.span('ffmpeg spawn', 'recording', camera=self.camera_id):
+                    process = subprocess.Popen(ffmpeg_command, stdin=subprocess.PIPE,
+                                               stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            except Exception as e:
+                print(f"Error starting FFmpeg: {e}")
+                logger.error(f"Error starting FFmpeg: {e}")
+                if frame_pipeline:
+                    frame_pipeline.close()
+                return False
+            if frame_pipeline:
+                frame_pipeline.start()
+            self.frame_pipeline = frame_pipeline
+            error_thread = threading.Thread(target=self._log_ffmpeg_errors, args=(process,), daemon=True)
+            error_thread.start()
+            self.segment_start = segment_start
+            self.segment_writer = FailoverSegmentWriter(process.stdout, storage_pool, segment_start,
+                                                        exclude=retention_manager.critical_folders(),
+                                                        uploader=upload_scheduler if STREAMING_UPLOAD and not CLOUD_TIER else None)
+            self.segment_writer.start()
+            self.segment_writer.quality_tier = self.quality_tier
+            # Compared by value: a relay that cannot reach the camera hands back its own URLs
+            self.ffmpeg_camera = ffmpeg_camera
+            self.via_ingest = ffmpeg_camera != self.selected_camera
+            self.segment_writer.audio_lag = self._audio_lag()
+            self.process = process
+            if self.quality:
+                self.quality.reset()
+            return True
+
+    def _open_frame_pipeline(self):
+        if not self.frame_consumers:
+            return None
+        try:
+            return FramePipeline(self.frame_consumers, self.frame_lock)
+        except ImportError:
+            logger.error("NumPy is required for frame consumers. Recording without them.")
+            self.frame_consumers = []
+        except OSError as e:
+            logger.error(f"Cannot open frame pipeline for {self.camera_id}: {e}")
+        return None
+
+    def _close_frame_consumers(self):
+        for consumer in self.frame_consumers:
+            try:
+                if hasattr(consumer, 'close'):
+                    consumer.close()
+            except Exception as e:
+                logger.error(f"Error closing frame consumer {type(consumer).__name__}: {e}")
+
+    def _log_ffmpeg_errors(self, process):
+        # Progress lines end in '\r' rather than '\n', so split on both
+        pending = b''
+        while True:
+            chunk = process.stderr.read1(4096)
+            if not chunk:
+                break
+            lines = re.split(rb'[\r\n]', pending + chunk)
+            pending = lines.pop()
+            for raw_line in lines:
+                self._handle_ffmpeg_line(raw_line.decode('utf-8', errors='replace').strip())
+        self._handle_ffmpeg_line(pending.decode('utf-8', errors='replace').strip())
+
+    def _handle_ffmpeg_line(self, line):
+        if not line:
+            return
+        if line.startswith('frame=') and 'speed=' in line:
+            if self.quality:
+                self.quality.observe(line)
+            ffmpeg_logger.debug(line, extra={'camera': self.camera_id})
+            return
+        level = logging.ERROR if FFMPEG_ERROR_PATTERN.search(line) else logging.INFO
+        ffmpeg_logger.log(level, line, extra={'camera': self.camera_id})
+
+    @tracing.traced('finish segment', category='finalize')
+    def _finish_segment(self, segment_writer):
+        segment_writer.join(timeout=10)
+        if not segment_writer.parts:
+            print('No recording data was written. Check video_recorder.log for errors.')
+        if len(segment_writer.parts) > 1:
+            print(f'Storage failed over during recording; saved {len(segment_writer.parts)} parts.')
+        drift = self._audio_drift_ms(segment_writer)
+        sync = {'audio_drift_ms': round(drift)} if drift is not None else None
+        if drift is not None and abs(drift) >= AV_RESYNC_DRIFT_MS:
+            logger.warning(f"Audio drifted {drift:+.0f} ms behind video on {self.camera_id}")
+        for part in segment_writer.parts:
+            saved_path = finalize_recording_part(part, self.camera_id)
+            if saved_path:
+                self.saved_files.append(saved_path)
+                recording_index.add_segment(self.camera_id, part['start'], part['end'],
+                                            os.path.basename(saved_path), segment_writer.quality_tier, sync)
+
+    def _supervise(self):
+        backoff = WATCHDOG_INITIAL_BACKOFF
+        try:
+            while True:
+                returncode = self._wait(self.process)
+                if returncode is None:
+                    # Rotated into a new segment without a gap
+                    continue
+                segment_end = datetime.now()
+                if self.frame_pipeline:
+                    self.frame_pipeline.close()
+                segment_writer = self.segment_writer
+                if self.stop_event.is_set():
+                    self._finish_segment(segment_writer)
+                    break
+                # Save what was recorded while the replacement starts up
+                finalizer = threading.Thread(target=self._finish_segment, args=(segment_writer,), daemon=True)
+                finalizer.start()
+                self.finalizer_threads.append(finalizer)
+                if (segment_end - self.segment_start).total_seconds() >= WATCHDOG_STABLE_SECONDS:
+                    backoff = WATCHDOG_INITIAL_BACKOFF
+                planned, self.planned_restart = self.planned_restart, None
+                self._set_state('restarting', planned or f"ffmpeg exited with code {returncode}")
+                if planned:
+                    # Quality tier change or segment rotation: restart straight away
+                    reason = planned
+                    restarted = self._spawn()
+                else:
+                    reason = f"ffmpeg exited with code {returncode}"
+                    print(f"FFmpeg process ended unexpectedly (exit code {returncode}). Restarting in {backoff}s. Check video_recorder.log for errors.")
+                    logger.warning(f"FFmpeg exited with code {returncode} on {self.camera_id}; restarting in {backoff}s")
+                    restarted = False
+                while not restarted and not self.stop_event.wait(backoff):
+                    backoff = min(backoff * 2, WATCHDOG_MAX_BACKOFF)
+                    if self._spawn():
+                        restarted = True
+                        break
+                    logger.error(f"FFmpeg restart failed on {self.camera_id}; retrying in {backoff}s")
+                gap_end = self.segment_start if restarted else datetime.now()
+                recording_index.add_gap(self.camera_id, segment_end, gap_end, reason)
+                if not restarted:
+                    break
+                if not planned:
+                    self.restarts += 1
+                    print(f"Recording resumed after a {(gap_end - segment_end).total_seconds():.1f}s gap.")
+                self._set_state('recording', 'resumed')
+        except Exception as e:
+            logger.error(f"Error in recording watchdog for {self.camera_id}: {e}")
+        finally:
+            retention_manager.remove_listener(self._on_storage_pressure)
+            self._close_frame_consumers()
+            self.bitrate.close()
+            self._set_state('stopped', 'stop requested' if self.stop_event.is_set() else 'gave up restarting')
+            if self.on_finished:
+                self.on_finished()
+
+    def _audio_lag(self):
+        """(connection, seconds) the camera's audio clock lags the wall clock, as seen by the shared ingest"""
+        if not self.via_ingest:
+            return None
+        return ingest_hub.clock_lag(self.selected_camera[0][1])
+
+    def _audio_drift_ms(self, segment_writer):
+        """How far audio has fallen behind video since the segment started; None if not measured.
+
+        Video is stamped with the wall clock and audio follows the camera's
+        sample clock, so their drift is the change in the audio clock's lag.
+        """
+        lag = self._audio_lag()
+        if lag is None:
+            return None
+        if segment_writer.audio_lag is None or segment_writer.audio_lag[0] != lag[0]:
+            # First measurement on this connection becomes the segment's reference
+            segment_writer.audio_lag = lag
+            return None
+        return (lag[1] - segment_writer.audio_lag[1]) * 1000
+
+    def _wait(self, process):
+        """Wait for ffmpeg to exit; returns None instead if the session rotated to a new process"""
+        while True:
+            try:
+                return process.wait(timeout=SEGMENT_CHECK_INTERVAL)
+            except subprocess.TimeoutExpired:
+                self.bitrate.observe(self.segment_writer)
+                reason = self._rotation_due()
+                if reason and self._rotate(process, reason):
+                    return None
+
+    def _rotation_due(self):
+        if self.stop_event.is_set() or time.monotonic() < self.rotation_retry_at:
+            return None
+        age = (datetime.now() - self.segment_start).total_seconds()
+        if MAX_SEGMENT_SECONDS and age >= MAX_SEGMENT_SECONDS:
+            return f"segment reached {MAX_SEGMENT_SECONDS}s"
+        drift = self._audio_drift_ms(self.segment_writer)
+        if drift is not None and abs(drift) >= AV_RESYNC_DRIFT_MS and age >= AV_RESYNC_MIN_SECONDS:
+            return f"audio drifted {drift:+.0f} ms behind video"
+        return None
+
+    def _rotate(self, process, reason):
+        """Start a new segment to re-anchor A/V sync; True if ffmpeg was handed over without a gap.
+
+        Through the shared ingest the next ffmpeg can connect before the
+        current one stops, so the segments overlap slightly instead of
+        leaving a gap. Cameras read directly get one reader at a time, so
+        they are restarted like a quality change instead.
+        """
+        logger.info(f"Starting a new segment on {self.camera_id}: {reason}")
+        if not self.via_ingest:
+            with self.lock:
+                if self.stop_event.is_set():
+                    return False
+                self.planned_restart = reason
+            self._stop_process(process, announce=False)
+            return False
+        with self.lock:
+            previous = (self.process, self.segment_writer, self.frame_pipeline, self.segment_start,
+                        self.ffmpeg_camera, self.via_ingest)
+        if not self._spawn():
+            self.rotation_retry_at = time.monotonic() + ROTATION_RETRY_SECONDS
+            return False
+        new_process, new_writer = self.process, self.segment_writer
+        new_writer.first_fragment.wait(ROTATION_START_TIMEOUT)
+        if not new_writer.parts or new_process.poll() is not None:
+            logger.error(f"Next segment on {self.camera_id} did not start; keeping the current one")
+            new_pipeline = self.frame_pipeline
+            with self.lock:
+                (self.process, self.segment_writer, self.frame_pipeline, self.segment_start,
+                 self.ffmpeg_camera, self.via_ingest) = previous
+                stopping = self.stop_event.is_set()
+            self._stop_process(new_process, announce=False)
+            if new_pipeline:
+                new_pipeline.close()
+            if new_writer.parts:
+                self._finish_segment(new_writer)
+            if stopping:
+                # stop() signalled the new process; the current one has to go too
+                self._stop_process(process)
+            self.rotation_retry_at = time.monotonic() + ROTATION_RETRY_SECONDS
+            return False
+        old_process, old_writer, old_pipeline = previous[:3]
+        self._stop_process(old_process, announce=False)
+        if old_pipeline:
+            old_pipeline.close()
+        finalizer = threading.Thread(target=self._finish_segment, args=(old_writer,), daemon=True)
+        finalizer.start()
+        self.finalizer_threads.append(finalizer)
+        return True
+
+    def change_quality(self, tier, reason):
+        """Restart ffmpeg at another quality tier; the supervisor starts the new process"""
+        with self.lock:
+            if self.stop_event.is_set() or tier == self.quality_tier or self.process is None:
+                return
+            previous_tier = self.quality_tier
+            self.quality_tier = tier
+            self.planned_restart = f"quality tier changed to {tier}"
+            process = self.process
+        direction = 'down' if tier > previous_tier else 'up'
+        logger.warning(f"Stepping {self.camera_id} {direction} to quality tier {tier}: {reason}")
+        recording_index.add_quality_change(self.camera_id, datetime.now(), previous_tier, tier, reason)
+        self._stop_process(process, announce=False)
+
+    def _on_storage_pressure(self, pressure):
+        if pressure == 'critical' and not self.stop_event.is_set():
+            print("Recording drive is almost full. Stopping recording to protect the file.")
+            threading.Thread(target=self.stop, daemon=True).start()
+
+    @tracing.traced('ffmpeg stop', category='recording')
+    def _stop_process(self, process, announce=True):
+        try:
+            if process.stdin and not process.stdin.closed:
+                process.stdin.write(b'q\n')
+                process.stdin.flush()
+            try:
+                process.wait(timeout=5)
+                if announce:
+                    print(f'Recording stopped gracefully at: {datetime.now().strftime("%Y-%m-%d %I:%M:%S %p")}')
+            except subprocess.TimeoutExpired:
+                print('FFmpeg taking too long to stop, force terminating...')
+                process.terminate()
+                try:
+                    process.wait(timeout=3)
+                except subprocess.TimeoutExpired:
+                    process.kill()
+                    process.wait()
+                print('Recording force stopped.')
+        except Exception as e:
+            logger.error(f"Error stopping FFmpeg: {e}")
+            try:
+                process.terminate()
+                process.wait(timeout=3)
+            except:
+                process.kill()
+                process.wait()
+
+    def stop(self, timeout=60):
+        """Stop recording and wait for every segment to be saved"""
+        with self.lock:
+            already_stopping = self.stop_event.is_set()
+            self.stop_event.set()
+            process = self.process
+        if not already_stopping and process and process.poll() is None:
+            print("Stopping recording...")
+            self._stop_process(process)
+        if self.supervisor_thread and self.supervisor_thread is not threading.current_thread():
+            self.supervisor_thread.join(timeout=timeout)
+        for finalizer in self.finalizer_threads:
+            finalizer.join(timeout=timeout)
+        return self.saved_files
+
+# ------------------- Daemon Camera Controller -------------------
+def device_id(device):
+    return device.get('id') or re.sub(r'[^a-z0-9]+', '-', device['name'].lower()).strip('-')
+
+class CameraController:
+    """Starts and stops a RecordingSession per integrated device for daemon mode"""
+    def __init__(self, devices):
+        self.devices = {device_id(device): device for device in devices}
+        self.sessions = {}
+        self.lock = threading.Lock()
+
+    def start_camera(self, camera_id):
+        device = self.devices.get(camera_id)
+        if device is None:
+            return False, f"Unknown camera: {camera_id}"
+        with self.lock:
+            session = self.sessions.get(camera_id)
+            if session and session.is_active():
+                return False, f"{camera_id} is already recording"
+            if retention_manager.enforce() == 'critical':
+                return False, "Recording drive is almost full"
+            # No probing here: if the camera is offline the watchdog keeps retrying
+            audio_url = device.get('audio') or device['ip'].replace('/video', '/audio.opus')
+            active = sum(1 for other in self.sessions.values() if other.is_active())
+            # Cameras already recording keep their settings until they are restarted
+            session = RecordingSession(((device['ip'], audio_url), 0), camera_id=camera_id,
+                                       encode_settings=encoder_tuner.settings_for(active + 1))
+            if not session.start():
+                return False, f"Could not start FFmpeg for {camera_id}"
+            self.sessions[camera_id] = session
+        logger.info(f"Recording started on {camera_id}")
+        return True, f"{camera_id} recording"
+
+    def stop_camera(self, camera_id):
+        with self.lock:
+            session = self.sessions.get(camera_id)
+        if session is None or not session.is_active():
+            return False, f"{camera_id} is not recording"
+        session.stop()
+        logger.info(f"Recording stopped on {camera_id}")
+        return True, f"{camera_id} stopped"
+
+    def stop_all(self):
+        with self.lock:
+            sessions = list(self.sessions.values())
+        for session in sessions:
+            if session.is_active():
+                session.stop()
+
+    def camera_status(self, camera_id):
+        device = self.devices[camera_id]
+        session = self.sessions.get(camera_id)
+        return {
+            'id': camera_id,
+            'name': device['name'],
+            'url': device['ip'],
+            'state': session.state if session else 'idle',
+            'restarts': session.restarts if session else 0,
+            'quality_tier': session.quality_tier if session else 0,
+            'segment_start': session.segment_start.isoformat() if session and session.segment_start else None,
+            'saved_files': len(session.saved_files) if session else 0
+        }
+
+    def status(self):
+        return {
+            'cameras': [self.camera_status(camera_id) for camera_id in self.devices],
+            'storage': {
+                'pressure': retention_manager.pressure,
+                'volumes': storage_pool.video_folders,
+                'failed_volumes': sorted(storage_pool.failed_folders)
+            },
+            'uploads_queued': upload_scheduler.upload_queue.qsize(),
+            'ingest': ingest_hub.stats()
+        }
+
+# ------------------- Daemon Control API -------------------
+class ControlAPIHandler(BaseHTTPRequestHandler):
+    """JSON control API: GET /status, /cameras, /segments; POST /cameras/<id>/start|stop"""
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        path, _, query = self.path.partition('?')
+        params = parse_qs(query)
+        controller = self.server.controller
+        if path == '/status':
+            self._send_json(200, controller.status())
+        elif path == '/cameras':
+            self._send_json(200, controller.status()['cameras'])
+        elif path == '/segments':
+            camera_id = params.get('camera', [None])[0]
+            limit = params.get('limit', ['100'])[0]
+            if not limit.isdigit() or int(limit) <= 0:
+                self._send_json(400, {'error': f"limit must be a positive integer, got {limit!r}"})
+                return
+            limit = int(limit)
+            segments = recording_index.read_entries('segment', camera_id)
+            self._send_json(200, segments[-limit:])
+        else:
+            self._send_json(404, {'error': 'not found'})
+
+    def do_POST(self):
+        parts = self.path.partition('?')[0].strip('/').split('/')
+        controller = self.server.controller
+        if len(parts) == 3 and parts[0] == 'cameras' and parts[2] in ('start', 'stop'):
+            camera_id = parts[1]
+            if camera_id not in controller.devices:
+                self._send_json(404, {'error': f"Unknown camera: {camera_id}"})
+                return
+            if parts[2] == 'start':
+                ok, message = controller.start_camera(camera_id)
+            else:
+                ok, message = controller.stop_camera(camera_id)
+            self._send_json(200 if ok else 409, {'ok': ok, 'message': message,
+                                                 'camera': controller.camera_status(camera_id)})
+        else:
+            self._send_json(404, {'error': 'not found'})
+
+    def address_string(self):
+        # Unix socket peers have no (host, port) address
+        if isinstance(self.client_address, tuple):
+            return self.client_address[0]
+        return 'unix'
+
+    def log_message(self, format, *args):
+        logger.info(f"Control API {self.address_string()}: {format % args}")
+
+class UnixControlAPIServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+def start_control_api(controller, host=CONTROL_API_HOST, port=CONTROL_API_PORT, socket_path=None):
+    if socket_path:
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        server = UnixControlAPIServer(socket_path, ControlAPIHandler)
+        address = f"unix:{socket_path}"
+    else:
+        server = ThreadingHTTPServer((host, port), ControlAPIHandler)
+        server.daemon_threads = True
+        address = f"http://{host}:{server.server_address[1]}"
+    server.controller = controller
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logger.info(f"Control API listening on {address}")
+    print(f"Control API listening on {address}")
+    return server
+
+# ------------------- Storage Startup -------------------
+def prepare_storage():
+    video_folders = storage_pool.refresh()
+    if not video_folders:
+        return video_folders
+    print(f"Recording to {len(video_folders)} storage volume(s): {', '.join(video_folders)}")
+    for video_folder in video_folders:
+        retention_manager.add_folder(video_folder)
+    retention_manager.start()
+    # Files present now are leftovers from earlier runs; anything newer belongs to this run
+    leftover_files = []
+    for video_folder in video_folders:
+        # Tier copies that never finished uploading are remade from their originals
+        cloud_folder = os.path.join(video_folder, 'cloud')
+        if os.path.isdir(cloud_folder):
+            for file_name in os.listdir(cloud_folder):
+                try:
+                    os.remove(os.path.join(cloud_folder, file_name))
+                except OSError as e:
+                    logger.error(f"Cannot remove stale tier copy {file_name}: {e}")
+        for file_name in os.listdir(video_folder):
+            file_path = os.path.join(video_folder, file_name)
+            if file_name.endswith('.mp4') and os.path.isfile(file_path):
+                leftover_files.append(file_path)
+    # Hashing files and asking S3 about them can take minutes, so recording does not wait for it
+    threading.Thread(target=reconcile_uploads, args=(leftover_files,), daemon=True).start()
+    return video_folders
+
+def reconcile_uploads(file_paths):
+    """Queue the files that are not in S3, once storage is reachable"""
+    upload_scheduler.storage_ready.wait()
+    logger.info(f"Checking {len(file_paths)} existing video file(s) for ones not uploaded to S3...")
+    for file_path in file_paths:
+        if os.path.isfile(file_path) and not upload_scheduler.is_uploaded(file_path):
+            logger.info(f"Found local file not in S3: {os.path.basename(file_path)}. Queuing for upload.")
+            tier_transcoder.submit(file_path)
+
+# ------------------- Daemon Mode -------------------
+def run_daemon(args):
+    upload_scheduler.start_scheduler()
+    encoder_tuner.start()
+    with tracing.span('prepare storage', 'startup'):
+        video_folders = prepare_storage()
+    if not video_folders:
+        logger.error("No writable storage volume found. Exiting.")
+        print("No removable drive found or drive is not writable. Insert a USB drive with write permissions (or set EXTRA_STORAGE_PATHS) and try again.")
+        sys.exit(1)
+    controller = CameraController(INTEGRATED_DEVICES)
+    server = start_control_api(controller, args.control_host, args.control_port, args.control_socket)
+    shutdown_event = threading.Event()
+    def request_shutdown(signum, frame):
+        logger.info(f"Received signal {signum}, shutting down")
+        shutdown_event.set()
+    signal.signal(signal.SIGTERM, request_shutdown)
+    signal.signal(signal.SIGINT, request_shutdown)
+    record = list(controller.devices) if 'all' in args.record else args.record
+    for camera_id in record:
+        ok, message = controller.start_camera(camera_id)
+        print(message)
+    # Everything else happens on worker threads; just wait for a signal
+    shutdown_event.wait()
+    print("Shutting down...")
+    controller.stop_all()
+    server.shutdown()
+    server.server_close()
+    if args.control_socket and os.path.exists(args.control_socket):
+        os.remove(args.control_socket)
+    ingest_hub.shutdown()
+    preview_generator.shutdown()
+    tier_transcoder.shutdown()
+    upload_scheduler.stop_scheduler()
+    retention_manager.stop()
 
 # ------------------- Main -------------------
 def main():
     try:
         upload_scheduler.start_scheduler()
-        usb_drive = find_removable_drive()
-        if not usb_drive:
-            print("No removable drive found or drive is not writable. Insert a USB drive with write permissions and try again.")
+        encoder_tuner.start()
+        with tracing.span('prepare storage', 'startup'):
+            video_folders = prepare_storage()
+        if not video_folders:
+            print("No removable drive found or drive is not writable. Insert a USB drive with write permissions (or set EXTRA_STORAGE_PATHS) and try again.")
             sys.exit()
-        video_folder = os.path.join(usb_drive, 'captured_videos')
-        os.makedirs(video_folder, exist_ok=True)
-
-        # Check for existing files in video_folder and queue them for upload if not in S3
-        print("Checking for existing video files not uploaded to S3...")
-        for file_name in os.listdir(video_folder):
-            if file_name.endswith('.mp4'):
-                file_path = os.path.join(video_folder, file_name)
-                if os.path.isfile(file_path) and not upload_scheduler.check_file_exists_in_s3(file_name):
-                    logger.info(f"Found local file not in S3: {file_name}. Queuing for upload.")
-                    upload_scheduler.queue_upload(file_path)
 
         print("Note: S3 uploads may fail due to invalid credentials. Update AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY, and S3_BUCKET_NAME in the script.")
         selected_camera = select_camera()
@@ -876,96 +3344,36 @@ def main():
                 if isinstance(camera_info, tuple) and camera_info[0] == 'live':
                     print("Current camera is set to live stream mode. Please change camera to record.")
                     continue
+                for video_folder in storage_pool.refresh():
+                    retention_manager.add_folder(video_folder)
+                if retention_manager.enforce() == 'critical':
+                    print("Recording drive is almost full and no uploaded files can be evicted. Wait for uploads to finish or free up space.")
+                    continue
+                if retention_manager.pressure == 'degraded':
+                    print("Recording drive is low on space. Recording at reduced quality.")
                 start_time = datetime.now()
-                temp_filename = f"temp_recording_{start_time.strftime('%Y%m%d_%H%M%S')}.mp4"
-                temp_output_path = os.path.join(video_folder, temp_filename)
+                recording_started = tracing.clock()
                 print(f"Starting recording at: {start_time.strftime('%Y-%m-%d %I:%M:%S %p')}")
-                print(f"Temporary file: {temp_output_path}")
-                ffmpeg_command, _ = build_ffmpeg_command(selected_camera, temp_output_path)
-                print(f"FFmpeg command: {' '.join(ffmpeg_command)}")
-                try:
-                    process = subprocess.Popen(ffmpeg_command, stdin=subprocess.PIPE, 
-                                             stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-                    def log_ffmpeg_errors():
-                        stderr_output = []
-                        for line in process.stderr:
-                            if line.strip():
-                                stderr_output.append(line.strip())
-                                logger.error(line.strip())
-                        return stderr_output
-                    error_thread = threading.Thread(target=log_ffmpeg_errors, daemon=True)
-                    error_thread.start()
-                except Exception as e:
-                    print(f"Error starting FFmpeg: {e}")
+                stop_event = StopSignal()
+                session = RecordingSession(selected_camera, on_finished=stop_event.set,
+                                           encode_settings=encoder_tuner.settings_for(1))
+                if not session.start():
+                    stop_event.close()
                     continue
                 print('Recording started. Type "stop" and press Enter to stop recording.')
-                stop_event = threading.Event()
                 input_thread = threading.Thread(target=monitor_input, args=(stop_event,))
                 input_thread.daemon = True
                 input_thread.start()
-                recording_start_time = time.time()
-                process_finished = False
-                while not stop_event.is_set():
-                    if process.poll() is not None:
-                        process_finished = True
-                        break
-                    if time.time() - recording_start_time > 3 and process.poll() is not None:
-                        print("FFmpeg process ended unexpectedly. Check video_recorder.log for errors.")
-                        process_finished = True
-                        break
-                    time.sleep(0.1)
-                end_time = datetime.now()
-                if not process_finished:
-                    print("Stopping recording...")
-                    try:
-                        if process.stdin and not process.stdin.closed:
-                            process.stdin.write('q\n')
-                            process.stdin.flush()
-                        try:
-                            process.wait(timeout=5)
-                            print(f'Recording stopped gracefully at: {end_time.strftime("%Y-%m-%d %I:%M:%S %p")}')
-                        except subprocess.TimeoutExpired:
-                            print('FFmpeg taking too long to stop, force terminating...')
-                            process.terminate()
-                            try:
-                                process.wait(timeout=3)
-                            except subprocess.TimeoutExpired:
-                                process.kill()
-                                process.wait()
-                            print('Recording force stopped.')
-                    except Exception as e:
-                        logger.error(f"Error stopping FFmpeg: {e}")
-                        try:
-                            process.terminate()
-                            process.wait(timeout=3)
-                        except:
-                            process.kill()
-                            process.wait()
-                else:
-                    if process.returncode != 0:
-                        print(f"Recording failed with exit code {process.returncode}. Check video_recorder.log for FFmpeg errors.")
-                stop_event.set()
+                # Woken by "stop" on stdin or by the session ending on its own
+                stop_event.wait()
+                session.stop()
+                tracing.complete('recording session', recording_started, category='recording',
+                                 camera=session.camera_id, restarts=session.restarts)
+                if session.restarts:
+                    print(f"FFmpeg was restarted {session.restarts} time(s); gaps are listed in {RECORDING_INDEX_FILE}.")
                 if input_thread.is_alive():
                     input_thread.join(timeout=2)
-                if os.path.exists(temp_output_path) and os.path.getsize(temp_output_path) > 0:
-                    if validate_output_file(temp_output_path):
-                        final_filename = generate_filename(start_time, end_time)
-                        final_output_path = os.path.join(video_folder, final_filename)
-                        try:
-                            os.rename(temp_output_path, final_output_path)
-                            print(f'Recording saved as: {final_filename}')
-                            print(f"Please check the file at {final_output_path} with VLC or another media player.")
-                            upload_scheduler.queue_upload(final_output_path)
-                        except Exception as e:
-                            logger.error(f"Error renaming file: {e}")
-                            print(f'Recording saved as: {temp_filename}')
-                            print(f"Please check the file at {temp_output_path} with VLC or another media player.")
-                            upload_scheduler.queue_upload(temp_output_path)
-                    else:
-                        print(f'Output file {temp_output_path} is invalid. Check video_recorder.log for errors.')
-                else:
-                    print(f'Recording file not found or empty at {temp_output_path}. Check video_recorder.log for errors.')
-                stop_event.clear()
+                stop_event.close()
             elif action == 'camera':
                 selected_camera = select_camera()
                 if selected_camera[0] is None:
@@ -996,20 +3404,66 @@ def main():
                     print("Live stream is only available for IP cameras.")
                     print("Please change camera to an IP webcam to use live stream feature.")
             elif action == 'exit':
+                preview_generator.shutdown()
+                tier_transcoder.shutdown()
                 print("Stopping upload scheduler...")
                 upload_scheduler.stop_scheduler()
+                retention_manager.stop()
                 print("Exiting...")
                 sys.exit()
             else:
                 print('Invalid command. Type "start" to record, "camera" to change camera, "live" for live stream, or "exit" to quit.')
     except KeyboardInterrupt:
         print("\nShutting down...")
+        preview_generator.shutdown()
+        tier_transcoder.shutdown()
         upload_scheduler.stop_scheduler()
+        retention_manager.stop()
         sys.exit()
     except Exception as e:
         logger.error(f"Unexpected error in main: {e}")
         upload_scheduler.stop_scheduler()
+        retention_manager.stop()
         sys.exit()
 
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Record cameras to removable storage and upload the recordings to S3.")
+    parser.add_argument('--daemon', action='store_true',
+                        help='run headless, controlled through the HTTP control API instead of prompts')
+    parser.add_argument('--control-host', default=CONTROL_API_HOST,
+                        help='address the control API listens on (default: %(default)s)')
+    parser.add_argument('--control-port', type=int, default=CONTROL_API_PORT,
+                        help='port the control API listens on (default: %(default)s)')
+    parser.add_argument('--control-socket', metavar='PATH',
+                        help='serve the control API on a Unix socket instead of TCP')
+    parser.add_argument('--record', metavar='CAMERA_ID', nargs='*', default=[],
+                        help='integrated devices to start recording at launch, or "all"')
+    parser.add_argument('--autotune', action='store_true',
+                        help='re-measure the encoder on this host and print the settings it picks')
+    parser.add_argument('--trace', metavar='FILE', nargs='?', const='',
+                        help='write a Chrome trace of where time went (default file: recorder_trace_<time>.json)')
+    parser.add_argument('--profile', action='store_true',
+                        help='also sample Python stacks into the trace; costs some CPU')
+    return parser.parse_args(argv)
+
+def run_autotune():
+    print("Benchmarking the encoder on this host (this takes a few seconds)...")
+    encoder_tuner.get_profile(force=True)
+    camera_total = max(1, len(INTEGRATED_DEVICES))
+    for camera_count in sorted({1, camera_total}):
+        settings = encoder_tuner.settings_for(camera_count)
+        print(f"{camera_count} camera(s): {settings}")
+
 if __name__ == "__main__":
-    main()
+    args = parse_args()
+    if STREAMING_UPLOAD and STREAMING_PART_SIZE < MIN_MULTIPART_PART_SIZE:
+        print(f"STREAMING_PART_SIZE is {STREAMING_PART_SIZE} bytes; S3 needs at least {MIN_MULTIPART_PART_SIZE} per part.")
+        sys.exit(1)
+    if args.trace is not None or args.profile:
+        tracing.start(args.trace or tracing.default_path('recorder'), profile=args.profile)
+    if args.autotune:
+        run_autotune()
+    elif args.daemon:
+        run_daemon(args)
+    else:
+        main()
@@ -0,0 +1,120 @@
+import argparse
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+from botocore.exceptions import ClientError
+
+from recording_names import partition_path
+
+# ------------------- AWS S3 Setup -------------------
+AWS_ACCESS_KEY_ID = ''
+AWS_SECRET_ACCESS_KEY = ''
+AWS_REGION = 'eu-north-1'
+BUCKET_NAME = 'my-bucket-save'
+PREFIX = 'recorded-videos/'
+S3_ENDPOINT_URL = None  # set for S3-compatible stores (MinIO, moto server)
+PREVIEW_SUFFIXES = ('_sprite.jpg', '_preview.mp4', '_preview.json')
+
+# ------------------- Plan -------------------
+def recording_for(file_name):
+    """Recording name a flat object belongs to; previews are filed with their recording"""
+    for suffix in PREVIEW_SUFFIXES:
+        if file_name.endswith(suffix):
+            return file_name[:-len(suffix)] + '.mp4'
+    return file_name
+
+def plan_moves(s3_client, base_prefix):
+    """(source key, destination key, size) for every flat object directly under base_prefix"""
+    moves = []
+    paginator = s3_client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=BUCKET_NAME, Prefix=base_prefix, Delimiter='/'):
+        for item in page.get('Contents', []):
+            file_name = item['Key'][len(base_prefix):]
+            partition = partition_path(recording_for(file_name))
+            if partition:
+                moves.append((item['Key'], f"{base_prefix}{partition}{file_name}", item['Size']))
+    return moves
+
+# ------------------- Migrate -------------------
+class LayoutMigration:
+    """Copies flat-layout objects to <camera>/YYYY/MM/DD/HH/ keys.
+
+    A source is deleted only after its copy is confirmed with the same size,
+    and copies that already exist are skipped. An interrupted run can
+    simply be started again.
+    """
+    def __init__(self, s3_client, keep_source=False, dry_run=False):
+        self.s3_client = s3_client
+        self.keep_source = keep_source
+        self.dry_run = dry_run
+        self.lock = threading.Lock()
+        self.stats = {'moved': 0, 'skipped': 0, 'failed': 0, 'bytes': 0}
+
+    def count(self, key, amount=1):
+        with self.lock:
+            self.stats[key] += amount
+
+    def _size(self, key):
+        try:
+            return self.s3_client.head_object(Bucket=BUCKET_NAME, Key=key)['ContentLength']
+        except ClientError as e:
+            if e.response['Error']['Code'] in ('404', 'NoSuchKey'):
+                return None
+            raise
+
+    def move(self, source_key, destination_key, size):
+        if self.dry_run:
+            print(f"{source_key} -> {destination_key}")
+            self.count('moved')
+            return
+        try:
+            if self._size(destination_key) == size:
+                self.count('skipped')
+            else:
+                self.s3_client.copy({'Bucket': BUCKET_NAME, 'Key': source_key}, BUCKET_NAME, destination_key)
+                if self._size(destination_key) != size:
+                    raise RuntimeError("copy size does not match the source")
+                self.count('moved')
+                self.count('bytes', size)
+            if not self.keep_source:
+                self.s3_client.delete_object(Bucket=BUCKET_NAME, Key=source_key)
+        except Exception as e:
+            print(f"Failed to move {source_key}: {e}")
+            self.count('failed')
+
+    def run(self, moves, workers):
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for move in moves:
+                executor.submit(self.move, *move)
+        return self.stats
+
+# ------------------- Main -------------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Move flat-layout recordings in S3 to the time-partitioned layout.")
+    parser.add_argument('--dry-run', action='store_true', help='print the planned moves without changing anything')
+    parser.add_argument('--keep-source', action='store_true', help='copy objects but leave the flat originals')
+    parser.add_argument('--workers', type=int, default=8, help='parallel copies (default: %(default)s)')
+    args = parser.parse_args(argv)
+
+    s3_client = boto3.client(
+        's3',
+        aws_access_key_id=AWS_ACCESS_KEY_ID,
+        aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
+        region_name=AWS_REGION,
+        endpoint_url=S3_ENDPOINT_URL
+    )
+    try:
+        moves = plan_moves(s3_client, PREFIX) + plan_moves(s3_client, f"{PREFIX}previews/")
+    except Exception as e:
+        print(f"Error listing {BUCKET_NAME}/{PREFIX}: {e}")
+        return 1
+    print(f"{len(moves)} object(s) to migrate in {BUCKET_NAME}/{PREFIX}")
+    stats = LayoutMigration(s3_client, args.keep_source, args.dry_run).run(moves, args.workers)
+    print(f"Moved: {stats['moved']}  Already migrated: {stats['skipped']}  Failed: {stats['failed']}  "
+          f"Copied: {stats['bytes'] / (1024 * 1024):.1f} MB")
+    return 1 if stats['failed'] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
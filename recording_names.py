@@ -0,0 +1,124 @@
+import os
+import re
+import time
+from datetime import datetime
+
+# ------------------- Recording Name Format -------------------
+# rec_<start epoch ms, 13 digits>_<duration ms, 9 digits>_<camera id>.mp4
+# Fixed-width numbers make names sort by start time and parse by slicing.
+NAME_PREFIX = 'rec_'
+NAME_SUFFIX = '.mp4'
+START_DIGITS = 13
+DURATION_DIGITS = 9
+START_END = len(NAME_PREFIX) + START_DIGITS
+DURATION_END = START_END + 1 + DURATION_DIGITS
+MAX_DURATION_MS = 10 ** DURATION_DIGITS - 1   # about 11.6 days; longer recordings are named as this long
+MIN_NAME_LENGTH = DURATION_END + 1 + 1 + len(NAME_SUFFIX)
+HOUR_MS = 60 * 60 * 1000
+DAY_MS = 24 * HOUR_MS
+LEGACY_CAMERA = 'legacy'   # partition for legacy names, which carry no camera id
+RESERVED_FOLDERS = ('index', 'previews', 'streaming')   # S3 folders beside the camera folders
+# Recordings up to this long are filed by start hour, so a search only looks
+# this far back before its window. Longer ones, such as legacy recordings that
+# were never split or any made with MAX_SEGMENT_SECONDS = 0, go under
+# <camera>/long/, which is always listed in full.
+MAX_PARTITIONED_MS = 6 * HOUR_MS
+LONG_PARTITION = 'long/'
+
+# captured_video_2024-01-15_11-58-00_PM_to_12-03-10_AM.mp4 (local time, 12-hour clock)
+LEGACY_NAME_PATTERN = re.compile(
+    r'captured_video_(\d{4})-(\d{2})-(\d{2})_(\d{2})-(\d{2})-(\d{2})_([AP])M'
+    r'_to_(\d{2})-(\d{2})-(\d{2})_([AP])M\.mp4$'
+)
+
+def camera_slug(camera_id):
+    """Camera id reduced to the characters allowed in a recording name, never a reserved folder name"""
+    slug = re.sub(r'[^a-z0-9-]+', '-', str(camera_id or '').lower()).strip('-') or 'camera'
+    return f"{slug}-cam" if slug in RESERVED_FOLDERS else slug
+
+def epoch_ms(moment):
+    return int(moment.timestamp() * 1000)
+
+def recording_name(start_time, end_time, camera_id=None):
+    start_ms = epoch_ms(start_time)
+    duration_ms = min(max(epoch_ms(end_time) - start_ms, 0), MAX_DURATION_MS) if end_time else 0
+    return f"{NAME_PREFIX}{start_ms:0{START_DIGITS}d}_{duration_ms:0{DURATION_DIGITS}d}_{camera_slug(camera_id)}{NAME_SUFFIX}"
+
+def name_prefix_for(start_ms):
+    """Key prefix shared by every recording starting at start_ms; useful as an S3 StartAfter bound"""
+    return f"{NAME_PREFIX}{max(start_ms, 0):0{START_DIGITS}d}"
+
+def _hour_24(hour, meridiem):
+    return hour % 12 + (12 if meridiem == 'P' else 0)
+
+def _parse_legacy(base_name):
+    match = LEGACY_NAME_PATTERN.match(base_name)
+    if not match:
+        return None
+    year, month, day, hour, minute, second, meridiem, end_hour, end_minute, end_second, end_meridiem = match.groups()
+    try:
+        start = datetime(int(year), int(month), int(day), _hour_24(int(hour), meridiem), int(minute), int(second))
+        end = start.replace(hour=_hour_24(int(end_hour), end_meridiem), minute=int(end_minute), second=int(end_second))
+    except ValueError:
+        return None
+    start_ms, end_ms = epoch_ms(start), epoch_ms(end)
+    if end_ms < start_ms:
+        # The end time has no date; an earlier clock time means the recording crossed midnight
+        end_ms += DAY_MS
+    return start_ms, end_ms, None
+
+def parse_recording_name(name):
+    """(start_ms, end_ms, camera_id) for a recording file name or S3 key, or None.
+
+    Legacy captured_video_ names are read too; their camera_id is None.
+    """
+    base_name = name[name.rfind('/') + 1:]
+    if base_name.startswith(NAME_PREFIX):
+        if (len(base_name) < MIN_NAME_LENGTH or not base_name.endswith(NAME_SUFFIX)
+                or base_name[START_END] != '_' or base_name[DURATION_END] != '_'):
+            return None
+        start = base_name[len(NAME_PREFIX):START_END]
+        duration = base_name[START_END + 1:DURATION_END]
+        if not (start.isdigit() and duration.isdigit()):
+            return None
+        start_ms = int(start)
+        return start_ms, start_ms + int(duration), base_name[DURATION_END + 1:-len(NAME_SUFFIX)]
+    if base_name.startswith('captured_video_'):
+        return _parse_legacy(base_name)
+    return None
+
+def is_recording_name(name):
+    return parse_recording_name(os.path.basename(name)) is not None
+
+# ------------------- Time Partitions -------------------
+# S3 keys are laid out as <camera>/YYYY/MM/DD/HH/<name> by UTC start hour,
+# or <camera>/long/<name> for recordings longer than MAX_PARTITIONED_MS
+def day_partition(ms):
+    moment = time.gmtime(ms // 1000)
+    return f"{moment.tm_year:04d}/{moment.tm_mon:02d}/{moment.tm_mday:02d}/"
+
+def hour_partition(ms):
+    return f"{day_partition(ms)}{time.gmtime(ms // 1000).tm_hour:02d}/"
+
+def partition_path(name):
+    """camera/YYYY/MM/DD/HH/ or camera/long/ for a recording name, or None if the name is not a recording"""
+    parsed = parse_recording_name(name)
+    if parsed is None:
+        return None
+    start_ms, end_ms, camera_id = parsed
+    if end_ms - start_ms > MAX_PARTITIONED_MS:
+        return f"{camera_id or LEGACY_CAMERA}/{LONG_PARTITION}"
+    return f"{camera_id or LEGACY_CAMERA}/{hour_partition(start_ms)}"
+
+def window_partitions(start_ms, end_ms):
+    """Day and hour partitions covering the window; whole UTC days collapse to one day prefix"""
+    partitions = []
+    hour = max(start_ms, 0) // HOUR_MS * HOUR_MS
+    while hour <= end_ms:
+        if hour % DAY_MS == 0 and hour + DAY_MS - 1 <= end_ms:
+            partitions.append(day_partition(hour))
+            hour += DAY_MS
+        else:
+            partitions.append(hour_partition(hour))
+            hour += HOUR_MS
+    return partitions
@@ -0,0 +1,396 @@
+import base64
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import uuid
+
+# ------------------- Storage Backend Configuration -------------------
+LOCAL_METADATA_FOLDER = '.metadata'     # per-object metadata sidecars inside a local store
+LOCAL_MULTIPART_FOLDER = '.multipart'   # parts of unfinished multipart uploads inside a local store
+LOCAL_LIST_PAGE_SIZE = 1000
+
+def sha256_checksum(data):
+    """Base64 SHA-256, the form S3 uses for ChecksumSHA256"""
+    return base64.b64encode(hashlib.sha256(data).digest()).decode()
+
+# ------------------- Storage Backend Interface -------------------
+class StorageBackend:
+    """Object store used for recordings, previews and the recording index.
+
+    Keys are '/'-separated paths. head() returns None for a missing object;
+    every other failure raises. Checksums are base64 SHA-256 digests, and
+    a multipart object's checksum is the SHA-256 of its part digests with a
+    -<parts> suffix, as in S3.
+    """
+    name = 'storage'
+
+    def check(self):
+        """Raise if the store cannot be reached"""
+        raise NotImplementedError
+
+    def put(self, key, data, metadata=None, checksum=None):
+        raise NotImplementedError
+
+    def get(self, key):
+        raise NotImplementedError
+
+    def get_range(self, key, start, end):
+        """Bytes start to end of an object, both inclusive like an HTTP Range"""
+        raise NotImplementedError
+
+    def download(self, key, path):
+        raise NotImplementedError
+
+    def head(self, key):
+        """{'size', 'metadata', 'checksum'} of an object, or None if it does not exist"""
+        raise NotImplementedError
+
+    def list_pages(self, prefix, delimiter=None):
+        """Yield (keys, folders) pages of the objects under prefix, in key order.
+
+        With a delimiter, keys containing it after the prefix are grouped into
+        folders instead, as S3's CommonPrefixes.
+        """
+        raise NotImplementedError
+
+    def copy(self, source_key, key, metadata=None):
+        """Copy an object, replacing its metadata when metadata is given"""
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def create_multipart(self, key, metadata=None):
+        """Start a multipart upload; returns its upload id"""
+        raise NotImplementedError
+
+    def upload_part(self, key, upload_id, part_number, data, checksum=None):
+        """Upload one part; returns the part entry to pass to complete_multipart"""
+        raise NotImplementedError
+
+    def complete_multipart(self, key, upload_id, parts):
+        raise NotImplementedError
+
+    def abort_multipart(self, key, upload_id):
+        raise NotImplementedError
+
+    def url(self, key, expires=3600):
+        """A URL ffmpeg can read the object from"""
+        raise NotImplementedError
+
+# ------------------- S3 Backend -------------------
+class S3Backend(StorageBackend):
+    """Amazon S3.
+
+    boto3 takes a good part of a second to import and to build a client, so
+    both wait until the first request instead of slowing down startup.
+    """
+    name = 's3'
+
+    def __init__(self, bucket, region=None, access_key=None, secret_key=None, endpoint_url=None):
+        self.bucket = bucket
+        self.region = region
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.endpoint_url = endpoint_url
+        self._client = None
+        self.client_lock = threading.Lock()
+
+    @property
+    def client(self):
+        if self._client is None:
+            with self.client_lock:
+                if self._client is None:
+                    import boto3
+                    self._client = boto3.client(
+                        's3',
+                        aws_access_key_id=self.access_key or None,
+                        aws_secret_access_key=self.secret_key or None,
+                        region_name=self.region,
+                        endpoint_url=self.endpoint_url,
+                        config=self.client_config()
+                    )
+        return self._client
+
+    def client_config(self):
+        return None
+
+    def check(self):
+        from botocore.exceptions import NoCredentialsError
+        try:
+            self.client.head_bucket(Bucket=self.bucket)
+        except NoCredentialsError:
+            raise PermissionError("AWS credentials not found. Please configure AWS_ACCESS_KEY_ID and AWS_SECRET_ACCESS_KEY")
+
+    def put(self, key, data, metadata=None, checksum=None):
+        arguments = {'Bucket': self.bucket, 'Key': key, 'Body': data, 'Metadata': metadata or {}}
+        if checksum:
+            arguments['ChecksumSHA256'] = checksum
+        self.client.put_object(**arguments)
+
+    def get(self, key):
+        return self.client.get_object(Bucket=self.bucket, Key=key)['Body'].read()
+
+    def get_range(self, key, start, end):
+        return self.client.get_object(Bucket=self.bucket, Key=key, Range=f"bytes={start}-{end}")['Body'].read()
+
+    def download(self, key, path):
+        self.client.download_file(self.bucket, key, path)
+
+    def head(self, key):
+        from botocore.exceptions import ClientError
+        try:
+            head = self.client.head_object(Bucket=self.bucket, Key=key, ChecksumMode='ENABLED')
+        except ClientError as e:
+            if e.response['Error']['Code'] in ('404', 'NoSuchKey'):
+                return None
+            raise
+        return {'size': head['ContentLength'], 'metadata': head.get('Metadata', {}), 'checksum': head.get('ChecksumSHA256')}
+
+    def list_pages(self, prefix, delimiter=None):
+        arguments = {'Bucket': self.bucket, 'Prefix': prefix}
+        if delimiter:
+            arguments['Delimiter'] = delimiter
+        for page in self.client.get_paginator('list_objects_v2').paginate(**arguments):
+            yield ([item['Key'] for item in page.get('Contents', [])],
+                   [common['Prefix'] for common in page.get('CommonPrefixes', [])])
+
+    def copy(self, source_key, key, metadata=None):
+        extra = {'Metadata': metadata, 'MetadataDirective': 'REPLACE'} if metadata is not None else None
+        # Managed copy so objects above the 5 GB single-copy limit still work
+        self.client.copy({'Bucket': self.bucket, 'Key': source_key}, self.bucket, key, ExtraArgs=extra)
+
+    def delete(self, key):
+        self.client.delete_object(Bucket=self.bucket, Key=key)
+
+    def create_multipart(self, key, metadata=None):
+        return self.client.create_multipart_upload(Bucket=self.bucket, Key=key, Metadata=metadata or {},
+                                                   ChecksumAlgorithm='SHA256')['UploadId']
+
+    def upload_part(self, key, upload_id, part_number, data, checksum=None):
+        arguments = {'Bucket': self.bucket, 'Key': key, 'UploadId': upload_id, 'PartNumber': part_number, 'Body': data}
+        if checksum:
+            arguments['ChecksumSHA256'] = checksum
+        response = self.client.upload_part(**arguments)
+        part = {'PartNumber': part_number, 'ETag': response['ETag']}
+        if checksum:
+            part['ChecksumSHA256'] = checksum
+        return part
+
+    def complete_multipart(self, key, upload_id, parts):
+        self.client.complete_multipart_upload(Bucket=self.bucket, Key=key, UploadId=upload_id,
+                                              MultipartUpload={'Parts': parts})
+
+    def abort_multipart(self, key, upload_id):
+        self.client.abort_multipart_upload(Bucket=self.bucket, Key=key, UploadId=upload_id)
+
+    def url(self, key, expires=3600):
+        return self.client.generate_presigned_url('get_object', Params={'Bucket': self.bucket, 'Key': key},
+                                                  ExpiresIn=expires)
+
+class S3CompatibleBackend(S3Backend):
+    """MinIO, Ceph, moto or another S3 API on a LAN; addressed by path since they rarely have bucket DNS"""
+    name = 's3-compatible'
+
+    def __init__(self, bucket, endpoint_url, region=None, access_key=None, secret_key=None):
+        super().__init__(bucket, region or 'us-east-1', access_key, secret_key, endpoint_url)
+
+    def client_config(self):
+        from botocore.config import Config
+        return Config(s3={'addressing_style': 'path'}, signature_version='s3v4')
+
+# ------------------- Local Directory Backend -------------------
+class LocalBackend(StorageBackend):
+    """Objects as files under a directory, for offline sites and benchmarks.
+
+    The directory can be a local disk or a NAS mount. Metadata and checksums
+    live in JSON sidecars under .metadata, and multipart uploads are
+    assembled from parts kept under .multipart.
+    """
+    name = 'local'
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+
+    def _path(self, key):
+        path = os.path.abspath(os.path.join(self.root, *key.split('/')))
+        if not path.startswith(self.root + os.sep):
+            raise ValueError(f"Key outside the store: {key}")
+        return path
+
+    def _metadata_path(self, key):
+        return os.path.join(self.root, LOCAL_METADATA_FOLDER, *key.split('/')) + '.json'
+
+    def _upload_folder(self, upload_id):
+        return os.path.join(self.root, LOCAL_MULTIPART_FOLDER, upload_id)
+
+    def _write_atomic(self, path, write):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        handle, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp_')
+        try:
+            with os.fdopen(handle, 'wb') as f:
+                write(f)
+            os.replace(temp_path, path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+    def _write_metadata(self, key, metadata, checksum):
+        sidecar = json.dumps({'metadata': metadata or {}, 'checksum': checksum}).encode()
+        self._write_atomic(self._metadata_path(key), lambda f: f.write(sidecar))
+
+    def check(self):
+        os.makedirs(self.root, exist_ok=True)
+        if not os.access(self.root, os.W_OK):
+            raise PermissionError(f"Local store {self.root} is not writable")
+
+    def put(self, key, data, metadata=None, checksum=None):
+        actual = sha256_checksum(data)
+        if checksum and checksum != actual:
+            raise ValueError(f"Checksum mismatch uploading {key}")
+        self._write_atomic(self._path(key), lambda f: f.write(data))
+        self._write_metadata(key, metadata, actual)
+
+    def get(self, key):
+        with open(self._path(key), 'rb') as f:
+            return f.read()
+
+    def get_range(self, key, start, end):
+        with open(self._path(key), 'rb') as f:
+            f.seek(start)
+            return f.read(end - start + 1)
+
+    def download(self, key, path):
+        shutil.copyfile(self._path(key), path)
+
+    def head(self, key):
+        path = self._path(key)
+        if not os.path.isfile(path):
+            return None
+        try:
+            with open(self._metadata_path(key)) as f:
+                sidecar = json.load(f)
+        except (OSError, ValueError):
+            sidecar = {}
+        return {'size': os.path.getsize(path), 'metadata': sidecar.get('metadata', {}), 'checksum': sidecar.get('checksum')}
+
+    def _key(self, path):
+        return os.path.relpath(path, self.root).replace(os.sep, '/')
+
+    def _is_internal(self, dir_path, name):
+        return name.startswith('.tmp_') or (dir_path == self.root and name.startswith('.'))
+
+    def _walk(self, folder):
+        """Keys of every object under a folder of the store"""
+        for dir_path, dir_names, file_names in os.walk(folder):
+            dir_names[:] = [name for name in dir_names if not self._is_internal(dir_path, name)]
+            for file_name in file_names:
+                if not self._is_internal(dir_path, file_name):
+                    yield self._key(os.path.join(dir_path, file_name))
+
+    def list_pages(self, prefix, delimiter=None):
+        # Only the deepest folder the prefix names needs to be read
+        folder = os.path.join(self.root, *prefix.split('/')[:-1])
+        if not os.path.isdir(folder):
+            return
+        keys, folders = [], set()
+        if delimiter == '/':
+            # Sub-folders are the common prefixes, so one directory listing is enough
+            for entry in os.scandir(folder):
+                key = self._key(entry.path)
+                if self._is_internal(folder, entry.name) or not key.startswith(prefix):
+                    continue
+                if entry.is_dir():
+                    folders.add(key + '/')
+                else:
+                    keys.append(key)
+        else:
+            for key in self._walk(folder):
+                if not key.startswith(prefix):
+                    continue
+                rest = key[len(prefix):]
+                if delimiter and delimiter in rest:
+                    folders.add(prefix + rest.split(delimiter, 1)[0] + delimiter)
+                else:
+                    keys.append(key)
+        keys.sort()
+        folders = sorted(folders)
+        for start in range(0, max(len(keys), 1), LOCAL_LIST_PAGE_SIZE):
+            yield keys[start:start + LOCAL_LIST_PAGE_SIZE], folders if start == 0 else []
+
+    def copy(self, source_key, key, metadata=None):
+        head = self.head(source_key)
+        if head is None:
+            raise FileNotFoundError(f"No such object: {source_key}")
+
+        def copy_data(out):
+            with open(self._path(source_key), 'rb') as f:
+                shutil.copyfileobj(f, out)
+        self._write_atomic(self._path(key), copy_data)
+        self._write_metadata(key, head['metadata'] if metadata is None else metadata, head['checksum'])
+
+    def delete(self, key):
+        for path in (self._path(key), self._metadata_path(key)):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def create_multipart(self, key, metadata=None):
+        upload_id = uuid.uuid4().hex
+        folder = self._upload_folder(upload_id)
+        os.makedirs(folder)
+        with open(os.path.join(folder, 'upload.json'), 'w') as f:
+            json.dump({'key': key, 'metadata': metadata or {}}, f)
+        return upload_id
+
+    def upload_part(self, key, upload_id, part_number, data, checksum=None):
+        actual = sha256_checksum(data)
+        if checksum and checksum != actual:
+            raise ValueError(f"Checksum mismatch in part {part_number} of {key}")
+        folder = self._upload_folder(upload_id)
+        if not os.path.isdir(folder):
+            raise FileNotFoundError(f"No such upload: {upload_id}")
+        self._write_atomic(os.path.join(folder, f"{part_number:05d}"), lambda f: f.write(data))
+        return {'PartNumber': part_number, 'ChecksumSHA256': actual}
+
+    def complete_multipart(self, key, upload_id, parts):
+        folder = self._upload_folder(upload_id)
+        with open(os.path.join(folder, 'upload.json')) as f:
+            upload = json.load(f)
+        part_numbers = [part['PartNumber'] for part in sorted(parts, key=lambda part: part['PartNumber'])]
+
+        def assemble(out):
+            for part_number in part_numbers:
+                with open(os.path.join(folder, f"{part_number:05d}"), 'rb') as part_file:
+                    shutil.copyfileobj(part_file, out)
+        self._write_atomic(self._path(key), assemble)
+        digests = b''.join(base64.b64decode(part['ChecksumSHA256']) for part in sorted(parts, key=lambda part: part['PartNumber']))
+        self._write_metadata(key, upload['metadata'], f"{sha256_checksum(digests)}-{len(parts)}")
+        shutil.rmtree(folder, ignore_errors=True)
+
+    def abort_multipart(self, key, upload_id):
+        shutil.rmtree(self._upload_folder(upload_id), ignore_errors=True)
+
+    def url(self, key, expires=3600):
+        return f"file:{self._path(key)}"
+
+# ------------------- Backend Factory -------------------
+STORAGE_BACKENDS = ('s3', 's3-compatible', 'local')
+
+def create_backend(kind, bucket, region=None, access_key=None, secret_key=None, endpoint_url=None, local_path=None):
+    """Build the backend a config names: 's3', 's3-compatible' (needs endpoint_url) or 'local' (needs local_path)"""
+    if kind == 's3':
+        return S3Backend(bucket, region, access_key, secret_key, endpoint_url)
+    if kind == 's3-compatible':
+        if not endpoint_url:
+            raise ValueError("The s3-compatible backend needs an endpoint URL")
+        return S3CompatibleBackend(bucket, endpoint_url, region, access_key, secret_key)
+    if kind == 'local':
+        if not local_path:
+            raise ValueError("The local backend needs a folder")
+        return LocalBackend(os.path.join(local_path, bucket))
+    raise ValueError(f"Unknown storage backend {kind!r}; expected one of {', '.join(STORAGE_BACKENDS)}")
@@ -0,0 +1,135 @@
+from collections import namedtuple
+from types import SimpleNamespace
+
+import pytest
+
+import index
+from index import (ADAPTIVE_HEADROOM_SECONDS, ADAPTIVE_PRESSURE_SECONDS, AUTOTUNE_PRESETS, QUALITY_TIERS,
+                   AdaptiveQualityController, apply_quality_tier)
+
+CpuTimes = namedtuple('CpuTimes', 'user idle')
+
+class FakeSession:
+    def __init__(self, quality_tier=0):
+        self.quality_tier = quality_tier
+        self.changes = []
+
+    def change_quality(self, tier, reason):
+        self.changes.append((tier, reason))
+        self.quality_tier = tier
+
+class FakeHost:
+    """The monotonic clock and CPU counters the controller reads, advanced by hand"""
+    def __init__(self, monkeypatch):
+        self.now = 1000.0
+        self.busy = self.idle = 0.0
+        monkeypatch.setattr(index, 'time', SimpleNamespace(monotonic=lambda: self.now))
+        monkeypatch.setattr(index.psutil, 'cpu_times', lambda: CpuTimes(self.busy, self.idle))
+
+    def advance(self, seconds, cpu_percent):
+        self.now += seconds
+        self.busy += seconds * cpu_percent / 100
+        self.idle += seconds * (100 - cpu_percent) / 100
+
+@pytest.fixture
+def host(monkeypatch):
+    return FakeHost(monkeypatch)
+
+def pixels(resolution):
+    width, height = map(int, resolution.split('x'))
+    return width * height
+
+@pytest.mark.parametrize('tier', range(len(QUALITY_TIERS)))
+@pytest.mark.parametrize('base', [
+    {'preset': 'fast', 'crf': '23'},
+    {'preset': 'veryfast', 'crf': '23', 'threads': 2, 'resolution': '1280x720', 'fps': 30},
+    {'preset': 'ultrafast', 'crf': '35', 'resolution': '320x180', 'fps': 5},
+])
+def test_tier_never_raises_quality(base, tier):
+    settings = apply_quality_tier(base, tier)
+    assert int(settings['crf']) >= int(base['crf'])
+    assert AUTOTUNE_PRESETS.index(settings['preset']) >= AUTOTUNE_PRESETS.index(base['preset'])
+    if 'fps' in base:
+        assert settings['fps'] <= base['fps']
+    if 'resolution' in base:
+        assert pixels(settings['resolution']) <= pixels(base['resolution'])
+    assert settings.get('threads') == base.get('threads')
+
+def test_tiers_lower_default_settings():
+    base = {'preset': 'fast', 'crf': '23'}
+    assert apply_quality_tier(base, 0) == base
+    assert apply_quality_tier(base, 1) == {'preset': 'fast', 'crf': '28', 'fps': 20}
+    assert apply_quality_tier(base, 3) == {'preset': 'ultrafast', 'crf': '32', 'fps': 10, 'resolution': '640x360'}
+    assert base == {'preset': 'fast', 'crf': '23'}
+
+def test_sustained_pressure_steps_down(host):
+    session = FakeSession()
+    controller = AdaptiveQualityController(session)
+    host.advance(5, 95)
+    controller.check()
+    host.advance(ADAPTIVE_PRESSURE_SECONDS - 1, 95)
+    controller.check()
+    assert session.changes == []
+    host.advance(1, 95)
+    controller.check()
+    assert session.changes == [(1, 'CPU 95%')]
+
+def test_brief_pressure_is_forgotten(host):
+    session = FakeSession()
+    controller = AdaptiveQualityController(session)
+    host.advance(5, 95)
+    controller.check()
+    host.advance(ADAPTIVE_PRESSURE_SECONDS - 1, 95)
+    controller.check()
+    # Between the high and low marks is neither pressure nor headroom
+    host.advance(5, 75)
+    controller.check()
+    host.advance(5, 95)
+    controller.check()
+    host.advance(ADAPTIVE_PRESSURE_SECONDS - 1, 95)
+    controller.check()
+    assert session.changes == []
+
+def test_sustained_headroom_steps_up(host):
+    session = FakeSession(quality_tier=2)
+    controller = AdaptiveQualityController(session)
+    host.advance(5, 30)
+    controller.check()
+    host.advance(ADAPTIVE_HEADROOM_SECONDS - 1, 30)
+    controller.check()
+    assert session.changes == []
+    host.advance(1, 30)
+    controller.check()
+    assert session.changes == [(1, 'headroom restored (CPU 30%)')]
+
+def test_tiers_stop_at_both_ends(host):
+    lowest = FakeSession(quality_tier=len(QUALITY_TIERS) - 1)
+    controller = AdaptiveQualityController(lowest)
+    for _ in range(3):
+        host.advance(ADAPTIVE_PRESSURE_SECONDS, 95)
+        controller.check()
+    assert lowest.changes == []
+    highest = FakeSession()
+    controller = AdaptiveQualityController(highest)
+    for _ in range(3):
+        host.advance(ADAPTIVE_HEADROOM_SECONDS, 30)
+        controller.check()
+    assert highest.changes == []
+
+def test_slow_encode_counts_only_on_a_busy_host(host):
+    session = FakeSession()
+    controller = AdaptiveQualityController(session)
+    # Half a second of media per second of wall clock
+    for media_seconds in range(12):
+        host.advance(2, 40)
+        controller.observe(f"frame=1 fps=15 time=00:00:{media_seconds:05.2f} speed=0.5x")
+        controller.check()
+    assert controller.speed == pytest.approx(0.5)
+    assert controller.pressure_since is None
+    host.advance(2, 75)
+    controller.observe("frame=1 fps=15 time=00:00:12.00 speed=0.5x")
+    controller.check()
+    host.advance(ADAPTIVE_PRESSURE_SECONDS, 75)
+    controller.observe(f"frame=1 fps=15 time=00:00:{12 + ADAPTIVE_PRESSURE_SECONDS / 2:05.2f} speed=0.5x")
+    controller.check()
+    assert session.changes == [(1, 'encode speed 0.50x at CPU 75%')]
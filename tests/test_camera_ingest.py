@@ -0,0 +1,33 @@
+from camera_ingest import CLOCK_WINDOW_SECONDS, ClockTracker
+
+def test_lag_is_window_minimum():
+    clock = ClockTracker()
+    # One second of audio per second, arriving 0.5 s late with up to 0.3 s of jitter
+    for second in range(2 * CLOCK_WINDOW_SECONDS + 1):
+        clock.add(1.0, second + 1.5 + (0.3 if second % 2 else 0))
+    assert clock.lag == 0.5
+
+def test_no_lag_until_a_window_closes():
+    clock = ClockTracker()
+    for second in range(CLOCK_WINDOW_SECONDS):
+        clock.add(1.0, second + 1.0)
+    assert clock.lag is None
+
+def test_drift_shows_as_changing_lag():
+    clock = ClockTracker()
+    lags = []
+    # The camera's clock runs 1% slow, so its audio falls further behind
+    for second in range(5 * CLOCK_WINDOW_SECONDS):
+        clock.add(0.99, second + 1.0)
+        if clock.lag is not None and clock.lag not in lags:
+            lags.append(clock.lag)
+    assert len(lags) >= 3 and lags == sorted(lags)
+
+def test_reset_starts_over():
+    clock = ClockTracker()
+    for second in range(2 * CLOCK_WINDOW_SECONDS + 1):
+        clock.add(1.0, second + 2.0)
+    connection = clock.connection
+    clock.reset()
+    assert clock.connection == connection + 1
+    assert clock.lag is None and clock.media_time == 0.0
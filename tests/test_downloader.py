@@ -0,0 +1,76 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import downloader
+from recording_names import MAX_PARTITIONED_MS, epoch_ms, partition_path, recording_name
+from storage_backend import LocalBackend
+
+START = datetime(2024, 1, 15, 12, 0, tzinfo=timezone.utc)
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    backend = LocalBackend(str(tmp_path / 'bucket'))
+    monkeypatch.setattr(downloader, 'storage', backend)
+    return backend
+
+def upload(store, start, duration, camera_id='cam-1'):
+    name = recording_name(start, start + duration, camera_id)
+    key = f"{downloader.PREFIX}{partition_path(name)}{name}"
+    store.put(key, b'video')
+    return key
+
+def window_keys(start, end, camera=None):
+    return downloader.list_window_keys(downloader.PREFIX, epoch_ms(start), epoch_ms(end), camera)
+
+def test_finds_recordings_that_started_before_the_window(store):
+    inside = upload(store, START, timedelta(minutes=10))
+    earlier = upload(store, START - timedelta(hours=5), timedelta(hours=5, minutes=30))
+    later = upload(store, START + timedelta(hours=2), timedelta(minutes=10))
+    keys = window_keys(START + timedelta(minutes=5), START + timedelta(minutes=20))
+    assert inside in keys and earlier in keys
+    assert later not in keys
+
+def test_finds_recordings_longer_than_the_partition_lookback(store):
+    duration = timedelta(milliseconds=MAX_PARTITIONED_MS) + timedelta(hours=3)
+    long_key = upload(store, START - duration + timedelta(hours=1), duration, 'cam-2')
+    assert '/long/' in long_key
+    assert long_key in window_keys(START, START + timedelta(minutes=1))
+    assert long_key in window_keys(START, START + timedelta(minutes=1), camera='cam-2')
+    assert window_keys(START, START + timedelta(minutes=1), camera='cam-1') == []
+
+def test_finds_cameras_named_like_reserved_folders(store):
+    key = upload(store, START, timedelta(minutes=1), 'index')
+    assert key.startswith(f"{downloader.PREFIX}index-cam/")
+    store.put(f"{downloader.PREFIX}index/host.jsonl", b'{}')
+    assert window_keys(START, START + timedelta(minutes=1)) == [key]
+    assert window_keys(START, START + timedelta(minutes=1), camera='index') == [key]
+
+def test_finds_flat_objects(store):
+    name = recording_name(START, START + timedelta(minutes=1), 'cam-1')
+    store.put(f"{downloader.PREFIX}{name}", b'video')
+    assert window_keys(START, START + timedelta(minutes=1)) == [f"{downloader.PREFIX}{name}"]
+
+def test_clip_reads_all_copies_from_one_place(store):
+    s3_key = upload(store, START, timedelta(minutes=1))
+    copies = {'a.mp4': {'local': '/drive/a.mp4', 's3': s3_key}, 'b.mp4': {'local': '/drive/b.mp4'}}
+    assert downloader.choose_copies(['a.mp4', 'b.mp4'], copies) == {'a.mp4': ('local', '/drive/a.mp4'),
+                                                                  'b.mp4': ('local', '/drive/b.mp4')}
+
+def test_clip_reads_all_from_s3_when_tiers_match(store):
+    first = upload(store, START, timedelta(minutes=1))
+    second = upload(store, START + timedelta(minutes=1), timedelta(minutes=1))
+    copies = {'a.mp4': {'s3': first}, 'b.mp4': {'local': '/drive/b.mp4', 's3': second}}
+    assert downloader.choose_copies(['a.mp4', 'b.mp4'], copies) == {'a.mp4': ('s3', first), 'b.mp4': ('s3', second)}
+
+def test_clip_mixes_copies_only_when_it_must(store):
+    name = recording_name(START, START + timedelta(minutes=1), 'cam-1')
+    tier_key = f"{downloader.PREFIX}{partition_path(name)}{name}"
+    store.put(tier_key, b'video', metadata={'tier': 'compact'})
+    original_key = upload(store, START + timedelta(minutes=1), timedelta(minutes=1))
+    copies = {'a.mp4': {'s3': tier_key}, 'b.mp4': {'local': '/drive/b.mp4', 's3': original_key}}
+    chosen = downloader.choose_copies(['a.mp4', 'b.mp4'], copies)
+    assert chosen == {'a.mp4': ('s3', tier_key), 'b.mp4': ('local', '/drive/b.mp4')}
+    segments = {tier_key: {'tier': 'compact'}, '/drive/b.mp4': {'tier': None}}
+    assert downloader.mixed_tiers([(tier_key, 0, 1), ('/drive/b.mp4', 1, 2)], segments)
+    assert not downloader.mixed_tiers([('/drive/b.mp4', 1, 2)], segments)
@@ -0,0 +1,143 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from recording_names import (DAY_MS, HOUR_MS, LEGACY_CAMERA, LONG_PARTITION, MAX_DURATION_MS, MAX_PARTITIONED_MS,
+                             camera_slug, epoch_ms, is_recording_name, name_prefix_for, parse_recording_name, partition_path,
+                             recording_name, window_partitions)
+
+START = datetime(2024, 1, 15, 23, 58, 0, tzinfo=timezone.utc)
+START_MS = epoch_ms(START)
+
+# ------------------- Names -------------------
+def test_round_trip():
+    name = recording_name(START, START + timedelta(minutes=5, seconds=10), 'Cam 2')
+    assert name == f"rec_{START_MS:013d}_000310000_cam-2.mp4"
+    assert parse_recording_name(name) == (START_MS, START_MS + 310000, 'cam-2')
+
+def test_parse_reads_s3_keys():
+    name = recording_name(START, START + timedelta(seconds=1), 'cam-1')
+    assert parse_recording_name(f"videos/cam-1/2024/01/15/23/{name}") == (START_MS, START_MS + 1000, 'cam-1')
+
+def test_missing_end_is_zero_duration():
+    assert parse_recording_name(recording_name(START, None, 'cam-1')) == (START_MS, START_MS, 'cam-1')
+
+def test_end_before_start_is_zero_duration():
+    name = recording_name(START, START - timedelta(seconds=5), 'cam-1')
+    assert parse_recording_name(name)[:2] == (START_MS, START_MS)
+
+def test_duration_beyond_the_field_is_clamped():
+    # A name with a wider duration field would not parse, hiding the file from retention and the downloader
+    name = recording_name(START, START + timedelta(days=12), 'cam-1')
+    assert is_recording_name(name)
+    assert parse_recording_name(name) == (START_MS, START_MS + MAX_DURATION_MS, 'cam-1')
+    assert partition_path(name) == f"cam-1/{LONG_PARTITION}"
+
+def test_names_sort_by_start_time():
+    earlier = recording_name(datetime(2001, 9, 9, tzinfo=timezone.utc), None, 'cam-9')
+    later = recording_name(datetime(2033, 5, 18, tzinfo=timezone.utc), None, 'cam-1')
+    assert sorted([later, earlier]) == [earlier, later]
+    assert name_prefix_for(epoch_ms(datetime(2001, 9, 9, tzinfo=timezone.utc))) < earlier
+
+@pytest.mark.parametrize('camera_id, slug', [
+    ('cam-1', 'cam-1'), ('Front Door', 'front-door'), ('  USB__Cam  ', 'usb-cam'), (None, 'camera'), ('!!!', 'camera'), (3, '3'),
+    ('Index', 'index-cam'), ('previews', 'previews-cam'), ('streaming', 'streaming-cam'), ('index 2', 'index-2'),
+])
+def test_camera_slug(camera_id, slug):
+    assert camera_slug(camera_id) == slug
+
+@pytest.mark.parametrize('name', [
+    'rec_.mp4',
+    'rec_1705363080000_000310000_.mp4',
+    'rec_1705363080000_000310000_cam-1.mkv',
+    'rec_170536308000x_000310000_cam-1.mp4',
+    'rec_1705363080000-000310000_cam-1.mp4',
+    'rec_1705363080000_00031000_cam-1.mp4',
+    'captured_video_2024-01-15_11-58-00_PM.mp4',
+    'captured_video_2024-02-30_11-58-00_PM_to_12-03-10_AM.mp4',
+    'preview_1705363080000.jpg',
+])
+def test_rejects_other_names(name):
+    assert parse_recording_name(name) is None
+    assert not is_recording_name(name)
+
+# ------------------- Legacy Names -------------------
+def local_ms(*fields):
+    # Legacy names are in the recorder's local time
+    return epoch_ms(datetime(*fields))
+
+def test_legacy_name():
+    parsed = parse_recording_name('captured_video_2024-01-15_09-15-00_AM_to_01-20-30_PM.mp4')
+    assert parsed == (local_ms(2024, 1, 15, 9, 15), local_ms(2024, 1, 15, 13, 20, 30), None)
+
+def test_legacy_name_noon_and_midnight_hours():
+    parsed = parse_recording_name('captured_video_2024-01-15_12-00-00_AM_to_12-30-00_PM.mp4')
+    assert parsed == (local_ms(2024, 1, 15, 0, 0), local_ms(2024, 1, 15, 12, 30), None)
+
+def test_legacy_name_crossing_midnight():
+    start_ms, end_ms, camera_id = parse_recording_name('captured_video_2024-01-15_11-58-00_PM_to_12-03-10_AM.mp4')
+    assert start_ms == local_ms(2024, 1, 15, 23, 58)
+    assert end_ms == start_ms + 310000
+    assert camera_id is None
+
+def test_legacy_name_crossing_new_year():
+    start_ms, end_ms, _ = parse_recording_name('captured_video_2023-12-31_11-59-00_PM_to_12-01-00_AM.mp4')
+    assert end_ms - start_ms == 2 * 60 * 1000
+
+# ------------------- Partitions -------------------
+def test_partition_path():
+    name = recording_name(START, START + timedelta(minutes=5), 'cam-1')
+    assert partition_path(name) == 'cam-1/2024/01/15/23/'
+
+def test_partition_path_legacy():
+    name = 'captured_video_2024-01-15_11-58-00_PM_to_12-03-10_AM.mp4'
+    start_ms, _, _ = parse_recording_name(name)
+    assert partition_path(name) == f"{LEGACY_CAMERA}/{datetime.fromtimestamp(start_ms / 1000, timezone.utc):%Y/%m/%d/%H}/"
+
+def test_long_recordings_are_not_partitioned_by_hour():
+    longest = START + timedelta(milliseconds=MAX_PARTITIONED_MS)
+    assert partition_path(recording_name(START, longest, 'cam-1')) == 'cam-1/2024/01/15/23/'
+    longer = longest + timedelta(milliseconds=1)
+    assert partition_path(recording_name(START, longer, 'cam-1')) == f"cam-1/{LONG_PARTITION}"
+    legacy = 'captured_video_2024-01-15_08-00-00_AM_to_07-00-00_PM.mp4'
+    assert partition_path(legacy) == f"{LEGACY_CAMERA}/{LONG_PARTITION}"
+
+def test_partition_path_not_a_recording():
+    assert partition_path('notes.txt') is None
+
+def test_window_within_one_hour():
+    assert window_partitions(START_MS, START_MS + 60 * 1000) == ['2024/01/15/23/']
+
+def test_window_crossing_midnight():
+    assert window_partitions(START_MS, START_MS + 10 * 60 * 1000) == ['2024/01/15/23/', '2024/01/16/00/']
+
+def test_window_on_hour_boundary():
+    hour = START_MS // HOUR_MS * HOUR_MS
+    assert window_partitions(hour, hour) == ['2024/01/15/23/']
+    assert window_partitions(hour - 1, hour) == ['2024/01/15/22/', '2024/01/15/23/']
+
+def test_window_collapses_whole_days():
+    day = epoch_ms(datetime(2024, 1, 15, tzinfo=timezone.utc))
+    partitions = window_partitions(day - HOUR_MS, day + 2 * DAY_MS + HOUR_MS - 1)
+    assert partitions == ['2024/01/14/23/', '2024/01/15/', '2024/01/16/', '2024/01/17/00/']
+
+def test_window_part_of_a_day_stays_hourly():
+    day = epoch_ms(datetime(2024, 1, 15, tzinfo=timezone.utc))
+    partitions = window_partitions(day, day + DAY_MS - 2)
+    assert len(partitions) == 24
+    assert partitions[0] == '2024/01/15/00/' and partitions[-1] == '2024/01/15/23/'
+
+def test_window_covers_every_recording_in_it():
+    # Every recording starting inside the window lives under one of its partitions
+    start_ms = START_MS - 3 * HOUR_MS - 17
+    end_ms = START_MS + DAY_MS + 5 * HOUR_MS
+    partitions = window_partitions(start_ms, end_ms)
+    for ms in range(start_ms, end_ms + 1, 7 * 60 * 1000):
+        path = partition_path(f"rec_{ms:013d}_000000000_cam-1.mp4")[len('cam-1/'):]
+        assert any(path.startswith(partition) for partition in partitions), path
+
+def test_window_before_epoch_starts_at_zero():
+    assert window_partitions(-5, 10) == ['1970/01/01/00/']
+
+def test_empty_window():
+    assert window_partitions(START_MS, START_MS - 2 * HOUR_MS) == []
@@ -0,0 +1,70 @@
+import pytest
+
+from storage_backend import LocalBackend, create_backend, sha256_checksum
+
+@pytest.fixture
+def store(tmp_path):
+    backend = LocalBackend(str(tmp_path / 'bucket'))
+    backend.check()
+    return backend
+
+def test_put_get_head(store):
+    store.put('videos/cam-1/a.mp4', b'video', metadata={'tier': 'cloud'})
+    assert store.get('videos/cam-1/a.mp4') == b'video'
+    assert store.get_range('videos/cam-1/a.mp4', 1, 3) == b'ide'
+    assert store.head('videos/cam-1/a.mp4') == {'size': 5, 'metadata': {'tier': 'cloud'}, 'checksum': sha256_checksum(b'video')}
+    assert store.head('videos/cam-1/missing.mp4') is None
+
+def test_put_rejects_wrong_checksum(store):
+    with pytest.raises(ValueError):
+        store.put('a.mp4', b'video', checksum=sha256_checksum(b'other'))
+    assert store.head('a.mp4') is None
+
+def test_keys_cannot_leave_the_store(store):
+    with pytest.raises(ValueError):
+        store.put('../outside.mp4', b'video')
+
+def test_list_pages(store):
+    for key in ['videos/cam-1/2024/a.mp4', 'videos/cam-1/2024/b.mp4', 'videos/cam-2/c.mp4', 'videos/index.jsonl']:
+        store.put(key, b'x')
+    keys = [key for page, _ in store.list_pages('videos/') for key in page]
+    assert keys == ['videos/cam-1/2024/a.mp4', 'videos/cam-1/2024/b.mp4', 'videos/cam-2/c.mp4', 'videos/index.jsonl']
+    pages = list(store.list_pages('videos/', delimiter='/'))
+    assert pages == [(['videos/index.jsonl'], ['videos/cam-1/', 'videos/cam-2/'])]
+    assert [key for page, _ in store.list_pages('videos/cam-1/2024/b') for key in page] == ['videos/cam-1/2024/b.mp4']
+    assert list(store.list_pages('missing/')) == []
+
+def test_copy_and_delete(store):
+    store.put('a.mp4', b'video', metadata={'camera': 'cam-1'})
+    store.copy('a.mp4', 'b.mp4')
+    assert store.head('b.mp4')['metadata'] == {'camera': 'cam-1'}
+    store.delete('a.mp4')
+    store.delete('a.mp4')
+    assert store.head('a.mp4') is None
+    assert store.get('b.mp4') == b'video'
+
+def test_multipart(store):
+    upload_id = store.create_multipart('big.mp4', metadata={'sha256': 'abc'})
+    parts = [store.upload_part('big.mp4', upload_id, 2, b'world'), store.upload_part('big.mp4', upload_id, 1, b'hello ')]
+    store.complete_multipart('big.mp4', upload_id, parts)
+    assert store.get('big.mp4') == b'hello world'
+    head = store.head('big.mp4')
+    assert head['metadata'] == {'sha256': 'abc'} and head['checksum'].endswith('-2')
+    # Unfinished uploads and metadata sidecars are not listed
+    store.create_multipart('other.mp4')
+    assert [key for page, _ in store.list_pages('') for key in page] == ['big.mp4']
+
+def test_abort_multipart(store):
+    upload_id = store.create_multipart('big.mp4')
+    store.abort_multipart('big.mp4', upload_id)
+    with pytest.raises(FileNotFoundError):
+        store.upload_part('big.mp4', upload_id, 1, b'data')
+
+def test_create_backend(tmp_path):
+    assert isinstance(create_backend('local', 'bucket', local_path=str(tmp_path)), LocalBackend)
+    with pytest.raises(ValueError):
+        create_backend('local', 'bucket')
+    with pytest.raises(ValueError):
+        create_backend('s3-compatible', 'bucket')
+    with pytest.raises(ValueError):
+        create_backend('ftp', 'bucket')
@@ -0,0 +1,59 @@
+from datetime import datetime
+
+import pytest
+
+from timeline import Timeline, event_from_entry, parse_day, parse_time
+
+# 2024-01-17 is a Wednesday
+TODAY = datetime(2024, 1, 17, 15, 30)
+
+# ------------------- Days -------------------
+@pytest.mark.parametrize('text, day', [
+    ('today', datetime(2024, 1, 17)),
+    ('Yesterday', datetime(2024, 1, 16)),
+    ('monday', datetime(2024, 1, 15)),
+    ('wednesday', datetime(2024, 1, 17)),
+    ('last wednesday', datetime(2024, 1, 10)),
+    ('last tuesday', datetime(2024, 1, 16)),
+    ('thursday', datetime(2024, 1, 11)),
+    (' 2023-12-31 ', datetime(2023, 12, 31)),
+])
+def test_parse_day(text, day):
+    assert parse_day(text, today=TODAY) == day
+
+@pytest.mark.parametrize('text', ['someday', 'last', '2024-13-01', 'last 2024-01-01'])
+def test_parse_day_rejects(text):
+    with pytest.raises(ValueError):
+        parse_day(text, today=TODAY)
+
+def test_parse_time():
+    assert parse_time('1705363080000') == 1705363080000
+    assert parse_time('2024-01-15T23:58:00+00:00') == 1705363080000
+    with pytest.raises(ValueError):
+        parse_time('noon')
+
+# ------------------- Queries -------------------
+def test_event_from_entry():
+    entry = {'type': 'motion', 'camera': 'cam-1', 'time_ms': 5000, 'score': 0.7, 'file': 'a.mp4'}
+    assert event_from_entry(entry) == ('cam-1', 'motion', 5000, 5000, 0.7, '{"file": "a.mp4"}')
+
+def test_query_finds_long_events_that_started_earlier(tmp_path):
+    timeline = Timeline(str(tmp_path / 'timeline.sqlite'))
+    timeline.add_entries([
+        {'type': 'segment', 'camera': 'cam-1', 'start_ms': 0, 'end_ms': 10000, 'quality_tier': 0, 'file': 'long.mp4'},
+        {'type': 'segment', 'camera': 'cam-1', 'start_ms': 10000, 'end_ms': 11000, 'quality_tier': 1, 'file': 'short.mp4'},
+        {'type': 'gap', 'camera': 'cam-2', 'start_ms': 9000, 'end_ms': 9500},
+    ])
+    assert [event['file'] for event in timeline.query(9000, 9999, event_type='segment')] == ['long.mp4']
+    assert [event['type'] for event in timeline.query(9000, 9999)] == ['segment', 'gap']
+    assert [event['file'] for event in timeline.query(0, 20000, min_value=1)] == ['short.mp4']
+    assert timeline.query(20000, 30000) == []
+    timeline.close()
+
+def test_adding_entries_again_does_nothing(tmp_path):
+    timeline = Timeline(str(tmp_path / 'timeline.sqlite'))
+    entry = {'type': 'gap', 'camera': 'cam-1', 'start_ms': 0, 'end_ms': 500}
+    timeline.add_entries([entry])
+    timeline.add_entries([entry, {'type': 'unknown', 'time_ms': 0}])
+    assert len(timeline.query(0, 1000)) == 1
+    timeline.close()
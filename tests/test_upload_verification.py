@@ -0,0 +1,96 @@
+import hashlib
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import index
+from recording_names import recording_name
+from storage_backend import LocalBackend
+
+START = datetime(2024, 5, 1, 12, 0, tzinfo=timezone.utc)
+PART_SIZE = 1024
+
+@pytest.fixture
+def scheduler(tmp_path, monkeypatch):
+    backend = LocalBackend(str(tmp_path / 'bucket'))
+    backend.check()
+    scheduler = index.S3UploadScheduler()
+    scheduler.storage = backend
+    scheduler.storage_available = True
+    monkeypatch.setattr(index, 'KEEP_LOCAL_AFTER_UPLOAD', False)
+    monkeypatch.setattr(index, 'UPLOAD_PART_SIZE', PART_SIZE)
+    return scheduler
+
+@pytest.fixture
+def recording(tmp_path):
+    path = tmp_path / recording_name(START, START + timedelta(minutes=1), 'cam-1')
+    path.write_bytes(bytes(range(256)) * 20)
+    return path
+
+def sha256_of(data):
+    return hashlib.sha256(data).hexdigest()
+
+@pytest.mark.parametrize('size, parts', [(PART_SIZE, 1), (3 * PART_SIZE + 1, 4)])
+def test_upload_is_verified_then_deleted(scheduler, recording, size, parts):
+    data = recording.read_bytes()[:size]
+    recording.write_bytes(data)
+    s3_key = index.s3_key_for(recording.name)
+    scheduler._upload_file(str(recording), sha256=sha256_of(data))
+    assert not recording.exists()
+    assert scheduler.storage.get(s3_key) == data
+    head = scheduler.storage.head(s3_key)
+    assert head['metadata'] == {index.CHECKSUM_METADATA_KEY: sha256_of(data)}
+    # S3 reports a multipart object's checksum as a hash of its part hashes
+    checksum = index.UploadChecksum()
+    for offset in range(0, size, PART_SIZE):
+        checksum.add_part(data[offset:offset + PART_SIZE])
+    assert head['checksum'] == (f"{checksum.s3_checksum(True)}-{parts}" if parts > 1 else checksum.s3_checksum(False))
+    assert scheduler.verify_object(s3_key, size, sha256_of(data), checksum.s3_checksum(parts > 1))
+
+def test_verify_object_rejects_mismatches(scheduler, recording):
+    data = recording.read_bytes()
+    s3_key = index.s3_key_for(recording.name)
+    checksum = scheduler._put_file(str(recording), s3_key, None)
+    assert scheduler.verify_object(s3_key, len(data), sha256_of(data), checksum.s3_checksum(True))
+    assert not scheduler.verify_object(s3_key, len(data) + 1, sha256_of(data))
+    assert not scheduler.verify_object(s3_key, len(data), sha256_of(b'other'))
+    assert not scheduler.verify_object(s3_key, len(data), sha256_of(data), checksum.s3_checksum(False))
+    assert not scheduler.verify_object(index.s3_key_for('missing.mp4'), len(data), None)
+
+@pytest.mark.parametrize('size', [PART_SIZE, 3 * PART_SIZE])
+def test_file_changed_after_hashing_is_requeued(scheduler, recording, size):
+    data = recording.read_bytes()[:size]
+    recording.write_bytes(data)
+    s3_key = index.s3_key_for(recording.name)
+    scheduler._upload_file(str(recording), sha256=sha256_of(b'what was recorded before'))
+    assert recording.read_bytes() == data
+    assert scheduler.storage.head(s3_key) is None
+    file_path, queued_key, delete_after, sha256, _, _ = scheduler.upload_queue.get_nowait()
+    # The retry hashes the file again instead of trusting the stale hash
+    assert (file_path, queued_key, delete_after, sha256) == (str(recording), s3_key, True, None)
+
+def test_is_uploaded_matches_size_and_hash(scheduler, recording):
+    data = recording.read_bytes()
+    s3_key = index.s3_key_for(recording.name)
+    assert not scheduler.is_uploaded(str(recording))
+    scheduler.storage.put(s3_key, data[:-1], metadata={index.CHECKSUM_METADATA_KEY: sha256_of(data[:-1])})
+    assert not scheduler.is_uploaded(str(recording))
+    changed = data[:-1] + b'\0'
+    scheduler.storage.put(s3_key, changed, metadata={index.CHECKSUM_METADATA_KEY: sha256_of(changed)})
+    assert not scheduler.is_uploaded(str(recording))
+    scheduler.storage.put(s3_key, data, metadata={index.CHECKSUM_METADATA_KEY: sha256_of(data)})
+    assert scheduler.is_uploaded(str(recording))
+
+def test_is_uploaded_without_hash_compares_size(scheduler, recording):
+    data = recording.read_bytes()
+    scheduler.storage.put(index.s3_key_for(recording.name), data[:-1] + b'\0')
+    assert scheduler.is_uploaded(str(recording))
+
+def test_is_uploaded_accepts_tier_copy_of_this_file(scheduler, recording):
+    data = recording.read_bytes()
+    s3_key = index.s3_key_for(recording.name)
+    metadata = {index.TIER_METADATA_KEY: 'cloud', index.CHECKSUM_METADATA_KEY: sha256_of(b'small')}
+    scheduler.storage.put(s3_key, b'small', metadata={**metadata, index.SOURCE_CHECKSUM_METADATA_KEY: sha256_of(data)})
+    assert scheduler.is_uploaded(str(recording))
+    scheduler.storage.put(s3_key, b'small', metadata={**metadata, index.SOURCE_CHECKSUM_METADATA_KEY: sha256_of(b'other')})
+    assert not scheduler.is_uploaded(str(recording))
@@ -0,0 +1,240 @@
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+
+# ------------------- Timeline Configuration -------------------
+TIMELINE_FILE = 'timeline.sqlite'
+TIMELINE_CACHE_DIR = os.path.join('download_video', 'timeline')  # where --remote keeps each host's timeline
+EVENT_TYPES = ['segment', 'gap', 'motion', 'bitrate', 'health', 'quality']
+# Entry field stored as an event's value, so queries can filter on it
+VALUE_FIELDS = {'segment': 'quality_tier', 'motion': 'score', 'bitrate': 'peak_kbps', 'quality': 'to_tier'}
+WEEKDAYS = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    camera TEXT NOT NULL,
+    type TEXT NOT NULL,
+    start_ms INTEGER NOT NULL,
+    end_ms INTEGER NOT NULL,
+    value NUMERIC,
+    detail TEXT,
+    UNIQUE (camera, type, start_ms, end_ms)
+);
+CREATE INDEX IF NOT EXISTS events_by_camera ON events (camera, type, start_ms);
+CREATE INDEX IF NOT EXISTS events_by_type ON events (type, start_ms);
+CREATE INDEX IF NOT EXISTS events_by_time ON events (start_ms);
+CREATE TABLE IF NOT EXISTS spans (
+    type TEXT PRIMARY KEY,
+    longest_ms INTEGER NOT NULL
+);
+"""
+
+# ------------------- Timeline -------------------
+def event_from_entry(entry):
+    """(camera, type, start_ms, end_ms, value, detail) row for a recording index entry"""
+    start_ms = entry.get('start_ms', entry.get('time_ms'))
+    end_ms = entry.get('end_ms', start_ms)
+    value_field = VALUE_FIELDS.get(entry['type'])
+    detail = {key: value for key, value in entry.items()
+              if key not in ('type', 'camera', 'start_ms', 'end_ms', 'time_ms', value_field)}
+    return (entry.get('camera') or '', entry['type'], int(start_ms), int(end_ms),
+            entry.get(value_field), json.dumps(detail) if detail else None)
+
+class Timeline:
+    """SQLite index of what happened when on each camera.
+
+    Holds the recording index's segments, gaps, motion, bitrate spikes,
+    health and quality changes as (camera, type, start_ms, end_ms, value)
+    rows; instants have start_ms == end_ms. The longest event of each type
+    is kept in `spans`, so an overlap query can bound its index range scan
+    and stays in the millisecond range however much history there is.
+    Adding an event that is already there does nothing, so history can be
+    imported again safely. The database is opened on first use.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.connection = None
+        self.lock = threading.Lock()
+
+    def _connect(self):
+        if self.connection is None:
+            self.connection = sqlite3.connect(self.path, check_same_thread=False)
+            self.connection.execute('PRAGMA journal_mode=WAL')
+            self.connection.execute('PRAGMA synchronous=NORMAL')
+            self.connection.executescript(SCHEMA)
+        return self.connection
+
+    def add_entries(self, entries):
+        rows = [event_from_entry(entry) for entry in entries if entry.get('type') in EVENT_TYPES]
+        if not rows:
+            return
+        with self.lock:
+            connection = self._connect()
+            with connection:
+                connection.executemany('INSERT OR IGNORE INTO events VALUES (?, ?, ?, ?, ?, ?)', rows)
+                connection.executemany(
+                    'INSERT INTO spans VALUES (?, ?) '
+                    'ON CONFLICT (type) DO UPDATE SET longest_ms = MAX(longest_ms, excluded.longest_ms)',
+                    [(row[1], row[3] - row[2]) for row in rows])
+
+    def is_empty(self):
+        with self.lock:
+            return self._connect().execute('SELECT 1 FROM events LIMIT 1').fetchone() is None
+
+    def query(self, start_ms, end_ms, camera=None, event_type=None, min_value=None):
+        """Events overlapping start_ms..end_ms, oldest first, as recording index entries"""
+        with self.lock:
+            connection = self._connect()
+            if event_type:
+                longest = connection.execute('SELECT longest_ms FROM spans WHERE type = ?', (event_type,)).fetchone()
+            else:
+                longest = connection.execute('SELECT MAX(longest_ms) FROM spans').fetchone()
+            if not longest or longest[0] is None:
+                return []
+            sql = 'SELECT camera, type, start_ms, end_ms, value, detail FROM events WHERE start_ms BETWEEN ? AND ? AND end_ms >= ?'
+            params = [start_ms - longest[0], end_ms, start_ms]
+            if camera:
+                sql += ' AND camera = ?'
+                params.append(camera)
+            if event_type:
+                sql += ' AND type = ?'
+                params.append(event_type)
+            if min_value is not None:
+                sql += ' AND value >= ?'
+                params.append(min_value)
+            rows = connection.execute(sql + ' ORDER BY start_ms', params).fetchall()
+        events = []
+        for camera_id, row_type, row_start, row_end, value, detail in rows:
+            event = {'type': row_type, 'camera': camera_id, 'start_ms': row_start, 'end_ms': row_end}
+            if row_type in VALUE_FIELDS:
+                event[VALUE_FIELDS[row_type]] = value
+            event.update(json.loads(detail) if detail else {})
+            events.append(event)
+        return events
+
+    def snapshot(self, path):
+        """Write a consistent copy of the timeline to path, replacing it atomically"""
+        temp_path = f"{path}.tmp"
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        target = sqlite3.connect(temp_path)
+        try:
+            with self.lock:
+                self._connect().backup(target)
+        finally:
+            target.close()
+        os.replace(temp_path, path)
+
+    def close(self):
+        with self.lock:
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
+
+# ------------------- Query Helpers -------------------
+def parse_day(text, today=None):
+    """Midnight of 'today', 'yesterday', a weekday ('tuesday', 'last tuesday') or YYYY-MM-DD"""
+    today = (today or datetime.now()).replace(hour=0, minute=0, second=0, microsecond=0)
+    text = text.strip().lower()
+    if text == 'today':
+        return today
+    if text == 'yesterday':
+        return today - timedelta(days=1)
+    name = text[len('last '):] if text.startswith('last ') else text
+    if name in WEEKDAYS:
+        days_back = (today.weekday() - WEEKDAYS.index(name)) % 7
+        # "last tuesday" on a Tuesday means a week ago; plain "tuesday" means today
+        if days_back == 0 and text.startswith('last '):
+            days_back = 7
+        return today - timedelta(days=days_back)
+    return datetime.strptime(text, '%Y-%m-%d')
+
+def parse_time(text):
+    """Epoch milliseconds from epoch milliseconds or an ISO date/time"""
+    if text.isdigit():
+        return int(text)
+    return int(datetime.fromisoformat(text).timestamp() * 1000)
+
+def fetch_remote_timelines():
+    """Download every host's timeline from S3; returns their local paths"""
+    import downloader  # only needed with --remote
+    storage = downloader.get_storage()
+    if storage is None:
+        return []
+    os.makedirs(TIMELINE_CACHE_DIR, exist_ok=True)
+    paths = []
+    for key in downloader.list_keys(f"{downloader.PREFIX}index/")[0]:
+        if not key.endswith('.sqlite'):
+            continue
+        path = os.path.join(TIMELINE_CACHE_DIR, os.path.basename(key))
+        try:
+            storage.download(key, path)
+            paths.append(path)
+        except Exception as e:
+            print(f"Error downloading timeline {key}: {e}")
+    return paths
+
+def describe(event):
+    start = datetime.fromtimestamp(event['start_ms'] / 1000)
+    end = datetime.fromtimestamp(event['end_ms'] / 1000)
+    when = start.strftime('%Y-%m-%d %H:%M:%S')
+    if event['end_ms'] != event['start_ms']:
+        when += f" - {end.strftime('%H:%M:%S' if end.date() == start.date() else '%Y-%m-%d %H:%M:%S')}"
+    details = ', '.join(f"{key}={value}" for key, value in event.items()
+                        if key not in ('type', 'camera', 'start_ms', 'end_ms') and value is not None)
+    return f"{when}  {event['camera']:<12} {event['type']:<8} {details}"
+
+# ------------------- Main -------------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Search the event timeline: segments, gaps, motion, bitrate spikes, health and quality changes.")
+    parser.add_argument('type', nargs='?', choices=EVENT_TYPES, help='event type (default: all)')
+    parser.add_argument('--camera', help='camera id, e.g. cam-2')
+    parser.add_argument('--day', help="'today', 'yesterday', a weekday such as 'last tuesday', or YYYY-MM-DD")
+    parser.add_argument('--from', dest='start', help='start as epoch ms or ISO date/time')
+    parser.add_argument('--to', dest='end', help='end as epoch ms or ISO date/time (default: now)')
+    parser.add_argument('--min-value', type=float, help='only events whose value (motion score, peak kbps, tier) is at least this')
+    parser.add_argument('--db', action='append', help=f'timeline file to search; may be repeated (default: {TIMELINE_FILE})')
+    parser.add_argument('--remote', action='store_true', help="search every host's timeline synced to S3")
+    parser.add_argument('--json', action='store_true', help='print events as JSON lines')
+    args = parser.parse_args(argv)
+
+    try:
+        if args.day:
+            start = parse_day(args.day)
+            start_ms = int(start.timestamp() * 1000)
+            end_ms = int((start + timedelta(days=1)).timestamp() * 1000)
+        else:
+            start_ms = parse_time(args.start) if args.start else 0
+            end_ms = parse_time(args.end) if args.end else int(time.time() * 1000)
+    except ValueError as e:
+        print(f"Invalid time: {e}")
+        return 1
+    paths = fetch_remote_timelines() if args.remote else (args.db or [TIMELINE_FILE])
+    started = time.perf_counter()
+    events = []
+    for path in paths:
+        if not os.path.exists(path):
+            print(f"Timeline not found: {path}")
+            continue
+        timeline = Timeline(path)
+        try:
+            events.extend(timeline.query(start_ms, end_ms, args.camera, args.type, args.min_value))
+        except sqlite3.Error as e:
+            print(f"Error reading timeline {path}: {e}")
+        finally:
+            timeline.close()
+    events.sort(key=lambda event: event['start_ms'])
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    for event in events:
+        print(json.dumps(event) if args.json else describe(event))
+    if not args.json:
+        print(f"{len(events)} event(s) in {elapsed_ms:.1f} ms")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,238 @@
+import atexit
+import itertools
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from functools import wraps
+
+# ------------------- Tracing Configuration -------------------
+TRACE_MAX_EVENTS = 1_000_000   # events kept in memory; later ones are counted and dropped
+PROFILE_INTERVAL = 0.01        # seconds between stack samples
+PROFILE_MAX_DEPTH = 64         # outermost frames kept per sampled stack
+TRACK_TID_BASE = 1_000_000     # ids of named tracks, above any real thread id
+
+# ------------------- Tracer -------------------
+class Tracer:
+    """Collects timing spans as Chrome trace events and writes them to one JSON file.
+
+    The file opens in chrome://tracing, ui.perfetto.dev and speedscope.
+    Spans are complete ('X') events on the thread that ran them. Waits that
+    start on one thread and end on another, such as time spent in the upload
+    queue, overlap freely, so they are written as async ('b'/'e') events.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.pid = os.getpid()
+        self.origin = time.perf_counter()
+        self.started = time.strftime('%Y-%m-%dT%H:%M:%S')
+        self.events = []
+        self.dropped = 0
+        self.named_tids = set()
+        self.tracks = {}
+        self.async_ids = itertools.count(1)
+        self.lock = threading.Lock()
+
+    def _timestamp(self, clock):
+        """Microseconds since the tracer started, for a time.perf_counter() value"""
+        return round((clock - self.origin) * 1e6, 1)
+
+    def _add(self, event):
+        with self.lock:
+            if len(self.events) >= TRACE_MAX_EVENTS:
+                self.dropped += 1
+                return
+            self.events.append(event)
+
+    def _name_tid(self, tid, name):
+        with self.lock:
+            if tid in self.named_tids:
+                return
+            self.named_tids.add(tid)
+            self.events.append({'name': 'thread_name', 'ph': 'M', 'pid': self.pid, 'tid': tid, 'args': {'name': name}})
+
+    def thread_tid(self):
+        tid = threading.get_native_id()
+        self._name_tid(tid, threading.current_thread().name)
+        return tid
+
+    def track_tid(self, track):
+        """Id of a named track that is not a real thread, such as a thread's sampled stacks"""
+        with self.lock:
+            tid = self.tracks.setdefault(track, TRACK_TID_BASE + len(self.tracks))
+        self._name_tid(tid, track)
+        return tid
+
+    def complete(self, name, start, end, category, args=None, track=None):
+        tid = self.track_tid(track) if track else self.thread_tid()
+        event = {'name': name, 'cat': category, 'ph': 'X', 'pid': self.pid, 'tid': tid,
+                 'ts': self._timestamp(start), 'dur': round((end - start) * 1e6, 1)}
+        if args:
+            event['args'] = args
+        self._add(event)
+
+    def interval(self, name, start, end, category, args=None):
+        event_id = next(self.async_ids)
+        tid = self.thread_tid()
+        begin = {'name': name, 'cat': category, 'ph': 'b', 'id': event_id, 'pid': self.pid, 'tid': tid,
+                 'ts': self._timestamp(start)}
+        if args:
+            begin['args'] = args
+        self._add(begin)
+        self._add({'name': name, 'cat': category, 'ph': 'e', 'id': event_id, 'pid': self.pid, 'tid': tid,
+                   'ts': self._timestamp(end)})
+
+    def save(self):
+        with self.lock:
+            events = list(self.events)
+            dropped = self.dropped
+        trace = {
+            'traceEvents': events,
+            'displayTimeUnit': 'ms',
+            'otherData': {'started': self.started, 'command': ' '.join(sys.argv), 'dropped_events': dropped}
+        }
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, 'w') as f:
+            json.dump(trace, f)
+        os.replace(temp_path, self.path)
+
+# ------------------- Sampling Profiler -------------------
+class StackSampler:
+    """Samples every thread's Python stack PROFILE_INTERVAL apart.
+
+    Consecutive samples that share a frame are merged into one span, so each
+    thread gets a '<thread> samples' track that reads as a flame chart
+    beside its real spans. Sampling costs a little CPU on every thread, so
+    it is off unless asked for.
+    """
+    def __init__(self, tracer):
+        self.tracer = tracer
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._run, name='trace sampler', daemon=True)
+        self.open_frames = {}
+        self.thread_names = {}
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        self.thread.join(timeout=2)
+
+    def _close(self, ident, frames, now):
+        track = f"{self.thread_names.get(ident, ident)} samples"
+        for frame_name, start in reversed(frames):
+            self.tracer.complete(frame_name, start, now, 'sample', track=track)
+
+    def _run(self):
+        while not self.stop_event.wait(PROFILE_INTERVAL):
+            now = time.perf_counter()
+            stacks = sys._current_frames()
+            self.thread_names.update((thread.ident, thread.name) for thread in threading.enumerate())
+            for ident, frame in stacks.items():
+                if ident == self.thread.ident:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack = stack[::-1][:PROFILE_MAX_DEPTH]
+                opened = self.open_frames.get(ident, [])
+                common = 0
+                while common < min(len(opened), len(stack)) and opened[common][0] == stack[common]:
+                    common += 1
+                self._close(ident, opened[common:], now)
+                self.open_frames[ident] = opened[:common] + [(frame_name, now) for frame_name in stack[common:]]
+            for ident in [ident for ident in self.open_frames if ident not in stacks]:
+                self._close(ident, self.open_frames.pop(ident), now)
+        now = time.perf_counter()
+        for ident, frames in self.open_frames.items():
+            self._close(ident, frames, now)
+        self.open_frames = {}
+
+# ------------------- Module Interface -------------------
+# Everything below is a cheap no-op until start() is called
+tracer = None
+sampler = None
+
+def clock():
+    return time.perf_counter()
+
+def enabled():
+    return tracer is not None
+
+def default_path(program):
+    return f"{program}_trace_{time.strftime('%Y%m%d_%H%M%S')}.json"
+
+def start(path, profile=False):
+    """Record spans from now on and write them to path at exit; profile adds stack sampling"""
+    global tracer, sampler
+    if tracer is not None:
+        return
+    tracer = Tracer(path)
+    if profile:
+        sampler = StackSampler(tracer)
+        sampler.start()
+    atexit.register(stop)
+
+def stop():
+    """Stop sampling and write the trace file"""
+    global tracer, sampler
+    if tracer is None:
+        return
+    if sampler is not None:
+        sampler.stop()
+        sampler = None
+    current, tracer = tracer, None
+    try:
+        current.save()
+        print(f"Trace written to {current.path} ({len(current.events)} events)")
+    except OSError as e:
+        print(f"Cannot write trace {current.path}: {e}")
+
+@contextmanager
+def _span(name, category, args):
+    start_time = time.perf_counter()
+    try:
+        yield args
+    except Exception as e:
+        args['error'] = repr(e)
+        raise
+    finally:
+        current = tracer
+        if current is not None:
+            current.complete(name, start_time, time.perf_counter(), category, args)
+
+def span(name, category='app', **args):
+    """Time a block on the current thread; the yielded dict can take more args"""
+    if tracer is None:
+        return nullcontext({})
+    return _span(name, category, args)
+
+def traced(name=None, category='app'):
+    """Decorator that times every call of a function as a span"""
+    def decorate(function):
+        span_name = name or function.__name__
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            if tracer is None:
+                return function(*args, **kwargs)
+            with _span(span_name, category, {}):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorate
+
+def complete(name, start_time, end_time=None, category='app', **args):
+    """Record a span on the current thread that started at a clock() value taken earlier"""
+    current = tracer
+    if current is not None:
+        current.complete(name, start_time, end_time or time.perf_counter(), category, args)
+
+def interval(name, start_time, end_time=None, category='app', **args):
+    """Record a wait that may overlap others, such as a file's time in a queue"""
+    current = tracer
+    if current is not None:
+        current.interval(name, start_time, end_time or time.perf_counter(), category, args)